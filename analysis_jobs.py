@@ -0,0 +1,323 @@
+"""
+Asynchronous audio-analysis jobs on a bounded pool of worker processes
+Keeps librosa work off the Flask request threads; no external broker needed
+"""
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from multiprocessing.connection import Connection
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis_worker.py')
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class Job:
+    """State of one submitted analysis"""
+
+    def __init__(self, audio_bytes, filename, context=None, mode='full'):
+        self.id = uuid.uuid4().hex
+        self.audio_bytes = audio_bytes
+        self.filename = filename
+        self.mode = mode
+        self.context = context
+        self.timings = {}
+        self.status = 'queued'  # queued -> running -> done | failed | timeout | cancelled
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.done = threading.Event()
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.audio_bytes = None  # Free the upload as soon as possible
+        self.done.set()
+
+    def to_dict(self):
+        now = time.time()
+        info = {
+            'job_id': self.id,
+            'status': self.status,
+            'mode': self.mode,
+            'queued_sec': round((self.started or self.finished or now) - self.created, 3),
+        }
+        if self.started:
+            info['run_sec'] = round((self.finished or now) - self.started, 3)
+        if self.status == 'done':
+            info['result'] = self.result
+        elif self.error:
+            info['error'] = self.error
+        return info
+
+
+class _WorkerSlot(threading.Thread):
+    """
+    Owns one worker process and feeds it jobs from the shared queue
+
+    The slot thread polls its process while a job runs so it can honour the
+    timeout and cancellation by terminating the process and starting a fresh
+    one; ProcessPoolExecutor cannot stop a task once it has started.
+    """
+
+    def __init__(self, pool, index):
+        super().__init__(name=f'analysis-slot-{index}', daemon=True)
+        self.pool = pool
+        self.process = None
+        self.conn = None
+
+    def _start_process(self):
+        # A fresh interpreter rather than a fork of the threaded server: the
+        # worker inherits no locks, threads or model, and imports only the analyzer
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, str(child_sock.fileno()),
+                 str(self.pool.sample_rate), self.pool.resample_quality,
+                 '1' if self.pool.warm_up else '0'],
+                pass_fds=(child_sock.fileno(),))
+        finally:
+            child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+
+    def _restart_process(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.conn.close()
+        self._start_process()
+
+    def run(self):
+        self._start_process()
+        while True:
+            job = self.pool._queue.get()
+            if job is None:
+                self.conn.send(None)
+                return
+            if not self.pool._start_job(job):
+                continue  # Cancelled while queued
+
+            deadline = job.started + self.pool.job_timeout
+            try:
+                self.conn.send((job.id, job.audio_bytes, job.filename, job.mode))
+            except OSError:
+                self._restart_process()
+                self.pool._record(job, 'failed', error='Worker process unavailable')
+                continue
+
+            while True:
+                if self.conn.poll(0.05):
+                    try:
+                        _, features, error, job.timings = self.conn.recv()
+                    except EOFError:
+                        features, error = None, 'Worker process exited'
+                        self._restart_process()
+                    if job.timings and self.pool.on_timings:
+                        self.pool.on_timings(job.timings)
+                    if error or features is None:
+                        self.pool._record(job, 'failed', error=error or 'Analysis failed')
+                    else:
+                        self.pool._complete(job, features)
+                    break
+                if job.cancel_requested:
+                    self._restart_process()
+                    self.pool._record(job, 'cancelled', error='Cancelled while running')
+                    break
+                if time.time() > deadline:
+                    self._restart_process()
+                    self.pool._record(job, 'timeout',
+                                      error=f'Timed out after {self.pool.job_timeout}s')
+                    break
+                if self.process.poll() is not None:
+                    self._restart_process()
+                    self.pool._record(job, 'failed', error='Worker process died')
+                    break
+
+
+class AnalysisJobQueue:
+    """
+    Bounded queue of audio-analysis jobs served by worker processes
+
+    Args:
+        workers (int): Concurrent analyses (one process each)
+        max_queued (int): Jobs allowed to wait; submit() raises QueueFullError past this
+        job_timeout (float): Seconds a job may run before its worker is killed
+        result_ttl (float): Seconds finished jobs stay available for polling
+        postprocess (callable): postprocess(features, context) runs in the
+            server process on success and returns the stored result
+        sample_rate (int): Analysis sample rate for the workers
+        resample_quality (str): soxr preset for the workers, see audio_decode.py
+        on_timings (callable): Receives each job's per-stage wall times (seconds)
+        warm_up (bool): Have each worker analyze a synthetic clip before its first job
+    """
+
+    def __init__(self, workers=2, max_queued=16, job_timeout=120.0, result_ttl=600.0,
+                 postprocess=None, sample_rate=22050, resample_quality='HQ', on_timings=None,
+                 warm_up=False):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.postprocess = postprocess
+        self.sample_rate = sample_rate
+        self.resample_quality = resample_quality
+        self.on_timings = on_timings
+        self.warm_up = warm_up
+
+        # Unbounded: capacity is the number of live queued jobs (_waiting), so
+        # jobs cancelled while queued free their place at once and are skipped
+        self._queue = queue.Queue()
+        self._waiting = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = []
+        self._counts = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0,
+                        'timeout': 0, 'cancelled': 0}
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._started_jobs = 0
+
+    def _ensure_started(self):
+        # Workers are spawned on first use so importing the app stays cheap
+        if not self._slots:
+            self._slots = [_WorkerSlot(self, i) for i in range(self.workers)]
+            for slot in self._slots:
+                slot.start()
+
+    def submit(self, audio_bytes, filename, context=None, mode='full'):
+        """
+        Queue audio for analysis
+
+        Args:
+            audio_bytes (bytes): Encoded audio file contents
+            filename (str): Original name, used to pick a decoder
+            context: Passed through to postprocess with the features
+            mode (str): 'full' or 'fast' analysis
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            QueueFullError: If max_queued jobs are already waiting
+        """
+        job = Job(audio_bytes, filename, context, mode)
+        with self._lock:
+            self._ensure_started()
+            self._purge_expired()
+            if self._waiting >= self.max_queued:
+                self._counts['rejected'] += 1
+                raise QueueFullError(f'Analysis queue is full ({self.max_queued} waiting)')
+            self._waiting += 1
+            self._jobs[job.id] = job
+            self._counts['submitted'] += 1
+        self._queue.put(job)
+        return job
+
+    def add_finished(self, result, mode='full'):
+        """Register an already-available result (e.g. a cache hit) as a done job"""
+        job = Job(None, None, mode=mode)
+        job.started = job.created
+        job.finish('done', result=result)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """Long-poll: block up to timeout seconds for the job to finish"""
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job; returns the job, or None if unknown
+
+        A queued job is cancelled at once and its worker slot skips it. A
+        running job is stopped by its slot, which restarts the worker process.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return job
+            if job.status == 'queued':
+                self._waiting -= 1
+                job.finish('cancelled', error='Cancelled before start')
+                self._counts['cancelled'] += 1
+            else:
+                job.cancel_requested = True
+        return job
+
+    def _start_job(self, job):
+        """Move a job from queued to running; False if it was cancelled meanwhile"""
+        with self._lock:
+            if job.status != 'queued':
+                return False
+            self._waiting -= 1
+            job.status = 'running'
+            job.started = time.time()
+        return True
+
+    def _complete(self, job, features):
+        try:
+            result = self.postprocess(features, job.context) if self.postprocess else features
+        except Exception as e:
+            self._record(job, 'failed', error=f'Postprocessing failed: {e}')
+            return
+        self._record(job, 'done', result=result)
+
+    def _record(self, job, status, result=None, error=None):
+        job.finish(status, result=result, error=error)
+        with self._lock:
+            self._counts[status] += 1
+            if job.started:
+                self._started_jobs += 1
+                self._total_wait += job.started - job.created
+                self._total_run += job.finished - job.started
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        """Queue depth, running jobs, outcome counts and mean wait/run times"""
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == 'running')
+            started = self._started_jobs
+            return {
+                'workers': self.workers,
+                'queue_depth': self._waiting,
+                'max_queued': self.max_queued,
+                'running': running,
+                'mean_wait_sec': round(self._total_wait / started, 3) if started else 0.0,
+                'mean_run_sec': round(self._total_run / started, 3) if started else 0.0,
+                **self._counts,
+            }
+
+    def shutdown(self):
+        for _ in self._slots:
+            self._queue.put(None)
+        for slot in self._slots:
+            slot.join(timeout=5)
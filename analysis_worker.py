@@ -0,0 +1,44 @@
+"""
+Worker process entry point for analysis_jobs.py
+Imports only the audio analyzer, never the server, its model or its threads
+
+Started by AnalysisJobQueue as a fresh interpreter:
+    python analysis_worker.py <socket fd> <sample rate> <resample quality> <warm up 0|1>
+"""
+import io
+import sys
+from multiprocessing.connection import Connection
+
+from audio_analyzer import SpotifyAudioAnalyzer
+from metrics import StageTimer
+
+
+def worker_main(conn, sample_rate, resample_quality='HQ', warm_up=False):
+    """Worker process loop: analyze (job_id, audio_bytes, filename, mode) requests"""
+    analyzer = SpotifyAudioAnalyzer(sample_rate=sample_rate, resample_quality=resample_quality)
+    if warm_up:
+        analyzer.warm_up()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        job_id, audio_bytes, filename, mode = request
+        timer = StageTimer()
+        try:
+            if mode == 'fast':
+                features = analyzer.analyze_audio_preview(io.BytesIO(audio_bytes), filename,
+                                                          timer=timer)
+            else:
+                y, sr = analyzer.load_audio_bytes(audio_bytes, filename, timer=timer)
+                features = analyzer.analyze_signal(y, sr, timer=timer)
+            conn.send((job_id, features, None, timer.timings))
+        except Exception as e:
+            conn.send((job_id, None, f'{type(e).__name__}: {e}', timer.timings))
+
+
+if __name__ == '__main__':
+    worker_main(Connection(int(sys.argv[1])), int(sys.argv[2]), resample_quality=sys.argv[3],
+                warm_up=sys.argv[4] == '1')
@@ -1,49 +1,562 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify
 import pandas as pd
 import numpy as np
 import joblib
 import os
-from werkzeug.utils import secure_filename
-from audio_analyzer import SpotifyAudioAnalyzer
+import threading
+import time
+from analysis_jobs import AnalysisJobQueue, QueueFullError
+from audio_analyzer import ANALYSIS_MODES, SpotifyAudioAnalyzer
+from audio_decode import FORMAT_DECODERS
+from catalog_scores import SCORES_DIR, load_current_scores
+from dataset_snapshot import FEATURE_NAMES, load_dataset, load_snapshot
+from feature_cache import FeatureCache
+from forest_engine import ENGINE_DIR, load_engine
+from metrics import NULL_TIMER, REGISTRY, StageTimer
+from prediction_cache import FileWatcher, PredictionCache, quantize_features, row_keys
+from sensitivity import SensitivityCurves, feature_grids
+from similarity_index import INDEX_DIR, SimilarityIndex, load_or_build_index, scaled_catalog
+from song_index import SongIndex
+from song_sampler import SongSampler
 
 app = Flask(__name__)
+started_at = time.perf_counter()  # /api/ready reports times relative to this
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['FEATURE_CACHE_DIR'] = 'cache/features'
+app.config['FEATURE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+app.config['MAX_BATCH_SIZE'] = 50000  # Records per /api/predict_batch request
+app.config['USE_FOREST_ENGINE'] = True
+app.config['FOREST_ENGINE_MAX_ROWS'] = 256  # Larger batches go to sklearn's C loop
+# Serve every prediction from the memory-mapped forest engine and skip
+# unpickling the sklearn forest, so worker processes share the tree arrays
+# through the page cache (set by serve.py --share mmap)
+app.config['MODEL_MMAP'] = os.environ.get('SPOTIFY_MODEL_MMAP', '') == '1'
+# Set by serve.py once its parent process has built or checked the dataset
+# snapshot, forest engine and similarity index: open them without re-checking
+app.config['ARTIFACTS_PREPARED'] = os.environ.get('SPOTIFY_ARTIFACTS_PREPARED', '') == '1'
+app.config['ANALYSIS_WORKERS'] = 2  # Concurrent /api/jobs analyses (one process each)
+app.config['ANALYSIS_QUEUE_SIZE'] = 16  # Waiting jobs before /api/jobs returns 429
+app.config['ANALYSIS_JOB_TIMEOUT'] = 120  # Seconds before a running job is killed
+app.config['JOB_LONG_POLL_MAX'] = 30  # Upper bound for ?wait= on job status
+app.config['DEFAULT_ANALYSIS_MODE'] = 'full'  # 'fast' analyzes excerpts; see ?mode=
+app.config['METRICS_ENABLED'] = True  # Latency histograms and counters for /metrics
+app.config['SIMILAR_NPROBE'] = 16  # IVF lists searched per /api/similar query (recall vs latency)
+app.config['SIMILAR_MAX_K'] = 100
+app.config['UPLOAD_DEFAULT_YEAR'] = 2023  # Features audio cannot provide, unless ?year=/?genre=
+app.config['UPLOAD_DEFAULT_GENRE'] = 'pop'
+app.config['MAX_SCORED_YEARS'] = 100  # Longest ?years= range scored per upload
+app.config['SENSITIVITY_CACHE_SIZE'] = 1024  # Base records with cached /api/sensitivity curves
+app.config['PREDICTION_CACHE_ENABLED'] = True  # /api/predict results cached by quantized features
+app.config['PREDICTION_CACHE_SIZE'] = 50000
+app.config['PREDICTION_CACHE_TTL'] = 3600  # Seconds; None keeps entries until evicted
+app.config['MODEL_CHECK_INTERVAL'] = 2.0  # Seconds between checks for changed model files
+app.config['CATALOG_SCORES_DIR'] = SCORES_DIR  # Precomputed predictions from catalog_scores.py
+# Analyze a synthetic clip and score it once at startup, off the request path,
+# so the first real upload does not pay for librosa/numba first-use costs
+app.config['WARMUP_ON_START'] = os.environ.get('SPOTIFY_WARMUP', '1') != '0'
 
-# Create uploads directory
-os.makedirs('uploads', exist_ok=True)
+# Metrics served by /metrics (per process; scrape each worker under serve.py)
+REQUEST_LATENCY = REGISTRY.histogram('http_request_duration_seconds',
+                                     'Request latency by endpoint', ['endpoint', 'method'])
+REQUESTS = REGISTRY.counter('http_requests_total', 'Requests by endpoint and status',
+                            ['endpoint', 'method', 'status'])
+REQUEST_ERRORS = REGISTRY.counter('http_request_errors_total',
+                                  'Requests answered with a 5xx status', ['endpoint'])
+MODEL_LATENCY = REGISTRY.histogram('model_call_duration_seconds',
+                                   'Scaler and model call latency', ['backend', 'step'])
+MODEL_ROWS = REGISTRY.counter('model_predicted_rows_total', 'Rows scored', ['backend'])
+ANALYSIS_STAGE_LATENCY = REGISTRY.histogram('audio_analysis_stage_duration_seconds',
+                                            'Wall time per audio analysis stage', ['stage'])
 
 # Allowed audio file extensions
-ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'm4a', 'aac', 'ogg'}
+ALLOWED_EXTENSIONS = set(FORMAT_DECODERS)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def build_feature_matrix(records):
+    """
+    Build the model input matrix from feature records
+    
+    Args:
+        records (list): Dicts holding at least every name in FEATURE_NAMES
+        
+    Returns:
+        np.ndarray: C-contiguous float64 array of shape (len(records), 15)
+        
+    Raises:
+        ValueError: If a record is missing a feature or has a non-numeric value
+    """
+    try:
+        matrix = np.array([[record[name] for name in FEATURE_NAMES] for record in records],
+                          dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        # Slow path only to produce a useful error message
+        for i, record in enumerate(records):
+            if not isinstance(record, dict):
+                raise ValueError(f"Record {i} is not an object")
+            missing = [name for name in FEATURE_NAMES if name not in record]
+            if missing:
+                raise ValueError(f"Record {i} is missing features: {', '.join(missing)}")
+            for name in FEATURE_NAMES:
+                try:
+                    float(record[name])
+                except (TypeError, ValueError):
+                    raise ValueError(f"Record {i} has a non-numeric {name}: {record[name]!r}")
+        raise
+    
+    matrix = matrix.reshape(len(records), len(FEATURE_NAMES))
+    if not np.isfinite(matrix).all():
+        row = int(np.flatnonzero(~np.isfinite(matrix).all(axis=1))[0])
+        raise ValueError(f"Record {row} has a non-finite feature value")
+    return matrix
+
+def predict_popularity(feature_matrix):
+    """Scale and score a feature matrix in one call, clipped to 0-100"""
+    timed = app.config['METRICS_ENABLED']
+    # One consistent set of model objects even if a reload swaps them meanwhile
+    with model_swap_lock:
+        engine, model_, scaler_ = forest_engine, model, scaler
+    if engine is not None and (model_ is None or
+                               len(feature_matrix) <= app.config['FOREST_ENGINE_MAX_ROWS']):
+        # Scaler is folded into the engine's thresholds; same output as sklearn
+        start = time.perf_counter()
+        predictions = engine.predict(feature_matrix)
+        if timed:
+            MODEL_LATENCY.observe(time.perf_counter() - start, backend='engine', step='predict')
+            MODEL_ROWS.inc(len(feature_matrix), backend='engine')
+        return np.clip(predictions, 0, 100)
+    start = time.perf_counter()
+    scaled = scaler_.transform(feature_matrix)
+    scaled_at = time.perf_counter()
+    predictions = model_.predict(scaled)
+    if timed:
+        MODEL_LATENCY.observe(scaled_at - start, backend='sklearn', step='scale')
+        MODEL_LATENCY.observe(time.perf_counter() - scaled_at, backend='sklearn', step='predict')
+        MODEL_ROWS.inc(len(feature_matrix), backend='sklearn')
+    return np.clip(predictions, 0, 100)
+
+def load_models(verify=True):
+    """Scaler, forest engine and sklearn model from disk, as configured"""
+    scaler = joblib.load('spotify_scaler.pkl')
+    
+    # Array-backed forest from forest_engine.py, used when built for these pickles
+    if app.config['MODEL_MMAP']:
+        forest_engine = load_engine(mmap_mode='r', verify=verify)
+    elif app.config['USE_FOREST_ENGINE']:
+        forest_engine = load_engine(verify=verify)
+    else:
+        forest_engine = None
+    
+    if app.config['MODEL_MMAP'] and forest_engine is not None:
+        model = None  # The engine gives identical predictions for any batch size
+    else:
+        if app.config['MODEL_MMAP']:
+            print("No current forest engine; MODEL_MMAP falls back to the sklearn model")
+        model = joblib.load('spotify_popularity_model.pkl')
+    return scaler, forest_engine, model
+
+# Held while the model objects are read or replaced together
+model_swap_lock = threading.Lock()
+
 # Load model and data
 try:
-    model = joblib.load('spotify_popularity_model.pkl')
-    scaler = joblib.load('spotify_scaler.pkl')
+    scaler, forest_engine, model = load_models(verify=not app.config['ARTIFACTS_PREPARED'])
     genre_encoder = joblib.load('spotify_genre_encoder.pkl')
     
-    # Load data
-    data = pd.read_csv('data/spotify_data.csv')
-    data = data.dropna(subset=['artist_name', 'track_name'])
-    data = data[data['popularity'] > 0]
-    data['duration_min'] = data['duration_ms'] / 60000
-    
-    # Filter valid genres
-    genre_counts = data['genre'].value_counts()
-    valid_genres = genre_counts[genre_counts >= 1000].index.tolist()
-    data = data[data['genre'].isin(valid_genres)]
-    data['genre_encoded'] = genre_encoder.transform(data['genre'])
+    # Load the cleaned, encoded dataset from its memory-mapped snapshot
+    # (rebuilt from data/spotify_data.csv only when the CSV or encoder changes)
+    if app.config['ARTIFACTS_PREPARED']:
+        data = load_snapshot()
+    else:
+        data = load_dataset()
+    song_index = SongIndex(data)
     
     print("Model and data loaded successfully!")
 except Exception as e:
     print(f"Error loading model: {e}")
-    model = scaler = genre_encoder = data = None
+    model = scaler = genre_encoder = data = song_index = forest_engine = None
+
+# The sampler pre-serializes every row, so build it off the startup path;
+# /api/songs falls back to DataFrame sampling until it is ready
+song_sampler = None
+
+def build_song_sampler():
+    global song_sampler
+    song_sampler = SongSampler(data)
+
+song_sampler_thread = threading.Thread(target=build_song_sampler, daemon=True)
+if data is not None:
+    song_sampler_thread.start()
+
+# Nearest-neighbour index for /api/similar, loaded from disk (built on first run)
+similarity_index = None
+
+def build_similarity_index():
+    global similarity_index
+    if app.config['ARTIFACTS_PREPARED']:
+        similarity_index = SimilarityIndex.load(INDEX_DIR, mmap_mode='r')
+    else:
+        similarity_index = load_or_build_index(data, scaler)
+
+similarity_index_thread = threading.Thread(target=build_similarity_index, daemon=True)
+if data is not None:
+    similarity_index_thread.start()
 
-# Initialize audio analyzer
+# /api/sensitivity curves; grids come from the catalog on first use
+sensitivity_curves = None
+sensitivity_lock = threading.Lock()
+
+def get_sensitivity_curves():
+    global sensitivity_curves
+    if sensitivity_curves is None:
+        with sensitivity_lock:
+            if sensitivity_curves is None:
+                sensitivity_curves = SensitivityCurves(
+                    predict_popularity, feature_grids(data),
+                    capacity=app.config['SENSITIVITY_CACHE_SIZE'])
+    return sensitivity_curves
+
+# /api/predict results, dropped whenever the model files change on disk
+prediction_cache = PredictionCache(capacity=app.config['PREDICTION_CACHE_SIZE'],
+                                   ttl=app.config['PREDICTION_CACHE_TTL'])
+model_watcher = FileWatcher(['spotify_popularity_model.pkl', 'spotify_scaler.pkl',
+                             os.path.join(ENGINE_DIR, 'meta.json')],
+                            check_interval=app.config['MODEL_CHECK_INTERVAL'])
+model_reload_thread = None
+
+# Precomputed prediction and residual of every catalog song (catalog_scores.py);
+# None until a scoring run matches the current model files
+catalog_scores = None
+catalog_scores_watcher = FileWatcher([os.path.join(app.config['CATALOG_SCORES_DIR'], 'summary.json')],
+                                     check_interval=app.config['MODEL_CHECK_INTERVAL'])
+
+def load_catalog_scores():
+    global catalog_scores
+    try:
+        catalog_scores = load_current_scores(app.config['CATALOG_SCORES_DIR'])
+    except Exception as e:
+        print(f"Could not load catalog scores: {e}")
+        catalog_scores = None
+
+catalog_scores_thread = threading.Thread(target=load_catalog_scores, daemon=True)
+if scaler is not None:
+    catalog_scores_thread.start()
+
+def reload_models():
+    """
+    Load the changed model files, swap them in and clear the prediction caches
+    
+    The similarity index lives in the old scaler's space, so it is dropped
+    with the swap (/api/similar answers 503 meanwhile) and rebuilt for the
+    new scaler on this thread.
+    """
+    global scaler, forest_engine, model, similarity_index
+    try:
+        loaded = load_models()
+    except Exception as e:
+        print(f"Model files changed but could not be reloaded: {e}")
+        return
+    with model_swap_lock:
+        scaler, forest_engine, model = loaded
+        similarity_index = None
+    prediction_cache.clear()
+    if sensitivity_curves is not None:
+        sensitivity_curves.clear()
+    load_catalog_scores()  # Dropped unless they were already rescored for the new model
+    print("Model files changed; reloaded and cleared prediction caches")
+    
+    if data is not None:
+        new_scaler = loaded[0]
+        try:
+            index = load_or_build_index(data, new_scaler)
+        except Exception as e:
+            print(f"Could not rebuild the similarity index: {e}")
+            return
+        with model_swap_lock:
+            if scaler is new_scaler:  # Not replaced again while building
+                similarity_index = index
+
+def predict_popularity_cached(feature_matrix):
+    """
+    predict_popularity through the prediction cache
+    
+    Rows are rounded to the sliders' resolution (FEATURE_RESOLUTION) before
+    scoring and keyed by the rounded values, so nearby slider positions share
+    an entry and the answer does not depend on whether the cache is enabled
+    or the row was cached.
+    """
+    quantized = quantize_features(feature_matrix)
+    if not app.config['PREDICTION_CACHE_ENABLED']:
+        return predict_popularity(quantized)
+    keys = row_keys(feature_matrix)
+    predictions, generation = prediction_cache.lookup(keys)
+    missing = np.flatnonzero(np.isnan(predictions))
+    if len(missing):
+        computed = predict_popularity(quantized[missing])
+        predictions[missing] = computed
+        prediction_cache.store([keys[i] for i in missing], computed, generation)
+    return predictions
+
+# Initialize audio analyzer and its result cache
 audio_analyzer = SpotifyAudioAnalyzer()
+feature_cache = FeatureCache(app.config['FEATURE_CACHE_DIR'],
+                             max_bytes=app.config['FEATURE_CACHE_MAX_BYTES'],
+                             resample_quality=audio_analyzer.decoder.resample_quality)
+
+def record_stage_timings(timings):
+    """Add one analysis' per-stage wall times (seconds) to the stage histogram"""
+    if app.config['METRICS_ENABLED']:
+        for stage, seconds in timings.items():
+            ANALYSIS_STAGE_LATENCY.observe(seconds, stage=stage)
+
+def analysis_timer():
+    """StageTimer for this request when metrics or ?debug=1 need one, else None"""
+    if app.config['METRICS_ENABLED'] or debug_requested():
+        return StageTimer()
+    return None
+
+def analysis_mode():
+    """?mode=fast|full (query string or form field), or None if invalid"""
+    mode = request.values.get('mode') or app.config['DEFAULT_ANALYSIS_MODE']
+    return mode if mode in ANALYSIS_MODES else None
+
+def debug_requested():
+    return request.args.get('debug', '').lower() in ('1', 'true', 'yes')
+
+YEAR_COLUMN = FEATURE_NAMES.index('year')
+GENRE_COLUMN = FEATURE_NAMES.index('genre_encoded')
+
+def encode_genre(name):
+    """genre_encoded for a genre name, or None if the encoder does not know it"""
+    if genre_encoder is None or name not in genre_encoder.classes_:
+        return None
+    return int(np.searchsorted(genre_encoder.classes_, name))
+
+class ModelNotLoadedError(Exception):
+    """Raised when a request needs the model files and they are not loaded"""
+
+def upload_scoring_options():
+    """
+    Genre, year and optional year range for scoring an upload, from the request
+    
+    ?genre= picks the genre reported as predicted_popularity and ?year= its
+    year; ?years=2010-2023 (or a comma list) adds a genre x year grid.
+    
+    Raises:
+        ModelNotLoadedError: If the model and genre encoder are not loaded
+        ValueError: On an unknown genre or a malformed year range
+    """
+    if genre_encoder is None or scaler is None:
+        raise ModelNotLoadedError('Model not loaded')
+    genre = request.values.get('genre') or app.config['UPLOAD_DEFAULT_GENRE']
+    if encode_genre(genre) is None:
+        raise ValueError(f'Unknown genre: {genre}')
+    year = request.values.get('year', app.config['UPLOAD_DEFAULT_YEAR'], type=int)
+    spec = request.values.get('years', '').strip()
+    years = None
+    if spec:
+        try:
+            if '-' in spec.lstrip('-'):
+                start, end = (int(part) for part in spec.split('-', 1))
+                years = list(range(min(start, end), max(start, end) + 1))
+            else:
+                years = sorted({int(part) for part in spec.split(',')})
+        except ValueError:
+            raise ValueError('years must be a range like 2010-2023 or a comma-separated list')
+        if len(years) > app.config['MAX_SCORED_YEARS']:
+            raise ValueError(f"At most {app.config['MAX_SCORED_YEARS']} years can be scored")
+    return {'genre': genre, 'year': year, 'years': years}
+
+def score_genre_grid(features, years):
+    """
+    Predicted popularity of one feature record for every genre and year
+    
+    The record is repeated into a (years x genres) block that differs only
+    in the year and genre_encoded columns and scored in a single batch.
+    
+    Returns:
+        np.ndarray: (n_genres, n_years) predictions
+    """
+    base = build_feature_matrix([features])[0]
+    n_genres = len(genre_encoder.classes_)
+    grid = np.repeat(base[None, :], n_genres * len(years), axis=0)
+    grid[:, GENRE_COLUMN] = np.tile(np.arange(n_genres), len(years))
+    grid[:, YEAR_COLUMN] = np.repeat(np.asarray(years, dtype=np.float64), n_genres)
+    return predict_popularity(grid).reshape(len(years), n_genres).T
+
+def score_uploaded_features(features, timer=None, options=None):
+    """
+    Fill the features audio cannot provide and add predicted popularity
+    
+    Adds predicted_popularity for the chosen genre and year, a prediction per
+    genre with the best one, and with options['years'] a genre x year grid;
+    all of it comes from one model call.
+    """
+    options = options or {'genre': app.config['UPLOAD_DEFAULT_GENRE'],
+                          'year': app.config['UPLOAD_DEFAULT_YEAR'], 'years': None}
+    features['year'] = options['year']
+    features['genre'] = options['genre']
+    features['genre_encoded'] = encode_genre(options['genre'])
+    
+    with (timer or NULL_TIMER).stage('predict'):
+        years = sorted(set(options['years'] or []) | {options['year']})
+        grid = score_genre_grid(features, years)
+        by_genre = grid[:, years.index(options['year'])]
+        features['predicted_popularity'] = float(by_genre[features['genre_encoded']])
+        features['genre_predictions'] = {genre: round(float(value), 3)
+                                         for genre, value in zip(genre_encoder.classes_, by_genre)}
+        features['best_genre'] = str(genre_encoder.classes_[int(np.argmax(by_genre))])
+        if options['years']:
+            columns = [years.index(year) for year in options['years']]
+            features['genre_year_predictions'] = {
+                'genres': [str(genre) for genre in genre_encoder.classes_],
+                'years': options['years'],
+                'popularity': np.round(grid[:, columns], 3).tolist(),
+            }
+    return features
+
+def add_debug_timings(features, timer):
+    """Attach per-stage timings for ?debug=1; an empty set means a cache hit"""
+    if timer is not None and debug_requested():
+        analyzed = any(stage != 'predict' for stage in timer.timings)
+        features['_debug'] = {'cache': 'miss' if analyzed else 'hit',
+                              'timings_ms': timer.timings_ms()}
+    return features
+
+def finish_analysis_job(features, context):
+    """Runs on a job-queue thread when a worker returns features"""
+    cache_key, options = context
+    feature_cache.put(cache_key, features)
+    return score_uploaded_features(dict(features), options=options)
+
+# Background analysis for /api/jobs; worker processes start on the first submit
+analysis_jobs = AnalysisJobQueue(workers=app.config['ANALYSIS_WORKERS'],
+                                 max_queued=app.config['ANALYSIS_QUEUE_SIZE'],
+                                 job_timeout=app.config['ANALYSIS_JOB_TIMEOUT'],
+                                 postprocess=finish_analysis_job,
+                                 sample_rate=audio_analyzer.sample_rate,
+                                 resample_quality=audio_analyzer.decoder.resample_quality,
+                                 on_timings=record_stage_timings,
+                                 warm_up=app.config['WARMUP_ON_START'])
+
+# Startup warm-up, reported by /api/ready
+warmup_status = {'state': 'pending' if app.config['WARMUP_ON_START'] else 'disabled',
+                 'timings_ms': {}, 'error': None, 'finished_after_sec': None}
+first_responses = {}  # endpoint -> seconds after startup and latency of its first response
+
+def warm_up():
+    """Run the slow-on-first-use paths once: audio analysis, scoring and sensitivity grids"""
+    warmup_status['state'] = 'running'
+    timings = warmup_status['timings_ms']
+    try:
+        features, analysis_times = audio_analyzer.warm_up()
+        for mode, seconds in analysis_times.items():
+            timings[f'analyze_{mode}'] = round(seconds * 1e3, 1)
+        if features is None:
+            raise RuntimeError('synthetic clip could not be analyzed')
+        if scaler is not None:
+            start = time.perf_counter()
+            scored = score_uploaded_features(dict(features))
+            # A batch past FOREST_ENGINE_MAX_ROWS reaches the sklearn path too
+            predict_popularity(np.repeat(build_feature_matrix([scored]),
+                                         app.config['FOREST_ENGINE_MAX_ROWS'] + 1, axis=0))
+            timings['predict'] = round((time.perf_counter() - start) * 1e3, 1)
+            start = time.perf_counter()
+            get_sensitivity_curves()
+            timings['sensitivity_grids'] = round((time.perf_counter() - start) * 1e3, 1)
+        warmup_status['state'] = 'done'
+    except Exception as e:
+        warmup_status['state'] = 'failed'
+        warmup_status['error'] = str(e)
+        print(f"Warm-up failed: {e}")
+    warmup_status['finished_after_sec'] = round(time.perf_counter() - started_at, 3)
+    print(f"Warm-up {warmup_status['state']} after {warmup_status['finished_after_sec']}s: {timings}")
+
+warmup_thread = threading.Thread(target=warm_up, daemon=True)
+if app.config['WARMUP_ON_START']:
+    warmup_thread.start()
+
+# Cache and queue state, read when /metrics is scraped
+REGISTRY.callback('feature_cache_hits_total', 'Feature cache hits',
+                  lambda: feature_cache.stats()['hits'], kind='counter')
+REGISTRY.callback('feature_cache_misses_total', 'Feature cache misses',
+                  lambda: feature_cache.stats()['misses'], kind='counter')
+REGISTRY.callback('feature_cache_evictions_total', 'Feature cache evictions',
+                  lambda: feature_cache.stats()['evictions'], kind='counter')
+REGISTRY.callback('feature_cache_hit_ratio', 'Feature cache hits / lookups',
+                  lambda: feature_cache.stats()['hit_rate'])
+REGISTRY.callback('prediction_cache_hits_total', 'Prediction cache hits',
+                  lambda: prediction_cache.stats()['hits'], kind='counter')
+REGISTRY.callback('prediction_cache_misses_total', 'Prediction cache misses',
+                  lambda: prediction_cache.stats()['misses'], kind='counter')
+REGISTRY.callback('prediction_cache_entries', 'Predictions currently cached',
+                  lambda: prediction_cache.stats()['entries'])
+REGISTRY.callback('analysis_queue_depth', 'Analysis jobs waiting for a worker',
+                  lambda: analysis_jobs.stats()['queue_depth'])
+REGISTRY.callback('analysis_jobs_running', 'Analysis jobs currently running',
+                  lambda: analysis_jobs.stats()['running'])
+REGISTRY.callback('analysis_job_mean_wait_seconds', 'Mean time jobs waited for a worker',
+                  lambda: analysis_jobs.stats()['mean_wait_sec'])
+REGISTRY.callback('analysis_jobs_total', 'Analysis jobs by outcome',
+                  lambda: {status: analysis_jobs.stats()[status]
+                           for status in ('done', 'failed', 'timeout', 'cancelled', 'rejected')},
+                  kind='counter', labelnames=['status'])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    if app.config['METRICS_ENABLED'] and 'request_start' in g:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - g.request_start,
+                                endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            REQUEST_ERRORS.inc(endpoint=endpoint)
+    if request.endpoint not in first_responses and 'request_start' in g:
+        now = time.perf_counter()
+        first_responses.setdefault(request.endpoint or 'unmatched', {
+            'after_sec': round(now - started_at, 3),
+            'latency_ms': round((now - g.request_start) * 1e3, 1),
+            'status': response.status_code})
+    return response
+
+@app.before_request
+def watch_model_files():
+    """Reload in the background when the model files change (checked every few seconds)"""
+    global model_reload_thread
+    if model_reload_thread is not None and model_reload_thread.is_alive():
+        return
+    if model_watcher.changed():
+        model_reload_thread = threading.Thread(target=reload_models, daemon=True)
+        model_reload_thread.start()
+    elif catalog_scores_watcher.changed():
+        model_reload_thread = threading.Thread(target=load_catalog_scores, daemon=True)
+        model_reload_thread.start()
+
+@app.route('/api/ready')
+def readiness():
+    """200 once the model is loaded and the warm-up has finished, 503 before"""
+    warmed = warmup_status['state'] in ('done', 'failed', 'disabled')
+    ready = scaler is not None and warmed
+    return jsonify({
+        'ready': ready,
+        'uptime_sec': round(time.perf_counter() - started_at, 3),
+        'model_loaded': scaler is not None,
+        'warmup': warmup_status,
+        'song_sampler_ready': song_sampler is not None,
+        'similarity_index_ready': similarity_index is not None,
+        'catalog_scores_ready': catalog_scores is not None,
+        'first_responses': first_responses,
+    }), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of request, model, analysis, cache and queue metrics"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -51,29 +564,75 @@ def index():
 
 @app.route('/api/songs')
 def get_songs():
-    if data is not None:
-        songs = data.sample(50)[['artist_name', 'track_name', 'popularity', 'genre']].to_dict('records')
-        return jsonify(songs)
-    return jsonify([])
+    """Random songs, optionally ?genre=<name>, ?n=<count> and ?stratified=1 by popularity band"""
+    if data is None:
+        return jsonify([])
+    n = max(1, min(request.args.get('n', 50, type=int), 500))
+    genre = request.args.get('genre') or None
+    stratified = request.args.get('stratified', '').lower() in ('1', 'true', 'yes')
+    
+    if song_sampler is not None:
+        body = song_sampler.sample(n, genre=genre, stratified=stratified)
+        return Response(body, mimetype='application/json')
+    
+    # Sampler still building
+    pool = data[data['genre'] == genre] if genre else data
+    songs = pool.sample(min(n, len(pool)))[['artist_name', 'track_name', 'popularity', 'genre']]
+    return jsonify(songs.to_dict('records'))
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
     try:
         features = request.json
-        feature_array = np.array([[
-            features['year'], features['danceability'], features['energy'],
-            features['key'], features['loudness'], features['mode'],
-            features['speechiness'], features['acousticness'], 
-            features['instrumentalness'], features['liveness'],
-            features['valence'], features['tempo'], features['duration_min'],
-            features['time_signature'], features['genre_encoded']
-        ]])
+        feature_array = build_feature_matrix([features])
+        prediction = predict_popularity_cached(feature_array)[0]
+        return jsonify({'prediction': float(prediction)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/predict/stats')
+def prediction_cache_stats():
+    """Prediction cache size, hit/miss counts and hit rate"""
+    return jsonify(prediction_cache.stats())
+
+@app.route('/api/predict_batch', methods=['POST'])
+def predict_batch():
+    """Score many feature records with a single scaler/model call"""
+    try:
+        payload = request.get_json()
+        records = payload.get('records') if isinstance(payload, dict) else payload
+        if not isinstance(records, list):
+            return jsonify({'error': 'Expected a JSON list of records or {"records": [...]}'}), 400
+        if len(records) > app.config['MAX_BATCH_SIZE']:
+            return jsonify({'error': f"Batch too large (max {app.config['MAX_BATCH_SIZE']} records)"}), 413
+        if not records:
+            return jsonify({'predictions': []})
         
-        scaled = scaler.transform(feature_array)
-        prediction = model.predict(scaled)[0]
-        return jsonify({'prediction': max(0, min(100, prediction))})
+        feature_matrix = build_feature_matrix(records)
+        predictions = predict_popularity(feature_matrix)
+        return jsonify({'predictions': predictions.tolist()})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sensitivity', methods=['POST'])
+def sensitivity():
+    """
+    What-if curves for every feature around a JSON feature record
+    
+    Each feature is swept over its grid with the others held at the base
+    values, all in one model call; results are cached by the base record
+    rounded to the sliders' resolution.
+    """
+    if data is None:
+        return jsonify({'error': 'Model and data not loaded'}), 503
+    try:
+        base = build_feature_matrix([request.get_json(silent=True)])[0]
+    except ValueError as e:
         return jsonify({'error': str(e)}), 400
+    result, cached = get_sensitivity_curves().curves(base)
+    return jsonify({**result, 'cached': cached})
 
 @app.route('/api/analyze_audio', methods=['POST'])
 def analyze_audio():
@@ -86,37 +645,32 @@ def analyze_audio():
             return jsonify({'error': 'No file selected'}), 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Decoded straight from memory; the upload never touches disk
+            audio_bytes = file.read()
             
-            # Analyze the audio file
-            features = audio_analyzer.analyze_audio_file(filepath)
+            mode = analysis_mode()
+            if mode is None:
+                return jsonify({'error': 'mode must be one of: ' + ', '.join(ANALYSIS_MODES)}), 400
+            try:
+                options = upload_scoring_options()
+            except ModelNotLoadedError as e:
+                return jsonify({'error': str(e)}), 503
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            # Clean up uploaded file
-            os.remove(filepath)
+            # Identical audio is served from the feature cache
+            timer = analysis_timer()
+            features = feature_cache.get_or_compute(
+                audio_bytes, audio_analyzer.sample_rate,
+                lambda: audio_analyzer.analyze_audio_bytes(audio_bytes, file.filename,
+                                                           timer=timer, mode=mode),
+                mode=mode)
             
             if features:
-                # Add default values for missing features
-                features['year'] = 2023
-                features['genre'] = 'pop'  # Default genre
-                features['genre_encoded'] = 0  # Default to first genre
-                
-                # Make prediction
-                feature_array = np.array([[
-                    features['year'], features['danceability'], features['energy'],
-                    features['key'], features['loudness'], features['mode'],
-                    features['speechiness'], features['acousticness'], 
-                    features['instrumentalness'], features['liveness'],
-                    features['valence'], features['tempo'], features['duration_min'],
-                    features['time_signature'], features['genre_encoded']
-                ]])
-                
-                scaled = scaler.transform(feature_array)
-                prediction = model.predict(scaled)[0]
-                features['predicted_popularity'] = max(0, min(100, prediction))
-                
-                return jsonify(features)
+                if timer is not None:
+                    record_stage_timings(timer.timings)
+                features = score_uploaded_features(features, timer, options)
+                return jsonify(add_debug_timings(features, timer))
             else:
                 return jsonify({'error': 'Failed to analyze audio file'}), 500
         else:
@@ -125,45 +679,217 @@ def analyze_audio():
     except Exception as e:
         return jsonify({'error': f'Error processing audio: {str(e)}'}), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_analysis_job():
+    """Queue an uploaded audio file for analysis; returns 202 with a job id"""
+    if 'audio_file' not in request.files:
+        return jsonify({'error': 'No audio file provided'}), 400
+    file = request.files['audio_file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Supported: WAV, MP3, FLAC, M4A, AAC, OGG'}), 400
+    
+    mode = analysis_mode()
+    if mode is None:
+        return jsonify({'error': 'mode must be one of: ' + ', '.join(ANALYSIS_MODES)}), 400
+    try:
+        options = upload_scoring_options()
+    except ModelNotLoadedError as e:
+        return jsonify({'error': str(e)}), 503
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    audio_bytes = file.read()
+    cache_key = feature_cache.key_for(audio_bytes, audio_analyzer.sample_rate, mode)
+    cached = feature_cache.get(cache_key)
+    if cached is not None:
+        job = analysis_jobs.add_finished(score_uploaded_features(cached, options=options),
+                                         mode=mode)
+    else:
+        try:
+            job = analysis_jobs.submit(audio_bytes, file.filename, context=(cache_key, options),
+                                       mode=mode)
+        except QueueFullError as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+    
+    body = job.to_dict()
+    body['status_url'] = f'/api/jobs/{job.id}'
+    return jsonify(body), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_analysis_job(job_id):
+    """Job status and result; ?wait=<seconds> long-polls until the job finishes"""
+    wait = max(0.0, min(request.args.get('wait', 0, type=float), app.config['JOB_LONG_POLL_MAX']))
+    job = analysis_jobs.wait(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    body = job.to_dict()
+    if debug_requested() and job.timings:
+        body['_debug'] = {'timings_ms': {stage: round(seconds * 1e3, 3)
+                                         for stage, seconds in job.timings.items()}}
+    return jsonify(body)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_analysis_job(job_id):
+    job = analysis_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/stats')
+def analysis_job_stats():
+    """Queue depth, running jobs, outcome counts and mean wait time"""
+    return jsonify(analysis_jobs.stats())
+
 @app.route('/api/analyze_default')
 def analyze_default():
     """Analyze the default sample file"""
     try:
         if os.path.exists('skeletononthebeat.wav'):
-            features = audio_analyzer.analyze_audio_file('skeletononthebeat.wav')
+            with open('skeletononthebeat.wav', 'rb') as f:
+                audio_bytes = f.read()
+            mode = analysis_mode()
+            if mode is None:
+                return jsonify({'error': 'mode must be one of: ' + ', '.join(ANALYSIS_MODES)}), 400
+            try:
+                options = upload_scoring_options()
+            except ModelNotLoadedError as e:
+                return jsonify({'error': str(e)}), 503
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            # The bundled sample is an electronic track
+            if not request.values.get('genre') and encode_genre('electronic') is not None:
+                options['genre'] = 'electronic'
+            timer = analysis_timer()
+            features = feature_cache.get_or_compute(
+                audio_bytes, audio_analyzer.sample_rate,
+                lambda: audio_analyzer.analyze_audio_file('skeletononthebeat.wav',
+                                                          timer=timer, mode=mode),
+                mode=mode)
             if features:
-                # Add default values
-                features['year'] = 2023
-                features['genre'] = 'electronic'
-                features['genre_encoded'] = 3  # Assuming electronic is index 3
-                
-                # Make prediction
-                feature_array = np.array([[
-                    features['year'], features['danceability'], features['energy'],
-                    features['key'], features['loudness'], features['mode'],
-                    features['speechiness'], features['acousticness'], 
-                    features['instrumentalness'], features['liveness'],
-                    features['valence'], features['tempo'], features['duration_min'],
-                    features['time_signature'], features['genre_encoded']
-                ]])
-                
-                scaled = scaler.transform(feature_array)
-                prediction = model.predict(scaled)[0]
-                features['predicted_popularity'] = max(0, min(100, prediction))
-                
-                return jsonify(features)
+                if timer is not None:
+                    record_stage_timings(timer.timings)
+                features = score_uploaded_features(features, timer, options)
+                return jsonify(add_debug_timings(features, timer))
         
         return jsonify({'error': 'Default sample file not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/similar', methods=['GET', 'POST'])
+def similar_songs():
+    """
+    Catalog songs nearest to a song in scaled feature space
+    
+    The query is a catalog song (?artist=&track=), an uploaded audio_file or
+    a JSON feature record. ?k= sets the number of results and ?genre= limits
+    them to one genre; for uploads the genre and ?year= (UPLOAD_DEFAULT_GENRE
+    and UPLOAD_DEFAULT_YEAR if absent) fill the features audio cannot provide.
+    """
+    if data is None:
+        return jsonify({'error': 'Model and data not loaded'}), 503
+    # The index and the scaler it was built with, as one consistent pair
+    with model_swap_lock:
+        index, scaler_ = similarity_index, scaler
+    if index is None:
+        response = jsonify({'error': 'Similarity index is still loading'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    k = max(1, min(request.values.get('k', 10, type=int), app.config['SIMILAR_MAX_K']))
+    genre = request.values.get('genre') or None
+    genre_code = encode_genre(genre) if genre is not None else None
+    if genre is not None and genre_code is None:
+        return jsonify({'error': f'Unknown genre: {genre}'}), 400
+    
+    exclude = None
+    try:
+        if request.method == 'GET':
+            position = song_index.find(request.args.get('artist', ''), request.args.get('track', ''))
+            if position is None:
+                return jsonify({'error': 'Not found'}), 404
+            query = data.iloc[[position]]
+            exclude = position
+            query_vector = scaled_catalog(query, scaler_)[0]
+            query_info = song_index.row(position, ['artist_name', 'track_name', 'genre'])
+        else:
+            if 'audio_file' in request.files:
+                file = request.files['audio_file']
+                if not allowed_file(file.filename):
+                    return jsonify({'error': 'Invalid file type. Supported: WAV, MP3, FLAC, M4A, AAC, OGG'}), 400
+                mode = analysis_mode()
+                if mode is None:
+                    return jsonify({'error': 'mode must be one of: ' + ', '.join(ANALYSIS_MODES)}), 400
+                audio_bytes = file.read()
+                features = feature_cache.get_or_compute(
+                    audio_bytes, audio_analyzer.sample_rate,
+                    lambda: audio_analyzer.analyze_audio_bytes(audio_bytes, file.filename,
+                                                               mode=mode),
+                    mode=mode)
+                if not features:
+                    return jsonify({'error': 'Failed to analyze audio file'}), 500
+                features = dict(features)
+                features['year'] = request.values.get('year', app.config['UPLOAD_DEFAULT_YEAR'],
+                                                      type=int)
+                features['genre'] = genre or app.config['UPLOAD_DEFAULT_GENRE']
+                features['genre_encoded'] = encode_genre(features['genre'])
+                if features['genre_encoded'] is None:
+                    return jsonify({'error': f"Unknown genre: {features['genre']}"}), 400
+            else:
+                features = request.get_json(silent=True)
+                if not isinstance(features, dict):
+                    return jsonify({'error': 'Provide artist/track, an audio_file or a JSON feature record'}), 400
+            query_vector = scaler_.transform(build_feature_matrix([features]))[0]
+            query_info = features
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows, distances = index.query(query_vector, k=k, nprobe=app.config['SIMILAR_NPROBE'],
+                                  genre=genre_code, exclude=exclude)
+    columns = ['artist_name', 'track_name', 'popularity', 'genre', 'year']
+    results = []
+    for row, distance in zip(rows, distances):
+        song = song_index.row(int(row), columns)
+        song['distance'] = round(float(distance), 4)
+        results.append(song)
+    return jsonify({'query': query_info, 'results': results})
+
 @app.route('/api/song/<artist>/<track>')
 def get_song(artist, track):
-    if data is not None:
-        song = data[(data['artist_name'] == artist) & (data['track_name'] == track)]
-        if not song.empty:
-            return jsonify(song.iloc[0].to_dict())
+    if song_index is not None:
+        # Exact match first, then case/whitespace-insensitive
+        position = song_index.find(artist, track)
+        if position is not None:
+            song = song_index.row(position)
+            scores = catalog_scores
+            if scores is not None:
+                song.update(scores.lookup(song['artist_name'], song['track_name']) or {})
+            return jsonify(song)
     return jsonify({'error': 'Not found'}), 404
 
+@app.route('/api/catalog/errors')
+def catalog_errors():
+    """Per-genre prediction errors over the whole catalog, from the last catalog_scores.py run"""
+    scores = catalog_scores
+    if scores is None:
+        return jsonify({'error': 'No catalog scores for the current model; run catalog_scores.py'}), 404
+    summary = scores.summary
+    return jsonify({'n_rows': summary['n_rows'], 'overall': summary['overall'],
+                    'genres': summary['genres'], 'scored_in_sec': summary['seconds']})
+
+@app.route('/api/search')
+def search_songs():
+    """Autocomplete songs by track or artist name prefix"""
+    if song_index is None:
+        return jsonify([])
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    positions = song_index.search_prefix(query, limit=limit)
+    columns = ['artist_name', 'track_name', 'popularity', 'genre']
+    return jsonify([song_index.row(position, columns) for position in positions])
+
 if __name__ == '__main__':
     app.run(port=5001)
@@ -3,67 +3,732 @@ Audio Feature Extraction for Spotify-like Analysis
 Extracts audio features similar to Spotify's API from audio files
 """
 
+import io
 import os
+import time
+
+# librosa compiles its numba kernels with cache=True; keep the compiled code
+# in the project cache so restarts load it instead of recompiling, also where
+# site-packages is read-only. Must be set before numba is first imported.
+# Relative to this file, so every working directory shares one cache.
+os.environ.setdefault('NUMBA_CACHE_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'numba'))
 
 import librosa
 import numpy as np
 import soundfile as sf
 from scipy import stats
 import warnings
+
+from audio_decode import AudioDecoder, downmix
+from metrics import NULL_TIMER
 warnings.filterwarnings('ignore')
 
+# Bump whenever feature formulas change so cached results are not reused
+ANALYZER_VERSION = '1'
+
+ANALYSIS_MODES = ('full', 'fast')
+
+# Fast mode averages these over its excerpts and reports their spread
+PREVIEW_CONTINUOUS_FEATURES = ['tempo', 'energy', 'loudness', 'danceability', 'valence',
+                               'acousticness', 'instrumentalness', 'liveness', 'speechiness']
+
+# Root-mean-square shift of each fast-mode feature caused by analyzing at
+# PREVIEW_RATE_SHIFT_RATES[1] Hz instead of [0] Hz, as measured by
+# benchmark_suite.py --only preview on clips fast mode analyzes whole.
+# Re-measure when feature formulas or these rates change. Liveness and
+# speechiness are left out: the synthetic fixtures never make them non-zero.
+PREVIEW_RATE_SHIFT_RATES = (22050, 11025)
+PREVIEW_RATE_SHIFT = {'tempo': 5.403, 'energy': 0.0252, 'loudness': 0.1142, 'danceability': 0.0237,
+                      'valence': 0.0358, 'acousticness': 0.0802, 'instrumentalness': 0.0966}
+
+
+class AnalysisContext:
+    """
+    Spectral features for one decoded signal, computed lazily and memoized
+
+    A single magnitude STFT is shared by chroma, centroid, rolloff and
+    bandwidth, and a single mel spectrogram by MFCC and the onset envelope,
+    so each transform runs at most once per file no matter how many
+    feature calculators ask for it.
+    """
+
+    def __init__(self, y, sr, n_fft=2048, hop_length=512, timer=None):
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.timer = timer or NULL_TIMER
+        self._cache = {}
+
+    def _memo(self, name, compute):
+        if name not in self._cache:
+            if isinstance(name, str):
+                # Each transform is timed once, by whichever stage first needs it
+                with self.timer.stage(name):
+                    self._cache[name] = compute()
+            else:
+                self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def n_samples(self):
+        return len(self.y)
+
+    @property
+    def signal_power(self):
+        """Mean squared amplitude of the whole signal"""
+        return self._memo('signal_power', lambda: float(np.mean(self.y ** 2)))
+
+    def mean(self, name):
+        """Per-row mean over frames of a frame-level feature"""
+        return self._memo(('mean', name), lambda: np.mean(getattr(self, name), axis=-1))
+
+    def var(self, name):
+        """Per-row variance over frames of a frame-level feature"""
+        return self._memo(('var', name), lambda: np.var(getattr(self, name), axis=-1))
+
+    @property
+    def stft(self):
+        """Magnitude spectrogram |STFT(y)|"""
+        return self._memo('stft', lambda: np.abs(
+            librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length)))
+
+    @property
+    def power(self):
+        """Power spectrogram |STFT(y)|^2"""
+        return self._memo('power', lambda: self.stft ** 2)
+
+    @property
+    def mel_db(self):
+        """Log-power mel spectrogram shared by MFCC and onset detection"""
+        return self._memo('mel_db', lambda: librosa.power_to_db(
+            librosa.feature.melspectrogram(S=self.power, sr=self.sr)))
+
+    @property
+    def chroma(self):
+        return self._memo('chroma', lambda: librosa.feature.chroma_stft(
+            S=self.power, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    @property
+    def spectral_centroid(self):
+        return self._memo('spectral_centroid', lambda: librosa.feature.spectral_centroid(
+            S=self.stft, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length)[0])
+
+    @property
+    def spectral_rolloff(self):
+        return self._memo('spectral_rolloff', lambda: librosa.feature.spectral_rolloff(
+            S=self.stft, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length)[0])
+
+    @property
+    def spectral_bandwidth(self):
+        return self._memo('spectral_bandwidth', lambda: librosa.feature.spectral_bandwidth(
+            S=self.stft, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length)[0])
+
+    @property
+    def mfcc(self):
+        return self._memo('mfcc', lambda: librosa.feature.mfcc(
+            S=self.mel_db, sr=self.sr, n_mfcc=13))
+
+    @property
+    def mfcc_abs(self):
+        return self._memo('mfcc_abs', lambda: np.abs(self.mfcc))
+
+    @property
+    def rms(self):
+        # Framed directly from the waveform: RMS taken from the windowed STFT
+        # is systematically lower and would shift energy/liveness.
+        return self._memo('rms', lambda: librosa.feature.rms(
+            y=self.y, frame_length=self.n_fft, hop_length=self.hop_length)[0])
+
+    @property
+    def onset_envelope(self):
+        return self._memo('onset_envelope', lambda: librosa.onset.onset_strength(
+            S=self.mel_db, sr=self.sr, hop_length=self.hop_length))
+
+    @property
+    def beat_onset_envelope(self):
+        """Median-aggregated onset envelope, as beat_track computes it from y"""
+        return self._memo('beat_onset_envelope', lambda: librosa.onset.onset_strength(
+            S=self.mel_db, sr=self.sr, hop_length=self.hop_length, aggregate=np.median))
+
+    @property
+    def beat_track(self):
+        """(tempo, beat frames) tracked from the shared onset envelope"""
+        def compute():
+            tempo, beats = librosa.beat.beat_track(
+                onset_envelope=self.beat_onset_envelope, sr=self.sr, hop_length=self.hop_length)
+            # Newer librosa returns tempo as a 1-element array
+            return float(np.atleast_1d(tempo)[0]), beats
+        return self._memo('beat_track', compute)
+
+
+class _RunningMoments:
+    """Streaming per-row mean and variance over frames (Chan et al. parallel update)"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        n_b = x.shape[-1]
+        if n_b == 0:
+            return
+        mean_b = np.mean(x, axis=-1, dtype=np.float64)
+        m2_b = np.sum((x - mean_b[..., None]) ** 2, axis=-1, dtype=np.float64)
+        n = self.count + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * n_b / n
+        self.m2 = self.m2 + m2_b + delta ** 2 * self.count * n_b / n
+        self.count = n
+
+    @property
+    def var(self):
+        return self.m2 / self.count if self.count else 0.0
+
+
+class StreamingAnalysisContext:
+    """
+    Block-wise counterpart of AnalysisContext for long recordings
+
+    Samples are pushed in with update() and reduced to running statistics
+    as frames complete, so memory does not grow with track length. Frames
+    line up exactly with the centered STFT of the full signal; the places
+    that differ from whole-file analysis are the dB floor (relative to the
+    loudest frame seen so far), the chroma tuning (estimated on the first
+    block) and beat tracking, which runs over overlapping windows of the
+    onset envelope and takes the duration-weighted median tempo.
+    """
+
+    _MOMENT_FEATURES = ('rms', 'chroma', 'spectral_centroid', 'spectral_rolloff',
+                        'spectral_bandwidth', 'mfcc', 'mfcc_abs', 'onset_envelope')
+
+    def __init__(self, sr, n_fft=2048, hop_length=512, beat_window_seconds=120.0,
+                 beat_overlap_seconds=10.0, top_db=80.0):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.top_db = top_db
+        self.n_samples = 0
+        self._sum_sq = 0.0
+        self._moments = {name: _RunningMoments() for name in self._MOMENT_FEATURES}
+        self._tuning = None
+        self._db_max = -np.inf
+        self._prev_mel_db = None
+        # Center padding: the full STFT pads n_fft // 2 zeros on both ends
+        self._carry = np.zeros(n_fft // 2, dtype=np.float32)
+
+        # Onset envelopes start with lag + n_fft // (2 * hop) zeros, and the
+        # last two differences fall off the end, so hold them back
+        self._onset_pad = 1 + n_fft // (2 * hop_length)
+        self._pending_onsets = []
+        self._onset_pad_pending = True
+
+        # Beat tracking over overlapping windows of the median onset envelope
+        self._beat_window = max(1, int(beat_window_seconds * sr / hop_length))
+        self._beat_overlap = min(int(beat_overlap_seconds * sr / hop_length),
+                                 self._beat_window // 2)
+        self._beat_env = np.zeros(0, dtype=np.float32)
+        self._beat_env_start = 0
+        self._beats = []
+        self._tempos = []
+        self._finalized = False
+
+    def update(self, y):
+        """Consume the next block of mono samples at self.sr"""
+        y = np.asarray(y, dtype=np.float32)
+        self.n_samples += len(y)
+        self._sum_sq += float(np.sum(np.square(y, dtype=np.float64)))
+        self._consume(np.concatenate([self._carry, y]))
+
+    def finalize(self):
+        """Flush trailing frames and beat windows once all samples are in"""
+        if self._finalized:
+            return
+        self._consume(np.concatenate([self._carry, np.zeros(self.n_fft // 2, dtype=np.float32)]))
+        self._carry = np.zeros(0, dtype=np.float32)
+        # Differences past the final frame are trimmed, as in onset_strength
+        self._pending_onsets = []
+        self._track_beats(final=True)
+        self._finalized = True
+
+    def _consume(self, buf):
+        if len(buf) < self.n_fft:
+            self._carry = buf
+            return
+        n_frames = 1 + (len(buf) - self.n_fft) // self.hop_length
+        seg = buf[:(n_frames - 1) * self.hop_length + self.n_fft]
+        self._carry = buf[n_frames * self.hop_length:]
+
+        frames = librosa.util.frame(seg, frame_length=self.n_fft, hop_length=self.hop_length)
+        self._moments['rms'].update(np.sqrt(np.mean(frames ** 2, axis=0)))
+
+        S = np.abs(librosa.stft(seg, n_fft=self.n_fft, hop_length=self.hop_length, center=False))
+        power = S ** 2
+        if self._tuning is None:
+            self._tuning = librosa.estimate_tuning(S=power, sr=self.sr, bins_per_octave=12)
+        self._moments['chroma'].update(librosa.feature.chroma_stft(
+            S=power, sr=self.sr, tuning=self._tuning))
+        self._moments['spectral_centroid'].update(
+            librosa.feature.spectral_centroid(S=S, sr=self.sr)[0])
+        self._moments['spectral_rolloff'].update(
+            librosa.feature.spectral_rolloff(S=S, sr=self.sr)[0])
+        self._moments['spectral_bandwidth'].update(
+            librosa.feature.spectral_bandwidth(S=S, sr=self.sr)[0])
+
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=self.sr),
+                                     top_db=None)
+        self._db_max = max(self._db_max, float(mel_db.max()))
+        mel_db = np.maximum(mel_db, self._db_max - self.top_db)
+        mfcc = librosa.feature.mfcc(S=mel_db, sr=self.sr, n_mfcc=13)
+        self._moments['mfcc'].update(mfcc)
+        self._moments['mfcc_abs'].update(np.abs(mfcc))
+        self._update_onsets(mel_db)
+
+    def _update_onsets(self, mel_db):
+        if self._prev_mel_db is not None:
+            mel_db_lagged = np.concatenate([self._prev_mel_db, mel_db], axis=1)
+        else:
+            mel_db_lagged = mel_db
+        self._prev_mel_db = mel_db[:, -1:]
+        diff = np.maximum(0.0, mel_db_lagged[:, 1:] - mel_db_lagged[:, :-1])
+        if diff.shape[1] == 0 and not self._onset_pad_pending:
+            return
+
+        mean_env = np.mean(diff, axis=0)
+        median_env = np.median(diff, axis=0)
+        if self._onset_pad_pending:
+            pad = np.zeros(self._onset_pad, dtype=mean_env.dtype)
+            mean_env = np.concatenate([pad, mean_env])
+            median_env = np.concatenate([pad, median_env])
+            self._onset_pad_pending = False
+
+        # Hold back the newest two values: the last two differences of the
+        # track are trimmed, and we only know which ones they are at the end
+        self._pending_onsets.extend(zip(mean_env, median_env))
+        ready = self._pending_onsets[:-2]
+        self._pending_onsets = self._pending_onsets[-2:]
+        if ready:
+            mean_ready, median_ready = (np.asarray(v, dtype=np.float32) for v in zip(*ready))
+            self._moments['onset_envelope'].update(mean_ready)
+            self._beat_env = np.concatenate([self._beat_env, median_ready])
+            self._track_beats()
+
+    def _track_beats(self, final=False):
+        step = self._beat_window - self._beat_overlap
+        half = self._beat_overlap // 2
+        while len(self._beat_env) >= self._beat_window or (final and len(self._beat_env)):
+            env = self._beat_env[:self._beat_window]
+            is_last = final and len(self._beat_env) <= self._beat_window
+            tempo, beats = librosa.beat.beat_track(onset_envelope=env, sr=self.sr,
+                                                   hop_length=self.hop_length)
+            # Keep only beats in this window's core; overlaps belong to neighbours
+            lo = half if self._beat_env_start > 0 else 0
+            hi = len(env) if is_last else step + half
+            core = beats[(beats >= lo) & (beats < hi)]
+            self._beats.extend((core + self._beat_env_start).tolist())
+            self._tempos.append((float(np.atleast_1d(tempo)[0]), hi - lo))
+            if is_last:
+                self._beat_env = self._beat_env[:0]
+                break
+            self._beat_env = self._beat_env[step:]
+            self._beat_env_start += step
+
+    @property
+    def signal_power(self):
+        return self._sum_sq / self.n_samples if self.n_samples else 0.0
+
+    def mean(self, name):
+        return self._moments[name].mean
+
+    def var(self, name):
+        return self._moments[name].var
+
+    @property
+    def beat_track(self):
+        """(tempo, beat frames) stitched together from the beat windows"""
+        if not self._tempos:
+            return 0.0, np.zeros(0, dtype=int)
+        tempos, weights = (np.asarray(v, dtype=float) for v in zip(*self._tempos))
+        order = np.argsort(tempos)
+        cumulative = np.cumsum(weights[order])
+        tempo = tempos[order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+        return float(tempo), np.asarray(self._beats, dtype=int)
+
+
 class SpotifyAudioAnalyzer:
-    def __init__(self, sample_rate=22050):
+    def __init__(self, sample_rate=22050, preview_sample_rate=11025, preview_window_seconds=10.0,
+                 preview_probes=16, resample_quality='HQ', format_decoders=None):
         self.sample_rate = sample_rate
+        self.preview_sample_rate = preview_sample_rate
+        self.preview_window_seconds = preview_window_seconds
+        self.preview_probes = preview_probes
+        # Decoder chain per format and soxr quality; see audio_decode.py
+        self.decoder = AudioDecoder(sample_rate, resample_quality=resample_quality,
+                                    format_decoders=format_decoders)
     
-    def analyze_audio_file(self, file_path):
+    def warm_up(self, seconds=8.0, native_sample_rate=44100):
+        """
+        Run full and fast analysis once on a short synthetic clip
+        
+        The first analysis in a process pays for librosa's lazy submodule
+        imports, numba compilation (or loading it from NUMBA_CACHE_DIR) and
+        FFT setup. Calling this at startup keeps that cost off the first real
+        request. The clip, a click track over a chord, goes through the same
+        in-memory WAV decode and resampling path as an upload.
+        
+        Args:
+            seconds (float): Clip length
+            native_sample_rate (int): Rate the clip is encoded at
+            
+        Returns:
+            tuple: (features from the full analysis or None on failure,
+                dict of seconds spent per mode)
+        """
+        t = np.arange(int(seconds * native_sample_rate)) / native_sample_rate
+        y = sum(np.sin(2 * np.pi * f0 * t) for f0 in (220.0, 277.18, 329.63)) / 6
+        beat_phase = t % 0.5
+        y += np.exp(-beat_phase / 0.004) * np.sin(2 * np.pi * 1000 * t) * 0.5
+        buffer = io.BytesIO()
+        sf.write(buffer, y.astype(np.float32), native_sample_rate, format='WAV', subtype='PCM_16')
+        audio_bytes = buffer.getvalue()
+        
+        timings = {}
+        features = None
+        for mode in ANALYSIS_MODES:
+            start = time.perf_counter()
+            result = self.analyze_audio_bytes(audio_bytes, 'warmup.wav', mode=mode)
+            timings[mode] = time.perf_counter() - start
+            if mode == 'full':
+                features = result
+        return features, timings
+
+    def analyze_audio_file(self, file_path, timer=None, mode='full'):
         """
         Extract Spotify-like features from an audio file
         
         Args:
             file_path (str): Path to audio file
+            timer (StageTimer): Optional collector of per-stage wall times
+            mode (str): 'full' analyzes every sample; 'fast' analyzes excerpts
+                (see analyze_audio_preview)
             
         Returns:
             dict: Dictionary of extracted features
         """
         try:
+            if mode == 'fast':
+                return self.analyze_audio_preview(file_path, timer=timer)
             # Load audio file
-            y, sr = librosa.load(file_path, sr=self.sample_rate)
-            
-            # Extract all features
-            features = {}
-            
-            # Basic properties
-            features['duration_min'] = len(y) / sr / 60.0
-            
-            # Tempo and beat tracking
-            tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-            features['tempo'] = float(tempo)
-            
-            # Time signature (estimate based on beat patterns)
-            features['time_signature'] = self._estimate_time_signature(beats, sr)
+            y, sr = self.load_audio(file_path, timer=timer)
+            return self.analyze_signal(y, sr, timer=timer)
             
-            # Key detection
-            features['key'] = self._estimate_key(y, sr)
-            features['mode'] = self._estimate_mode(y, sr)
+        except Exception as e:
+            print(f"Error analyzing audio: {e}")
+            return None
+
+    def analyze_audio_stream(self, file_path, block_seconds=30.0, beat_window_seconds=120.0,
+                             beat_overlap_seconds=10.0):
+        """
+        Extract features block by block, with memory independent of track length
+        
+        Intended for long recordings (DJ mixes, live sets) run offline. Only
+        formats soundfile can read are supported (WAV, FLAC, OGG, MP3 with
+        libsndfile >= 1.1). Results match analyze_audio_file closely but not
+        exactly; see StreamingAnalysisContext.
+        
+        Args:
+            file_path (str): Path to audio file
+            block_seconds (float): Audio decoded per block
+            beat_window_seconds (float): Onset envelope length per beat-tracking window
+            beat_overlap_seconds (float): Overlap between consecutive beat windows
             
-            # Energy features
-            features['energy'] = self._calculate_energy(y)
-            features['loudness'] = self._calculate_loudness(y)
+        Returns:
+            dict: Dictionary of extracted features
+        """
+        try:
+            ctx = StreamingAnalysisContext(self.sample_rate,
+                                           beat_window_seconds=beat_window_seconds,
+                                           beat_overlap_seconds=beat_overlap_seconds)
+            for block in self._stream_blocks(file_path, block_seconds):
+                ctx.update(block)
+            ctx.finalize()
+            return self._extract_features(ctx)
             
-            # Spectral features
-            features['danceability'] = self._calculate_danceability(y, sr, tempo)
-            features['valence'] = self._calculate_valence(y, sr)
-            features['acousticness'] = self._calculate_acousticness(y, sr)
-            features['instrumentalness'] = self._calculate_instrumentalness(y, sr)
-            features['liveness'] = self._calculate_liveness(y, sr)
-            features['speechiness'] = self._calculate_speechiness(y, sr)
+        except Exception as e:
+            print(f"Error analyzing audio: {e}")
+            return None
+
+    def _stream_blocks(self, file_path, block_seconds):
+        """Yield mono float32 blocks resampled to the analyzer's sample rate"""
+        import soxr
+        
+        native_sr = sf.info(file_path).samplerate
+        resampler = None
+        if native_sr != self.sample_rate:
+            resampler = soxr.ResampleStream(native_sr, self.sample_rate, 1, dtype='float32',
+                                            quality=self.decoder.resample_quality)
+        
+        blocksize = max(1, int(block_seconds * native_sr))
+        for block in sf.blocks(file_path, blocksize=blocksize, dtype='float32', always_2d=True):
+            mono = downmix(block)
+            yield resampler.resample_chunk(mono) if resampler else mono
+        if resampler:
+            yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+    def analyze_audio_bytes(self, audio_bytes, filename, timer=None, mode='full'):
+        """
+        Extract Spotify-like features from audio held in memory
+        
+        Args:
+            audio_bytes (bytes): Encoded audio file contents
+            filename (str): Original file name, used for its extension
+            timer (StageTimer): Optional collector of per-stage wall times
+            mode (str): 'full' or 'fast', as for analyze_audio_file
             
-            return features
+        Returns:
+            dict: Dictionary of extracted features
+        """
+        try:
+            if mode == 'fast':
+                return self.analyze_audio_preview(io.BytesIO(audio_bytes), filename, timer=timer)
+            y, sr = self.load_audio_bytes(audio_bytes, filename, timer=timer)
+            return self.analyze_signal(y, sr, timer=timer)
             
         except Exception as e:
             print(f"Error analyzing audio: {e}")
             return None
+
+    def load_audio(self, file_path, timer=None):
+        """Decode an audio file to a mono signal at the analyzer's sample rate"""
+        extension = file_path.rsplit('.', 1)[-1] if '.' in os.path.basename(file_path) else ''
+        return self.decoder.load(file_path, extension, timer or NULL_TIMER)
+
+    def load_audio_bytes(self, audio_bytes, filename, timer=None):
+        """
+        Decode in-memory audio without touching disk where possible
+        
+        Formats soundfile reads (WAV/FLAC/OGG, and MP3 on libsndfile >= 1.1)
+        are decoded straight from a BytesIO; only the audioread fallback
+        spills to a temporary file.
+        """
+        extension = filename.rsplit('.', 1)[-1] if '.' in filename else ''
+        return self.decoder.load(io.BytesIO(audio_bytes), extension, timer or NULL_TIMER)
+
+    def analyze_audio_preview(self, source, filename=None, timer=None):
+        """
+        Quick estimate of the features from a few excerpts of the track
+        
+        Three windows of preview_window_seconds are analyzed at
+        preview_sample_rate: the intro, the middle, and the loudest of
+        preview_probes short probes spread over the track (usually a
+        chorus). With soundfile-readable input only those windows and the
+        probes are decoded. Continuous features are averaged over the
+        windows; key and mode come from the averaged chroma; duration is
+        the full track's.
+        
+        The returned dict has the usual features plus a 'preview' entry
+        giving the excerpts and, per continuous feature:
+        
+        - window_error: standard error of the window average, i.e. how much
+          the track varies between windows; None when a single window
+          covers the whole track
+        - estimated_error: window_error combined with the calibrated shift
+          of the lower sample rate (PREVIEW_RATE_SHIFT); None when either
+          part is unknown
+        
+        Args:
+            source (str or file-like): Path or open binary file
+            filename (str): Original name when source is file-like, for its extension
+            timer (StageTimer): Optional collector of per-stage wall times
+            
+        Returns:
+            dict: Dictionary of extracted features
+        """
+        timer = timer or NULL_TIMER
+        windows, native_sr, duration = self._load_excerpts(source, filename, timer)
+        with timer.stage('resample'):
+            windows = [(start, self.decoder.resample(y, native_sr, self.preview_sample_rate))
+                       for start, y in windows]
+        sr = self.preview_sample_rate
+        
+        contexts = [AnalysisContext(y, sr, timer=timer) for _, y in windows]
+        per_window = [self._extract_features(ctx, timer=timer) for ctx in contexts]
+        weights = np.array([ctx.n_samples for ctx in contexts], dtype=np.float64)
+        weights /= weights.sum()
+        
+        features = {'duration_min': duration / 60.0, 'time_signature': per_window[0]['time_signature']}
+        window_errors = {}
+        errors = {}
+        calibrated = (self.sample_rate, sr) == PREVIEW_RATE_SHIFT_RATES
+        for name in PREVIEW_CONTINUOUS_FEATURES:
+            values = np.array([f[name] for f in per_window], dtype=np.float64)
+            if name == 'tempo':
+                # A median keeps one window's octave error from skewing the estimate
+                features[name] = float(np.median(values))
+            elif name == 'loudness':
+                # Level of the pooled power, as full analysis measures it, not a mean of dB
+                power = float(sum(w * ctx.signal_power for w, ctx in zip(weights, contexts)))
+                features[name] = self._loudness_from_power(power)
+            else:
+                features[name] = float(np.dot(weights, values))
+            if len(values) > 1:
+                window_errors[name] = float(np.std(values, ddof=1) / np.sqrt(len(values)))
+            else:
+                window_errors[name] = None  # The whole track: no spread to measure
+            rate_error = PREVIEW_RATE_SHIFT.get(name) if calibrated else None
+            if rate_error is None:
+                errors[name] = None
+            else:
+                errors[name] = float(np.hypot(window_errors[name] or 0.0, rate_error))
+        
+        chroma_mean = sum(w * ctx.mean('chroma') for w, ctx in zip(weights, contexts))
+        features['key'] = self._key_from_chroma(chroma_mean)
+        features['mode'] = self._mode_from_chroma(chroma_mean)
+        features['preview'] = {
+            'sample_rate': sr,
+            'excerpts_sec': [[round(start / native_sr, 2), round(start / native_sr + len(y) / sr, 2)]
+                             for (start, _), y in zip(windows, (ctx.y for ctx in contexts))],
+            'estimated_error': errors,
+            'window_error': window_errors,
+            'key_agreement': float(np.mean([f['key'] == features['key'] for f in per_window])),
+        }
+        return features
+
+    def _load_excerpts(self, source, filename, timer):
+        """
+        Decode the preview windows as mono float32 at the native rate
+        
+        Returns:
+            tuple: ([(start_frame, samples), ...], native sample rate, duration in seconds)
+        """
+        try:
+            with timer.stage('decode'):
+                with sf.SoundFile(source) as f:
+                    native_sr, total = f.samplerate, f.frames
+                    window = self._window_frames(total, native_sr)
+                    starts = self._excerpt_starts(f, total, window, native_sr)
+                    windows = []
+                    for start in starts:
+                        f.seek(start)
+                        block = f.read(min(window, total - start), dtype='float32', always_2d=True)
+                        windows.append((start, downmix(block)))
+            return windows, native_sr, total / native_sr
+        except RuntimeError:
+            # soundfile's LibsndfileError: format not readable by libsndfile
+            pass
+        
+        # soundfile cannot read this format: decode everything, then cut the windows
+        if hasattr(source, 'read'):
+            source.seek(0)
+            y, native_sr = self.load_audio_bytes(source.read(), filename or '', timer=timer)
+        else:
+            y, native_sr = self.load_audio(source, timer=timer)
+        window = self._window_frames(len(y), native_sr)
+        starts = self._excerpt_starts(y, len(y), window, native_sr)
+        return [(start, y[start:start + window]) for start in starts], native_sr, len(y) / native_sr
+
+    def _window_frames(self, total, sr):
+        """Excerpt length in frames; tracks shorter than three excerpts are analyzed whole"""
+        window = int(self.preview_window_seconds * sr)
+        return total if total <= 3 * window else window
+
+    def _excerpt_starts(self, source, total, window, sr):
+        """
+        Start frames of the intro, middle and loudest-probe windows
+        
+        source is an open SoundFile (probes are seeked and read) or a
+        decoded signal.
+        """
+        if window >= total:
+            return [0]
+        probe = int(0.5 * sr)
+        probe_starts = np.linspace(window, total - window - probe, self.preview_probes).astype(np.int64)
+        energies = []
+        for start in probe_starts:
+            if isinstance(source, np.ndarray):
+                x = source[start:start + probe]
+            else:
+                source.seek(int(start))
+                x = source.read(probe, dtype='float32', always_2d=True)
+            energies.append(float(np.mean(np.square(x))))
+        
+        intro = 0
+        middle = (total - window) // 2
+        # Loudest probe whose window does not overlap the other two
+        for index in np.argsort(energies)[::-1]:
+            start = int(min(max(probe_starts[index] + probe // 2 - window // 2, 0), total - window))
+            if all(abs(start - other) >= window for other in (intro, middle)):
+                return [intro, middle, start]
+        return [intro, middle]
+
+    def analyze_signal(self, y, sr, timer=None):
+        """
+        Extract Spotify-like features from an already decoded mono signal
+        
+        Args:
+            y (np.ndarray): Audio time series
+            sr (int): Sample rate of y
+            timer (StageTimer): Optional collector of per-stage wall times
+            
+        Returns:
+            dict: Dictionary of extracted features
+        """
+        return self._extract_features(AnalysisContext(y, sr, timer=timer), timer=timer)
+
+    def _extract_features(self, ctx, timer=None):
+        """
+        Build the feature dict from an AnalysisContext or StreamingAnalysisContext
+        
+        With a timer, every estimator and calculator is recorded as its own
+        stage. A stage includes any shared transform (stft, chroma, ...) it
+        was first to request; those are also recorded under their own names.
+        """
+        timer = timer or NULL_TIMER
+        sr = ctx.sr
+        
+        # Extract all features
+        features = {}
+        
+        # Basic properties
+        features['duration_min'] = ctx.n_samples / sr / 60.0
+        
+        # Tempo and beat tracking
+        with timer.stage('tempo'):
+            tempo, beats = ctx.beat_track
+        features['tempo'] = tempo
+        
+        # Time signature (estimate based on beat patterns)
+        features['time_signature'] = self._estimate_time_signature(beats, sr)
+        
+        # Key detection
+        with timer.stage('key'):
+            features['key'] = self._estimate_key(ctx)
+        with timer.stage('mode'):
+            features['mode'] = self._estimate_mode(ctx)
+        
+        # Energy features
+        with timer.stage('energy'):
+            features['energy'] = self._calculate_energy(ctx)
+        with timer.stage('loudness'):
+            features['loudness'] = self._calculate_loudness(ctx)
+        
+        # Spectral features
+        with timer.stage('danceability'):
+            features['danceability'] = self._calculate_danceability(ctx, tempo)
+        with timer.stage('valence'):
+            features['valence'] = self._calculate_valence(ctx)
+        with timer.stage('acousticness'):
+            features['acousticness'] = self._calculate_acousticness(ctx)
+        with timer.stage('instrumentalness'):
+            features['instrumentalness'] = self._calculate_instrumentalness(ctx)
+        with timer.stage('liveness'):
+            features['liveness'] = self._calculate_liveness(ctx)
+        with timer.stage('speechiness'):
+            features['speechiness'] = self._calculate_speechiness(ctx)
+        
+        return features
     
     def _estimate_time_signature(self, beats, sr):
         """Estimate time signature (simplified to 4/4 for most music)"""
@@ -71,22 +736,31 @@ class SpotifyAudioAnalyzer:
         # In a more advanced implementation, you could analyze beat patterns
         return 4
     
-    def _estimate_key(self, y, sr):
+    def _estimate_key(self, ctx):
         """Estimate musical key using chroma features"""
         try:
-            chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-            chroma_mean = np.mean(chroma, axis=1)
+            chroma_mean = ctx.mean('chroma')
+        except Exception:
+            return 5  # Default to F
+        return self._key_from_chroma(chroma_mean)
+    
+    def _key_from_chroma(self, chroma_mean):
+        try:
             key = np.argmax(chroma_mean)
             return int(key)
         except Exception:
             return 5  # Default to F
     
-    def _estimate_mode(self, y, sr):
+    def _estimate_mode(self, ctx):
         """Estimate major (1) or minor (0) mode"""
         try:
-            chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-            chroma_mean = np.mean(chroma, axis=1)
-            
+            chroma_mean = ctx.mean('chroma')
+        except Exception:
+            return 1  # Default to major
+        return self._mode_from_chroma(chroma_mean)
+    
+    def _mode_from_chroma(self, chroma_mean):
+        try:
             # Simple major/minor detection based on chord patterns
             major_profile = [1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1]
             minor_profile = [1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0]
@@ -98,33 +772,34 @@ class SpotifyAudioAnalyzer:
         except Exception:
             return 1  # Default to major
     
-    def _calculate_energy(self, y):
+    def _calculate_energy(self, ctx):
         """Calculate energy as RMS of the signal"""
-        rms = librosa.feature.rms(y=y)[0]
-        energy = np.mean(rms)
+        energy = ctx.mean('rms')
         return float(np.clip(energy * 10, 0, 1))  # Scale to 0-1
     
-    def _calculate_loudness(self, y):
+    def _calculate_loudness(self, ctx):
         """Calculate loudness in dB"""
-        rms = np.sqrt(np.mean(y**2))
+        return self._loudness_from_power(ctx.signal_power)
+    
+    def _loudness_from_power(self, signal_power):
+        rms = np.sqrt(signal_power)
         if rms > 0:
             loudness = 20 * np.log10(rms)
             return float(np.clip(loudness, -30, 5))  # Clip to reasonable range
         return -30.0
     
-    def _calculate_danceability(self, y, sr, tempo):
+    def _calculate_danceability(self, ctx, tempo):
         """Calculate danceability based on rhythm and tempo"""
         try:
             # Beat strength and regularity
-            onset_envelope = librosa.onset.onset_strength(y=y, sr=sr)
-            beat_strength = np.mean(onset_envelope)
+            beat_strength = ctx.mean('onset_envelope')
             
             # Tempo factor (songs around 120 BPM are more danceable)
             tempo_factor = 1 - abs(tempo - 120) / 120
             tempo_factor = max(0, tempo_factor)
             
             # Rhythm regularity
-            beats = librosa.beat.beat_track(y=y, sr=sr)[1]
+            beats = ctx.beat_track[1]
             if len(beats) > 1:
                 beat_intervals = np.diff(beats)
                 rhythm_regularity = 1 - (np.std(beat_intervals) / np.mean(beat_intervals))
@@ -137,18 +812,14 @@ class SpotifyAudioAnalyzer:
         except Exception:
             return 0.5
 
-    def _calculate_valence(self, y, sr):
+    def _calculate_valence(self, ctx):
         """Calculate valence (musical positivity) using spectral features"""
         try:
-            # Use spectral centroid and chroma features
-            spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-            
             # Higher spectral centroid often indicates brighter, happier sound
-            brightness = np.mean(spectral_centroid) / (sr / 2)
+            brightness = ctx.mean('spectral_centroid') / (ctx.sr / 2)
             
             # Major vs minor tendency from chroma
-            chroma_var = np.var(chroma, axis=1)
+            chroma_var = ctx.var('chroma')
             harmony_complexity = np.mean(chroma_var)
             
             valence = (brightness * 0.6 + (1 - harmony_complexity) * 0.4)
@@ -156,16 +827,12 @@ class SpotifyAudioAnalyzer:
         except Exception:
             return 0.5
 
-    def _calculate_acousticness(self, y, sr):
+    def _calculate_acousticness(self, ctx):
         """Calculate acousticness (likelihood of being acoustic)"""
         try:
-            # Use spectral features to detect acoustic vs electric instruments
-            spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0]
-            spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            
             # Acoustic instruments typically have different spectral characteristics
-            rolloff_mean = np.mean(spectral_rolloff) / (sr / 2)
-            centroid_mean = np.mean(spectral_centroid) / (sr / 2)
+            rolloff_mean = ctx.mean('spectral_rolloff') / (ctx.sr / 2)
+            centroid_mean = ctx.mean('spectral_centroid') / (ctx.sr / 2)
             
             # Lower rolloff and centroid often indicate more acoustic sound
             acousticness = 1 - (rolloff_mean * 0.5 + centroid_mean * 0.5)
@@ -173,17 +840,13 @@ class SpotifyAudioAnalyzer:
         except Exception:
             return 0.5
 
-    def _calculate_instrumentalness(self, y, sr):
+    def _calculate_instrumentalness(self, ctx):
         """Calculate instrumentalness (likelihood of no vocals)"""
         try:
             # Detect vocal-like frequencies and patterns
             # Vocals typically appear in 85-255 Hz (fundamental) and harmonics
-            spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-            
             # Vocal detection based on spectral characteristics
-            vocal_range_energy = np.mean(mfccs[1:4])  # MFCC coefficients related to vocal tract
-            spectral_stability = 1 - np.std(spectral_centroid) / np.mean(spectral_centroid)
+            vocal_range_energy = np.mean(ctx.mean('mfcc')[1:4])  # MFCC coefficients related to vocal tract
             
             # Higher instrumentalness if less vocal-like characteristics
             instrumentalness = 1 - abs(vocal_range_energy) * 0.1
@@ -191,33 +854,25 @@ class SpotifyAudioAnalyzer:
         except Exception:
             return 0.5
 
-    def _calculate_liveness(self, y, sr):
+    def _calculate_liveness(self, ctx):
         """Calculate liveness (likelihood of live performance)"""
         try:
             # Live recordings often have more ambient noise and reverb
-            # Use spectral features and dynamics
-            spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)[0]
-            rms = librosa.feature.rms(y=y)[0]
-            
             # Live performances often have more spectral bandwidth variation
-            bandwidth_var = np.var(spectral_bandwidth)
-            dynamics_var = np.var(rms)
+            bandwidth_var = ctx.var('spectral_bandwidth')
+            dynamics_var = ctx.var('rms')
             
             liveness = (bandwidth_var + dynamics_var) * 0.1
             return float(np.clip(liveness, 0, 1))
         except Exception:
             return 0.1
     
-    def _calculate_speechiness(self, y, sr):
+    def _calculate_speechiness(self, ctx):
         """Calculate speechiness (likelihood of spoken words)"""
         try:
             # Speech has different spectral characteristics than music
-            mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-            spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0]
-            
             # Speech typically has specific MFCC patterns
-            speech_mfcc_pattern = np.mean(np.abs(mfccs[1:5]), axis=0)
-            speech_indicator = np.mean(speech_mfcc_pattern)
+            speech_indicator = np.mean(ctx.mean('mfcc_abs')[1:5])
             
             speechiness = speech_indicator * 0.1
             return float(np.clip(speechiness, 0, 1))
@@ -0,0 +1,273 @@
+"""
+Batch audio feature extraction for whole audio libraries
+Runs SpotifyAudioAnalyzer across a process pool and streams results to CSV or Parquet
+
+Usage:
+    python batch_analyze.py music/ -o features.csv --workers 8
+    python batch_analyze.py manifest.txt -o features.parquet --chunksize 32
+
+Re-running with the same output skips files that already have a row, so an
+interrupted run picks up where it stopped.
+"""
+import argparse
+import csv
+import importlib.util
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from audio_analyzer import SpotifyAudioAnalyzer
+from audio_decode import FORMAT_DECODERS
+
+# Same formats the upload route accepts: those with a decoder chain
+AUDIO_EXTENSIONS = set(FORMAT_DECODERS)
+
+FEATURE_COLUMNS = ['duration_min', 'tempo', 'time_signature', 'key', 'mode',
+                   'energy', 'loudness', 'danceability', 'valence', 'acousticness',
+                   'instrumentalness', 'liveness', 'speechiness']
+RESULT_COLUMNS = ['path', 'status', 'error', 'elapsed_sec'] + FEATURE_COLUMNS
+
+# One analyzer per worker process, created by _init_worker
+_analyzer = None
+
+
+def find_audio_files(source):
+    """
+    List the audio files to analyze
+
+    Args:
+        source (str): Directory to scan recursively, or a manifest file
+            (one path per line, or a CSV with a 'path' column)
+
+    Returns:
+        list: Audio file paths in a stable order
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if '.' in name and name.rsplit('.', 1)[1].lower() in AUDIO_EXTENSIONS:
+                    paths.append(os.path.join(root, name))
+        return sorted(paths)
+
+    with open(source, newline='', encoding='utf-8') as f:
+        if source.lower().endswith('.csv'):
+            return [row['path'] for row in csv.DictReader(f) if row.get('path')]
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def _init_worker(sample_rate):
+    global _analyzer
+    _analyzer = SpotifyAudioAnalyzer(sample_rate=sample_rate)
+
+
+def _analyze_chunk(paths):
+    """Analyze a chunk of files in a worker, recording failures instead of raising"""
+    rows = []
+    for path in paths:
+        row = {'path': path, 'status': 'ok', 'error': ''}
+        start = time.perf_counter()
+        try:
+            y, sr = _analyzer.load_audio(path)
+            row.update(_analyzer.analyze_signal(y, sr))
+        except Exception as e:
+            row['status'] = 'error'
+            row['error'] = f'{type(e).__name__}: {e}'
+        row['elapsed_sec'] = round(time.perf_counter() - start, 4)
+        rows.append(row)
+    return rows
+
+
+class CSVResultWriter:
+    """Appends result rows to a CSV file, flushing after every chunk"""
+
+    def __init__(self, path):
+        self.path = path
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            self._truncate_partial_row(path)
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=RESULT_COLUMNS,
+                                      extrasaction='ignore')
+        if is_new:
+            self._writer.writeheader()
+
+    @staticmethod
+    def _truncate_partial_row(path):
+        """Cut off a last row left half-written by a crash, so appended rows start cleanly"""
+        with open(path, 'rb+') as f:
+            end = position = quotes = 0
+            for line in f:
+                position += len(line)
+                quotes += line.count(b'"')
+                # A newline inside a quoted field (odd quote count so far) does not end the row
+                if line.endswith(b'\n') and quotes % 2 == 0:
+                    end = position
+            if end < position:
+                f.truncate(end)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def completed(path):
+        """Map each already-recorded path to its status"""
+        if not os.path.exists(path):
+            return {}
+        done = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                # A crash mid-write can leave a truncated last line
+                if row.get('status') in ('ok', 'error'):
+                    done[row['path']] = row['status']
+        return done
+
+
+class ParquetResultWriter:
+    """
+    Writes result rows as numbered part files inside a directory
+
+    Parquet files cannot be appended to, so each flushed chunk becomes its own
+    part-NNNNN.parquet; the directory reads back as one dataset with pandas.
+    """
+
+    def __init__(self, path):
+        import pandas as pd
+        self._pd = pd
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._next_part = len([n for n in os.listdir(path) if n.endswith('.parquet')])
+
+    def write(self, rows):
+        frame = self._pd.DataFrame(rows, columns=RESULT_COLUMNS)
+        part = os.path.join(self.path, f'part-{self._next_part:05d}.parquet')
+        tmp = part + '.tmp'
+        frame.to_parquet(tmp, index=False)
+        os.replace(tmp, part)
+        self._next_part += 1
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def completed(path):
+        if not os.path.isdir(path):
+            return {}
+        import pandas as pd
+        done = {}
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.parquet'):
+                part = pd.read_parquet(os.path.join(path, name), columns=['path', 'status'])
+                done.update(zip(part['path'], part['status']))
+        return done
+
+
+def parquet_engine_available():
+    """True if pandas can write Parquet (pyarrow or fastparquet is installed)"""
+    return any(importlib.util.find_spec(name) for name in ('pyarrow', 'fastparquet'))
+
+
+def _writer_class(output):
+    return ParquetResultWriter if output.lower().endswith('.parquet') else CSVResultWriter
+
+
+def run_batch(source, output, workers=None, chunksize=8, max_in_flight=None,
+              sample_rate=22050, retry_errors=False, flush_rows=64):
+    """
+    Analyze every audio file under source and stream the features to output
+
+    Args:
+        source (str): Directory or manifest file (see find_audio_files)
+        output (str): Results path; '.parquet' writes a directory of part files,
+            anything else is written as CSV
+        workers (int): Worker processes (defaults to the CPU count)
+        chunksize (int): Files handed to a worker per task
+        max_in_flight (int): Most chunks submitted at once, bounding memory
+            held by pending results (defaults to 2 per worker)
+        sample_rate (int): Analysis sample rate passed to the analyzer
+        retry_errors (bool): Re-analyze files whose previous attempt failed
+        flush_rows (int): Rows buffered before each write to output
+
+    Returns:
+        dict: Counts of analyzed, failed and skipped files
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    writer_cls = _writer_class(output)
+
+    done = writer_cls.completed(output)
+    skip = {p for p, status in done.items() if status == 'ok' or not retry_errors}
+    paths = [p for p in find_audio_files(source) if p not in skip]
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+
+    summary = {'analyzed': 0, 'failed': 0, 'skipped': len(skip)}
+    print(f"Analyzing {len(paths)} files in {len(chunks)} chunks with {workers} workers "
+          f"({len(skip)} already done)")
+
+    writer = writer_cls(output)
+    buffer = []
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(sample_rate,)) as pool:
+            pending = set()
+            chunk_iter = iter(chunks)
+            while True:
+                # Top up to the in-flight limit before waiting on results
+                for chunk in chunk_iter:
+                    pending.add(pool.submit(_analyze_chunk, chunk))
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    break
+
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for row in future.result():
+                        summary['analyzed' if row['status'] == 'ok' else 'failed'] += 1
+                        buffer.append(row)
+                if len(buffer) >= flush_rows:
+                    writer.write(buffer)
+                    buffer = []
+                    total = summary['analyzed'] + summary['failed']
+                    rate = total / (time.perf_counter() - start)
+                    print(f"  {total}/{len(paths)} files ({rate:.1f} files/s)")
+    finally:
+        if buffer:
+            writer.write(buffer)
+        writer.close()
+
+    print(f"Done: {summary['analyzed']} analyzed, {summary['failed']} failed, "
+          f"{summary['skipped']} skipped in {time.perf_counter() - start:.1f}s")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract Spotify-like features for many audio files')
+    parser.add_argument('source', help='Directory to scan or manifest file of paths')
+    parser.add_argument('-o', '--output', default='audio_features.csv',
+                        help='Output .csv file or .parquet directory')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunksize', type=int, default=8, help='Files per submitted task')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Most tasks submitted at once (default: 2 per worker)')
+    parser.add_argument('--sample-rate', type=int, default=22050)
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='Re-analyze files that failed in an earlier run')
+    args = parser.parse_args()
+    if args.output.lower().endswith('.parquet') and not parquet_engine_available():
+        parser.error('a .parquet output needs pyarrow (pip install pyarrow) or fastparquet; '
+                     'use a .csv output instead')
+
+    run_batch(args.source, args.output, workers=args.workers, chunksize=args.chunksize,
+              max_in_flight=args.max_in_flight, sample_rate=args.sample_rate,
+              retry_errors=args.retry_errors)
+
+
+if __name__ == "__main__":
+    main()
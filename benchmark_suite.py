@@ -0,0 +1,546 @@
+"""
+Offline performance benchmarks for the analyzer, the model and the Flask routes
+Generates deterministic synthetic audio locally; no network or dataset download needed
+
+Usage:
+    python benchmark_suite.py -o bench.json                    # full run
+    python benchmark_suite.py --quick -o bench.json            # short fixtures, fewer repeats
+    python benchmark_suite.py -o new.json --compare bench.json # flag regressions vs a baseline
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+import numpy as np
+import soundfile as sf
+
+from audio_analyzer import (PREVIEW_CONTINUOUS_FEATURES, PREVIEW_RATE_SHIFT, AnalysisContext,
+                            SpotifyAudioAnalyzer)
+
+# Analyzer stages timed on a fresh AnalysisContext, so each includes the
+# transforms it needs; the first argument after ctx is bound per stage
+STAGES = ['_estimate_key', '_estimate_mode', '_calculate_energy', '_calculate_loudness',
+          '_calculate_danceability', '_calculate_valence', '_calculate_acousticness',
+          '_calculate_instrumentalness', '_calculate_liveness', '_calculate_speechiness']
+
+SAMPLE_FEATURES = {'year': 2020, 'danceability': 0.6, 'energy': 0.7, 'key': 5,
+                   'loudness': -6.0, 'mode': 1, 'speechiness': 0.05, 'acousticness': 0.2,
+                   'instrumentalness': 0.0, 'liveness': 0.1, 'valence': 0.5, 'tempo': 120.0,
+                   'duration_min': 3.5, 'time_signature': 4, 'genre_encoded': 1}
+
+
+def synthesize(kind, seconds, sr, seed=0):
+    """
+    Deterministic synthetic test signal
+
+    Args:
+        kind (str): 'tone' (A major chord with harmonics), 'clicks' (120 BPM
+            click track), 'noise' (pink-ish noise) or 'mix' (all three)
+        seconds (float): Length
+        sr (int): Sample rate
+        seed (int): Noise seed
+
+    Returns:
+        np.ndarray: float32 mono signal in [-1, 1]
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+
+    def tone():
+        y = np.zeros(n)
+        for f0 in (220.0, 277.18, 329.63):
+            for harmonic in range(1, 5):
+                y += np.sin(2 * np.pi * f0 * harmonic * t) / harmonic
+        return y * (0.6 + 0.4 * np.sin(2 * np.pi * 0.25 * t)) / 6
+
+    def clicks():
+        y = np.zeros(n)
+        click = np.exp(-np.arange(int(0.02 * sr)) / (0.002 * sr)) * np.sin(
+            2 * np.pi * 1000 * np.arange(int(0.02 * sr)) / sr)
+        for start in np.arange(0, n - len(click), int(0.5 * sr)):
+            y[start:start + len(click)] += click
+        return y
+
+    def noise():
+        white = rng.standard_normal(n)
+        # First-order low-pass tilts white noise towards pink
+        return np.convolve(white, np.exp(-np.arange(64) / 8.0), mode='same') * 0.02
+
+    generators = {'tone': tone, 'clicks': clicks, 'noise': noise}
+    if kind == 'mix':
+        y = tone() + 0.5 * clicks() + noise()
+    else:
+        y = generators[kind]()
+    peak = np.max(np.abs(y)) or 1.0
+    return (0.9 * y / peak).astype(np.float32)
+
+
+def wav_bytes(y, sr):
+    buffer = io.BytesIO()
+    sf.write(buffer, y, sr, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+
+def fixture_matrix(quick):
+    """(kind, seconds, sample_rate) combinations for the end-to-end runs"""
+    if quick:
+        return [(kind, 10, 22050) for kind in ('tone', 'clicks', 'noise', 'mix')]
+    fixtures = [(kind, 30, 44100) for kind in ('tone', 'clicks', 'noise')]
+    fixtures += [('mix', seconds, sr) for seconds in (10, 30, 180)
+                 for sr in (22050, 44100, 48000)]
+    return fixtures
+
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    ms = np.asarray(samples) * 1e3
+    return {'n': len(ms), 'median_ms': round(float(np.median(ms)), 4),
+            'p95_ms': round(float(np.percentile(ms, 95)), 4),
+            'mean_ms': round(float(np.mean(ms)), 4), 'min_ms': round(float(np.min(ms)), 4)}
+
+
+def time_calls(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_analyzer(results, quick, workdir):
+    analyzer = SpotifyAudioAnalyzer()
+    repeats = 2 if quick else 3
+
+    for kind, seconds, sr in fixture_matrix(quick):
+        path = os.path.join(workdir, f'{kind}_{seconds}s_{sr}.wav')
+        sf.write(path, synthesize(kind, seconds, sr), sr, subtype='PCM_16')
+        name = f'analyzer.analyze_audio_file[{kind},{seconds}s,{sr}Hz]'
+        results[name] = summarize(time_calls(lambda: analyzer.analyze_audio_file(path), repeats))
+        print(f"  {name}: {results[name]['median_ms']:.1f} ms")
+
+    # Per-stage costs on one representative fixture
+    seconds = 10 if quick else 30
+    path = os.path.join(workdir, f'stages_{seconds}s.wav')
+    sf.write(path, synthesize('mix', seconds, 44100), 44100, subtype='PCM_16')
+    results['analyzer.stage.decode'] = summarize(time_calls(lambda: analyzer.load_audio(path),
+                                                            repeats))
+    y, sr = analyzer.load_audio(path)
+    results['analyzer.stage.beat_track'] = summarize(time_calls(
+        lambda: AnalysisContext(y, sr).beat_track, repeats))
+    tempo = AnalysisContext(y, sr).beat_track[0]
+    for stage in STAGES:
+        method = getattr(analyzer, stage)
+        if stage == '_calculate_danceability':
+            call = lambda: method(AnalysisContext(y, sr), tempo)
+        else:
+            call = lambda: method(AnalysisContext(y, sr))
+        results[f'analyzer.stage.{stage}'] = summarize(time_calls(call, repeats))
+    for name in [k for k in results if k.startswith('analyzer.stage.')]:
+        print(f"  {name}: {results[name]['median_ms']:.1f} ms")
+
+
+def structured_song(seconds, sr):
+    """Quiet and loud sections in turn, so excerpt choice matters"""
+    sections = [('tone', 0.3), ('mix', 0.9), ('tone', 0.3), ('mix', 1.0), ('noise', 0.4), ('mix', 0.9)]
+    length = seconds / len(sections)
+    return np.concatenate([gain * synthesize(kind, length, sr, seed=i)
+                           for i, (kind, gain) in enumerate(sections)]).astype(np.float32)
+
+
+def preview_rate_shift(analyzer, workdir, seconds=25):
+    """
+    Root-mean-square fast-vs-full difference per feature on short clips
+
+    Fast mode analyzes a clip this short as one window covering the whole
+    track, so the only difference left is the lower preview sample rate.
+    These are the values to ship as audio_analyzer.PREVIEW_RATE_SHIFT.
+    """
+    diffs = {name: [] for name in PREVIEW_CONTINUOUS_FEATURES}
+    for sr in (22050, 44100, 48000):
+        clips = [(kind, synthesize(kind, seconds, sr, seed=sr))
+                 for kind in ('tone', 'clicks', 'noise', 'mix')]
+        clips.append(('song', structured_song(seconds, sr)))
+        for kind, y in clips:
+            path = os.path.join(workdir, f'rate_shift_{kind}_{sr}.wav')
+            sf.write(path, y, sr, subtype='PCM_16')
+            full = analyzer.analyze_audio_file(path)
+            fast = analyzer.analyze_audio_file(path, mode='fast')
+            for name in diffs:
+                diffs[name].append(fast[name] - full[name])
+    return {name: round(float(np.sqrt(np.mean(np.square(values)))), 4)
+            for name, values in diffs.items()}
+
+
+def bench_preview(results, quick, workdir):
+    """
+    Time fast (excerpt) analysis against full analysis and measure its error
+
+    Returns:
+        dict: Per fixture, the speedup and absolute error of each feature,
+            plus the measured sample-rate shift under 'rate_shift'
+    """
+    analyzer = SpotifyAudioAnalyzer()
+    repeats = 2 if quick else 3
+    fixtures = [('song', 60, 44100)] if quick else [('song', 180, 44100), ('song', 300, 48000),
+                                                     ('mix', 180, 44100)]
+    errors = {}
+    for kind, seconds, sr in fixtures:
+        y = structured_song(seconds, sr) if kind == 'song' else synthesize(kind, seconds, sr)
+        path = os.path.join(workdir, f'preview_{kind}_{seconds}s_{sr}.wav')
+        sf.write(path, y, sr, subtype='PCM_16')
+        label = f'{kind},{seconds}s,{sr}Hz'
+        full_samples = time_calls(lambda: analyzer.analyze_audio_file(path), repeats)
+        fast_samples = time_calls(lambda: analyzer.analyze_audio_file(path, mode='fast'), repeats)
+        results[f'analyzer.full[{label}]'] = summarize(full_samples)
+        results[f'analyzer.fast[{label}]'] = summarize(fast_samples)
+
+        full = analyzer.analyze_audio_file(path)
+        fast = analyzer.analyze_audio_file(path, mode='fast')
+        errors[label] = {
+            'speedup': round(float(np.median(full_samples) / np.median(fast_samples)), 2),
+            'abs_error': {name: round(abs(fast[name] - full[name]), 4)
+                          for name in full if isinstance(full[name], (int, float))},
+            'estimated_error': fast['preview']['estimated_error'],
+        }
+        print(f"  {label}: full {np.median(full_samples) * 1e3:.0f} ms, fast "
+              f"{np.median(fast_samples) * 1e3:.0f} ms ({errors[label]['speedup']}x)")
+
+    errors['rate_shift'] = preview_rate_shift(analyzer, workdir)
+    stale = {name: value for name, value in errors['rate_shift'].items()
+             if value and abs(value - PREVIEW_RATE_SHIFT.get(name, 0.0)) > 0.25 * value}
+    print(f"  rate shift: {errors['rate_shift']}")
+    if stale:
+        print(f"  PREVIEW_RATE_SHIFT differs by over 25% for {sorted(stale)}; consider updating it")
+    return errors
+
+
+# (extension, soundfile format, subtype) for the decode fixtures; m4a/aac need ffmpeg
+DECODE_FORMATS = [('wav', 'WAV', 'PCM_16'), ('flac', 'FLAC', 'PCM_16'), ('ogg', 'OGG', 'VORBIS'),
+                  ('mp3', 'MP3', 'MPEG_LAYER_III'), ('m4a', None, None), ('aac', None, None)]
+
+
+def encode_fixture(y, sr, extension, fmt, subtype, workdir):
+    """Encoded bytes of a stereo fixture, or None if no encoder is available"""
+    if fmt is not None:
+        buffer = io.BytesIO()
+        try:
+            # Block-wise: libsndfile's Vorbis encoder crashes on one very large write
+            with sf.SoundFile(buffer, 'w', sr, y.shape[1], subtype, format=fmt) as f:
+                for start in range(0, len(y), sr):
+                    f.write(y[start:start + sr])
+        except (sf.LibsndfileError, ValueError):
+            return None
+        return buffer.getvalue()
+    wav = os.path.join(workdir, 'decode_source.wav')
+    out = os.path.join(workdir, f'decode_fixture.{extension}')
+    sf.write(wav, y, sr, subtype='PCM_16')
+    try:
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', wav, '-c:a', 'aac', out],
+                       check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    with open(out, 'rb') as f:
+        return f.read()
+
+
+def bench_decode(results, quick, workdir):
+    """
+    Decode + resample time per upload format: librosa.load against the
+    analyzer's decoder at its default (HQ) and fastest (QQ) soxr quality
+
+    Returns:
+        dict: Per format, the decoder chain and median milliseconds per path,
+            or the reason it was skipped
+    """
+    import librosa
+
+    sr, seconds = 44100, 30 if quick else 180
+    repeats = 3 if quick else 5
+    mono = synthesize('mix', seconds, sr)
+    y = np.stack([mono, np.roll(mono, 441)], axis=1)
+    paths = {'librosa.load': None,
+             'decoder[HQ]': SpotifyAudioAnalyzer(resample_quality='HQ'),
+             'decoder[QQ]': SpotifyAudioAnalyzer(resample_quality='QQ')}
+
+    report = {}
+    for extension, fmt, subtype in DECODE_FORMATS:
+        data = encode_fixture(y, sr, extension, fmt, subtype, workdir)
+        if data is None:
+            report[extension] = {'skipped': 'no encoder available'}
+            print(f"  {extension}: skipped (no encoder available)")
+            continue
+        path = os.path.join(workdir, f'decode.{extension}')
+        with open(path, 'wb') as f:
+            f.write(data)
+        report[extension] = {'decoders': list(paths['decoder[HQ]'].decoder.decoders_for(extension))}
+        for name, analyzer in paths.items():
+            if analyzer is None:
+                call = lambda: librosa.load(path, sr=22050)
+            else:
+                call = lambda: analyzer.load_audio_bytes(data, f'song.{extension}')
+            try:
+                samples = time_calls(call, repeats)
+            except Exception as e:
+                report[extension][name] = f'failed: {e}'
+                continue
+            results[f'decode.{name}[{extension},{seconds}s]'] = summarize(samples)
+            report[extension][name] = round(float(np.median(samples)) * 1e3, 1)
+        print(f"  {extension}: " + ', '.join(f'{name} {report[extension][name]} ms'
+                                               for name in paths
+                                               if isinstance(report[extension].get(name), float)))
+    return report
+
+
+def bench_model(results, quick, app_module):
+    model, scaler = app_module.model, app_module.scaler
+    rng = np.random.default_rng(0)
+    base = np.array([[SAMPLE_FEATURES[name] for name in app_module.FEATURE_NAMES]])
+    for rows in ((1, 100, 1000) if quick else (1, 10, 100, 1000, 10000)):
+        X = base + rng.normal(0, 0.01, size=(rows, base.shape[1]))
+        repeats = 20 if rows <= 100 else 5
+        if model is not None:
+            name = f'model.sklearn_predict[{rows}]'
+            results[name] = summarize(time_calls(lambda: model.predict(scaler.transform(X)),
+                                                 repeats))
+            print(f"  {name}: {results[name]['median_ms']:.3f} ms")
+        name = f'model.predict_popularity[{rows}]'
+        results[name] = summarize(time_calls(lambda: app_module.predict_popularity(X), repeats))
+        print(f"  {name}: {results[name]['median_ms']:.3f} ms")
+
+
+def bench_http(results, quick, app_module):
+    client = app_module.app.test_client()
+    n = 20 if quick else 100
+
+    def run(name, call, requests=n):
+        samples = time_calls(call, requests)
+        results[name] = summarize(samples)
+        results[name]['requests_per_sec'] = round(len(samples) / sum(samples), 2)
+        print(f"  {name}: {results[name]['median_ms']:.2f} ms, "
+              f"{results[name]['requests_per_sec']:.0f} req/s")
+
+    run('http.predict', lambda: client.post('/api/predict', json=SAMPLE_FEATURES))
+    run('http.songs', lambda: client.get('/api/songs'))
+    if app_module.data is not None and len(app_module.data):
+        row = app_module.data.iloc[0]
+        url = f"/api/song/{quote(row['artist_name'], safe='')}/{quote(row['track_name'], safe='')}"
+        run('http.song', lambda: client.get(url))
+
+    # Fresh audio per request measures analysis; repeated audio measures the cache
+    sr, seconds = 22050, 10
+    uploads = iter([wav_bytes(synthesize('mix', seconds, sr, seed=1000 + i), sr)
+                    for i in range(4 if quick else 10)])
+    post = lambda audio: client.post('/api/analyze_audio',
+                                     data={'audio_file': (io.BytesIO(audio), 'bench.wav')},
+                                     content_type='multipart/form-data')
+    # Each upload is used once, including the warm-up call
+    run('http.analyze_audio', lambda: post(next(uploads)), requests=(4 if quick else 10) - 1)
+    cached = wav_bytes(synthesize('mix', seconds, sr, seed=999), sr)
+    run('http.analyze_audio_cached', lambda: post(cached))
+
+
+# Run in a fresh interpreter per measurement: import the app, wait until
+# /api/ready answers 200, then time two uploads of different audio. Prints
+# {"error": ...} instead if the model is not loaded or readiness times out
+COLDSTART_SCRIPT = """
+import io, json, sys, tempfile, time
+ready_timeout = float(sys.argv[1])
+start = time.perf_counter()
+import app_with_audio
+imported = time.perf_counter() - start
+client = app_with_audio.app.test_client()
+while True:
+    status = client.get('/api/ready')
+    if status.status_code == 200:
+        break
+    if not status.get_json()['model_loaded']:
+        print(json.dumps({'error': 'model files not loaded'}))
+        sys.exit(0)
+    if time.perf_counter() - start > ready_timeout:
+        print(json.dumps({'error': f'not ready after {ready_timeout:.0f}s'}))
+        sys.exit(0)
+    time.sleep(0.05)
+ready = time.perf_counter() - start
+app_with_audio.feature_cache.cache_dir = tempfile.mkdtemp()
+latencies = []
+for path in sys.argv[2:]:
+    with open(path, 'rb') as f:
+        audio = f.read()
+    t = time.perf_counter()
+    response = client.post('/api/analyze_audio', data={'audio_file': (io.BytesIO(audio), 'cold.wav')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    latencies.append(time.perf_counter() - t)
+print(json.dumps({'import_sec': imported, 'ready_sec': ready, 'latencies': latencies}))
+"""
+
+
+def bench_coldstart(results, quick, workdir, ready_timeout=300):
+    """
+    First-upload latency of a freshly started server, with and without warm-up
+
+    Args:
+        ready_timeout (float): Seconds a server may take to report ready;
+            the whole run is given twice that
+
+    Returns:
+        dict: Per setting, seconds to import the app and to become ready, the
+            first and second upload latency, and ready + first upload (time
+            to the first fast response); or the error that stopped the run
+    """
+    sr, seconds = 44100, 10 if quick else 30
+    paths = []
+    for i in range(2):
+        path = os.path.join(workdir, f'coldstart_{i}.wav')
+        sf.write(path, synthesize('mix', seconds, sr, seed=2000 + i), sr, subtype='PCM_16')
+        paths.append(path)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH', '')]))
+
+    report = {}
+    for warmup in ('off', 'on'):
+        env['SPOTIFY_WARMUP'] = '1' if warmup == 'on' else '0'
+        try:
+            output = subprocess.run([sys.executable, '-c', COLDSTART_SCRIPT, str(ready_timeout),
+                                     *paths], env=env, capture_output=True, text=True, check=True,
+                                    timeout=2 * ready_timeout).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+        except subprocess.TimeoutExpired:
+            run = {'error': f'timed out after {2 * ready_timeout}s'}
+        if 'error' in run:
+            print(f"  warm-up {warmup}: skipped, {run['error']}")
+            report[warmup] = {'error': run['error']}
+            if run['error'] == 'model files not loaded':
+                break  # The other setting would fail the same way
+            continue
+        first, second = run['latencies']
+        results[f'coldstart.first_upload[warmup={warmup}]'] = summarize([first])
+        report[warmup] = {'import_sec': round(run['import_sec'], 3),
+                          'ready_sec': round(run['ready_sec'], 3),
+                          'first_upload_ms': round(first * 1e3, 1),
+                          'second_upload_ms': round(second * 1e3, 1),
+                          'first_fast_response_sec': round(run['ready_sec'] + first, 3)}
+        print(f"  warm-up {warmup}: ready after {run['ready_sec']:.2f}s, first upload "
+              f"{first * 1e3:.0f} ms, second {second * 1e3:.0f} ms")
+    return report
+
+
+def environment():
+    import librosa
+    import sklearn
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'librosa': librosa.__version__,
+            'sklearn': sklearn.__version__, 'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare median latencies against a baseline run
+
+    Returns:
+        list: (name, baseline_ms, current_ms, ratio) for every regression
+    """
+    regressions = []
+    print(f"\n{'benchmark':<60} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else 1.0
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append((name, previous['median_ms'], current['median_ms'], ratio))
+        print(f"{name:<60} {previous['median_ms']:>10.3f} {current['median_ms']:>10.3f} "
+              f"{(ratio - 1) * 100:>+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analyzer, model and routes')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--quick', action='store_true', help='Short fixtures, fewer repeats')
+    parser.add_argument('--only', default='analyzer,preview,decode,model,http,coldstart',
+                        help='Comma-separated groups to run '
+                             '(analyzer, preview, decode, model, http, coldstart)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='Baseline JSON; exits 1 if any median regresses past --threshold')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown before flagging (0.25 = 25%%)')
+    args = parser.parse_args()
+    groups = set(args.only.split(','))
+
+    results = {}
+    report = {}
+    if 'analyzer' in groups:
+        print("Analyzer:")
+        with tempfile.TemporaryDirectory() as workdir:
+            bench_analyzer(results, args.quick, workdir)
+    if 'preview' in groups:
+        print("Fast mode vs full:")
+        with tempfile.TemporaryDirectory() as workdir:
+            report['preview_accuracy'] = bench_preview(results, args.quick, workdir)
+    if 'decode' in groups:
+        print("Decode and resample:")
+        with tempfile.TemporaryDirectory() as workdir:
+            report['decode'] = bench_decode(results, args.quick, workdir)
+
+    if groups & {'model', 'http'}:
+        # The startup warm-up would run on a background thread during the
+        # timings; the benchmarks warm up each call themselves
+        os.environ['SPOTIFY_WARMUP'] = '0'
+        import app_with_audio
+        # Likewise let the background index, sampler and score loading finish
+        for thread in (app_with_audio.song_sampler_thread, app_with_audio.similarity_index_thread,
+                       app_with_audio.catalog_scores_thread):
+            if thread.is_alive():
+                thread.join()
+        if app_with_audio.scaler is None:
+            print("Model files not loaded; skipping model and HTTP benchmarks")
+        else:
+            # Time analysis, not the persistent cache left by earlier runs
+            with tempfile.TemporaryDirectory() as cache_dir:
+                app_with_audio.feature_cache.cache_dir = cache_dir
+                if 'model' in groups:
+                    print("Model:")
+                    bench_model(results, args.quick, app_with_audio)
+                if 'http' in groups:
+                    print("HTTP:")
+                    bench_http(results, args.quick, app_with_audio)
+
+    if 'coldstart' in groups:
+        print("Cold start:")
+        with tempfile.TemporaryDirectory() as workdir:
+            report['coldstart'] = bench_coldstart(results, args.quick, workdir)
+
+    report.update({'environment': environment(), 'quick': args.quick, 'results': results})
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('quick') != args.quick:
+            print("Warning: baseline and current run use different --quick settings")
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
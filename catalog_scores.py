@@ -0,0 +1,338 @@
+"""
+Bulk scoring of the whole catalog with residuals and per-genre error summaries
+Streams the dataset through the app's cleaning rules and scores chunks across worker processes
+
+Usage:
+    python catalog_scores.py                      # score data/spotify_data.csv into data/catalog_scores/
+    python catalog_scores.py --workers 4 --chunk-rows 50000
+    python catalog_scores.py --check              # is the output current for the model files?
+
+The output is a directory of .npy columns (song_key, popularity,
+genre_encoded, predicted, residual) in dataset order, plus summary.json with
+the per-genre errors and the hashes of the model files and CSV it was made
+from. Run it again after every retrain; the app serves the results once
+they match its model files.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from dataset_pipeline import (CHUNK_ROWS, COUNT_COLUMNS, SongKeySet, count_genres,
+                              prepare_chunks, read_chunks, song_keys, valid_genres)
+from dataset_snapshot import FEATURE_NAMES, file_sha256, replace_dir
+from forest_engine import load_engine, model_files_hash, model_files_match, model_files_stamps
+
+SCORES_VERSION = 2  # 2: scored on float64 features
+SCORES_DIR = 'data/catalog_scores'
+
+SCORE_DTYPES = {
+    'song_key': 'uint64',
+    'popularity': 'int8',
+    'genre_encoded': 'int16',
+    'predicted': 'float32',
+    'residual': 'float32',  # actual - predicted
+}
+
+# One model per worker process, loaded by _init_worker
+_predict = None
+
+
+def _init_worker(use_engine):
+    """Load the model once per worker; the engine's arrays are shared through mmap"""
+    global _predict
+    engine = load_engine(mmap_mode='r') if use_engine else None
+    if engine is not None:
+        _predict = engine.predict
+        return
+    model = joblib.load('spotify_popularity_model.pkl')
+    scaler = joblib.load('spotify_scaler.pkl')
+    model.n_jobs = 1  # Parallelism comes from the worker processes
+    _predict = lambda X: model.predict(scaler.transform(X))
+
+
+def _score_chunk(matrix):
+    """Predicted popularity for a feature matrix, clipped to 0-100 as the app does"""
+    predictions = _predict(matrix)
+    return np.clip(predictions, 0, 100).astype(np.float32)
+
+
+class GenreErrors:
+    """
+    Running error sums per genre code
+
+    Only sums are kept (count, residuals, absolute and squared residuals,
+    actual values and their squares), so chunks can be added as they are
+    scored and the summary costs a few floats per genre.
+
+    Args:
+        n_genres (int): Number of genre codes
+    """
+
+    SUMS = ('n', 'residual', 'abs_residual', 'sq_residual', 'actual', 'sq_actual')
+
+    def __init__(self, n_genres):
+        self.sums = {name: np.zeros(n_genres) for name in self.SUMS}
+
+    def add(self, genre_encoded, actual, residual):
+        size = len(self.sums['n'])
+        actual = actual.astype(np.float64)
+        residual = residual.astype(np.float64)
+        for name, weights in (('n', None), ('residual', residual),
+                              ('abs_residual', np.abs(residual)), ('sq_residual', residual ** 2),
+                              ('actual', actual), ('sq_actual', actual ** 2)):
+            self.sums[name] += np.bincount(genre_encoded, weights=weights, minlength=size)
+
+    @staticmethod
+    def _summary(n, residual, abs_residual, sq_residual, actual, sq_actual):
+        if not n:
+            return None
+        variance = sq_actual - actual ** 2 / n
+        return {
+            'n': int(n),
+            'mean_actual': round(actual / n, 4),
+            'mean_predicted': round((actual - residual) / n, 4),
+            'bias': round(residual / n, 4),  # > 0: the model under-predicts
+            'mae': round(abs_residual / n, 4),
+            'rmse': round(float(np.sqrt(sq_residual / n)), 4),
+            'r2': round(1 - sq_residual / variance, 4) if variance > 0 else None,
+        }
+
+    def summary(self, genre_names):
+        """Errors per genre name (genres without rows are left out) and over all rows"""
+        per_genre = {}
+        for code, name in enumerate(genre_names):
+            entry = self._summary(*(self.sums[s][code] for s in self.SUMS))
+            if entry is not None:
+                per_genre[str(name)] = entry
+        overall = self._summary(*(float(self.sums[s].sum()) for s in self.SUMS))
+        return per_genre, overall
+
+
+def score_catalog(csv_path='data/spotify_data.csv', output=SCORES_DIR,
+                  encoder_path='spotify_genre_encoder.pkl', workers=None, chunk_rows=CHUNK_ROWS,
+                  max_in_flight=None, use_engine=True):
+    """
+    Score every cleaned catalog row and write predictions and residuals
+
+    Rows go through the same two-pass pipeline as the dataset snapshot
+    (cleaning, genre filter, encoder, deduplication), so the output lines up
+    with the rows the app serves. Chunks are scored in a process pool with
+    at most max_in_flight outstanding and are written back in file order;
+    memory is bounded by the chunks in flight plus 19 bytes per output row.
+
+    Args:
+        csv_path (str): Source dataset
+        output (str): Output directory, replaced atomically when done
+        encoder_path (str): Fitted LabelEncoder used for genre_encoded
+        workers (int): Worker processes (defaults to the CPU count)
+        chunk_rows (int): CSV rows parsed and scored at a time
+        max_in_flight (int): Most chunks submitted at once (defaults to 2 per worker)
+        use_engine (bool): Score with the forest engine when it is current for
+            the model files, else with the sklearn model
+
+    Returns:
+        dict: The summary written to summary.json
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    genre_encoder = joblib.load(encoder_path)
+    genre_names = [str(name) for name in genre_encoder.classes_]
+    stat = os.stat(csv_path)
+    model_stamps = model_files_stamps()
+
+    genre_counts = count_genres(read_chunks(csv_path, chunk_rows, COUNT_COLUMNS))
+    genres = valid_genres(genre_counts, genre_encoder)
+    counted_at = time.perf_counter()
+
+    columns = {name: [] for name in SCORE_DTYPES}
+    errors = GenreErrors(len(genre_names))
+    stats = {}
+
+    def collect(chunk, future):
+        predicted = future.result()
+        actual = chunk['popularity'].to_numpy()
+        residual = actual - predicted
+        genre_encoded = chunk['genre_encoded'].to_numpy()
+        columns['song_key'].append(song_keys(chunk))
+        columns['popularity'].append(actual)
+        columns['genre_encoded'].append(genre_encoded)
+        columns['predicted'].append(predicted)
+        columns['residual'].append(residual)
+        errors.add(genre_encoded, actual, residual)
+        scored = sum(len(c) for c in columns['predicted'])
+        print(f"  {scored:,} rows scored ({scored / (time.perf_counter() - counted_at):,.0f} rows/s)")
+
+    print(f"Scoring {csv_path} with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(use_engine,)) as pool:
+        pending = deque()
+        for chunk in prepare_chunks(read_chunks(csv_path, chunk_rows), genres, genre_encoder,
+                                    SongKeySet(), stats):
+            if not len(chunk):
+                continue
+            # Only the model inputs and the few output columns cross to the workers
+            chunk = chunk[['track_name', 'artist_name', 'popularity', *FEATURE_NAMES]]
+            matrix = chunk[FEATURE_NAMES].to_numpy(dtype=np.float64)
+            pending.append((chunk, pool.submit(_score_chunk, matrix)))
+            # Results are collected oldest first so the output keeps file order
+            if len(pending) >= max_in_flight:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+
+    tmp_dir = f'{output}.tmp-{os.getpid()}'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    n_rows = 0
+    for name, dtype in SCORE_DTYPES.items():
+        values = (np.concatenate(columns[name]).astype(dtype, copy=False) if columns[name]
+                  else np.empty(0, dtype=dtype))
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), values)
+        n_rows = len(values)
+
+    per_genre, overall = errors.summary(genre_names)
+    seconds = time.perf_counter() - start
+    summary = {
+        'version': SCORES_VERSION,
+        'n_rows': n_rows,
+        'model_sha256': model_files_hash(),
+        'model_stamps': model_stamps,
+        'encoder_sha256': file_sha256(encoder_path),
+        'source': {'path': os.path.abspath(csv_path), 'sha256': file_sha256(csv_path),
+                   'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+        'genre_names': genre_names,
+        'overall': overall,
+        'genres': per_genre,
+        'stats': stats,
+        'workers': workers,
+        'seconds': round(seconds, 2),
+        'rows_per_sec': round(n_rows / seconds, 1) if seconds else None,
+    }
+    with open(os.path.join(tmp_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    replace_dir(tmp_dir, output)
+    return summary
+
+
+def read_summary(scores_dir=SCORES_DIR):
+    try:
+        with open(os.path.join(scores_dir, 'summary.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def scores_are_current(scores_dir=SCORES_DIR, csv_path='data/spotify_data.csv',
+                       encoder_path='spotify_genre_encoder.pkl'):
+    """
+    Check the scores against the model files, encoder and CSV they were made from
+
+    As with the snapshot, the CSV is only re-hashed when its size or mtime
+    changed, and a deployment without the raw CSV counts as current.
+    """
+    summary = read_summary(scores_dir)
+    if summary is None or summary.get('version') != SCORES_VERSION:
+        return False
+    if not model_files_match(summary['model_sha256'], summary.get('model_stamps')):
+        return False
+    if summary['encoder_sha256'] != file_sha256(encoder_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    source, stat = summary['source'], os.stat(csv_path)
+    if stat.st_size == source['size'] and stat.st_mtime_ns == source['mtime_ns']:
+        return True
+    return file_sha256(csv_path) == source['sha256']
+
+
+class CatalogScores:
+    """
+    Memory-mapped catalog scores with lookup by song
+
+    Args:
+        scores_dir (str): Directory written by score_catalog
+    """
+
+    def __init__(self, scores_dir=SCORES_DIR):
+        self.summary = read_summary(scores_dir)
+        if self.summary is None:
+            raise FileNotFoundError(f"No catalog scores in {scores_dir}")
+        self.columns = {name: np.load(os.path.join(scores_dir, f'{name}.npy'), mmap_mode='r')
+                        for name in SCORE_DTYPES}
+        self._order = np.argsort(self.columns['song_key'], kind='stable')
+        self._sorted_keys = self.columns['song_key'][self._order]
+
+    def __len__(self):
+        return self.summary['n_rows']
+
+    def lookup(self, artist, track):
+        """Predicted popularity and residual for one song, or None if it was not scored"""
+        key = song_keys(pd.DataFrame({'track_name': [track], 'artist_name': [artist]}))[0]
+        i = np.searchsorted(self._sorted_keys, key)
+        if i == len(self._sorted_keys) or self._sorted_keys[i] != key:
+            return None
+        row = self._order[i]
+        return {'predicted_popularity': round(float(self.columns['predicted'][row]), 3),
+                'residual': round(float(self.columns['residual'][row]), 3)}
+
+    def frame(self):
+        """All scores as a DataFrame with the genre names decoded"""
+        frame = pd.DataFrame(self.columns, copy=False)
+        frame['genre'] = pd.Categorical.from_codes(frame['genre_encoded'],
+                                                   categories=self.summary['genre_names'])
+        return frame
+
+
+def load_current_scores(scores_dir=SCORES_DIR):
+    """CatalogScores if present and made with the current model files, else None"""
+    if not scores_are_current(scores_dir):
+        if read_summary(scores_dir) is not None:
+            print(f"Ignoring stale catalog scores in {scores_dir}; rerun catalog_scores.py")
+        return None
+    return CatalogScores(scores_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score the whole catalog and summarize errors by genre')
+    parser.add_argument('--csv', default='data/spotify_data.csv')
+    parser.add_argument('-o', '--output', default=SCORES_DIR)
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='Most chunks submitted at once (default: 2 per worker)')
+    parser.add_argument('--sklearn', action='store_true',
+                        help='Score with the sklearn model even if the forest engine is current')
+    parser.add_argument('--check', action='store_true',
+                        help='Only report whether the scores are current; exits 1 if not')
+    args = parser.parse_args()
+
+    if args.check:
+        current = scores_are_current(args.output, args.csv)
+        print(f"Catalog scores in {args.output} are {'current' if current else 'missing or stale'}")
+        raise SystemExit(0 if current else 1)
+
+    summary = score_catalog(args.csv, args.output, workers=args.workers,
+                            chunk_rows=args.chunk_rows, max_in_flight=args.max_in_flight,
+                            use_engine=not args.sklearn)
+    overall = summary['overall'] or {}
+    print(f"Wrote {summary['n_rows']:,} rows to {args.output}/ in {summary['seconds']}s "
+          f"({summary['rows_per_sec']:,} rows/s); MAE {overall.get('mae')}, "
+          f"RMSE {overall.get('rmse')}, R² {overall.get('r2')}")
+    worst = sorted(summary['genres'].items(), key=lambda item: -item[1]['mae'])[:5]
+    for genre, entry in worst:
+        print(f"  {genre:<20} n={entry['n']:>7,}  MAE {entry['mae']:.2f}  bias {entry['bias']:+.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Chunked preparation pipeline for the Spotify dataset
+Streams the CSV with explicit dtypes so memory stays bounded by the chunk size
+
+The cleaning rules live here once and are shared by the dataset snapshot
+(and through it the Flask app, the forest engine benchmark and the model data
+export):
+
+    1. drop rows without an artist or track name
+    2. keep rows with popularity > 0
+    3. duration_min = duration_ms / 60000
+    4. keep genres with at least MIN_GENRE_COUNT rows after steps 1-2
+    5. keep the first row of every (track_name, artist_name) pair
+
+Step 4 needs counts over the whole file before any row can be kept, so the
+CSV is read twice: pass one only counts genres, pass two filters, encodes and
+deduplicates. Duplicates are found through 64-bit hashes of the pair held in a
+sorted array, 8 bytes per distinct song, instead of a set of Python strings.
+"""
+import numpy as np
+import pandas as pd
+
+MIN_GENRE_COUNT = 1000
+CHUNK_ROWS = 100_000
+
+# Parse straight into the snapshot's dtypes: integers are narrowed, audio features
+# stay float64 so served and scored values are the CSV's. The index column is skipped
+CSV_DTYPES = {
+    'artist_name': 'object',
+    'track_name': 'object',
+    'track_id': 'object',
+    'genre': 'category',
+    'popularity': 'int8',
+    'year': 'int16',
+    'danceability': 'float64',
+    'energy': 'float64',
+    'key': 'int8',
+    'loudness': 'float64',
+    'mode': 'int8',
+    'speechiness': 'float64',
+    'acousticness': 'float64',
+    'instrumentalness': 'float64',
+    'liveness': 'float64',
+    'valence': 'float64',
+    'tempo': 'float64',
+    'duration_ms': 'int32',
+    'time_signature': 'int8',
+}
+
+
+# All the genre-counting pass needs to parse
+COUNT_COLUMNS = ['artist_name', 'track_name', 'popularity', 'genre']
+
+
+def read_chunks(csv_path, chunk_rows=CHUNK_ROWS, columns=None):
+    """Yield the CSV (or just the given columns) as DataFrames of at most chunk_rows rows"""
+    columns = list(columns or CSV_DTYPES)
+    with pd.read_csv(csv_path, usecols=columns, dtype={c: CSV_DTYPES[c] for c in columns},
+                     chunksize=chunk_rows) as reader:
+        yield from reader
+
+
+def clean_chunk(chunk):
+    """Apply the row-level cleaning rules (1-3) to one chunk"""
+    chunk = chunk.dropna(subset=['artist_name', 'track_name'])
+    chunk = chunk[chunk['popularity'] > 0].copy()
+    if 'duration_ms' in chunk:
+        chunk['duration_min'] = chunk['duration_ms'] / 60000
+    return chunk
+
+
+def count_genres(chunks, counts=None):
+    """
+    First pass: rows per genre after the row-level cleaning rules
+
+    Args:
+        chunks (iterable): Raw DataFrame chunks, at least COUNT_COLUMNS
+        counts (dict): Existing counts to add to, e.g. from earlier batches
+
+    Returns:
+        dict: genre -> row count
+    """
+    counts = dict(counts or {})
+    for chunk in chunks:
+        for genre, n in clean_chunk(chunk)['genre'].value_counts().items():
+            if n:
+                counts[genre] = counts.get(genre, 0) + int(n)
+    return counts
+
+
+def valid_genres(genre_counts, genre_encoder, min_count=MIN_GENRE_COUNT):
+    """
+    Genres frequent enough to keep that the encoder can also encode
+
+    A frequent genre the encoder was not fit on cannot be given a
+    genre_encoded value, so it is left out with a warning until the model is
+    retrained.
+    """
+    frequent = {genre for genre, n in genre_counts.items() if n >= min_count}
+    known = set(genre_encoder.classes_)
+    unknown = sorted(frequent - known)
+    if unknown:
+        print(f"Skipping genres the encoder was not fit on: {', '.join(unknown)}")
+    return sorted(frequent & known)
+
+
+def song_keys(chunk):
+    """64-bit hash of (track_name, artist_name) per row"""
+    return pd.util.hash_pandas_object(chunk[['track_name', 'artist_name']],
+                                      index=False).to_numpy()
+
+
+class SongKeySet:
+    """
+    Hashes of the songs already kept, as a sorted uint64 array
+
+    Args:
+        keys (np.ndarray): Previously saved keys (sorted), or None to start empty
+    """
+
+    def __init__(self, keys=None):
+        self.keys = np.asarray(keys if keys is not None else [], dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_new(self, keys):
+        """
+        Add a chunk's keys, reporting which rows are first occurrences
+
+        Args:
+            keys (np.ndarray): Row hashes in file order
+
+        Returns:
+            np.ndarray: Boolean mask, True for rows whose song was not seen
+                before (earlier in this chunk or in any previous one)
+        """
+        unique, first = np.unique(keys, return_index=True)
+        if len(self.keys):
+            position = np.searchsorted(self.keys, unique).clip(max=len(self.keys) - 1)
+            fresh = self.keys[position] != unique
+            unique, first = unique[fresh], first[fresh]
+        mask = np.zeros(len(keys), dtype=bool)
+        mask[first] = True
+        # unique is sorted, so one insert keeps the array sorted in O(n)
+        self.keys = np.insert(self.keys, np.searchsorted(self.keys, unique), unique)
+        return mask
+
+
+def prepare_chunks(chunks, genres, genre_encoder, seen, stats=None):
+    """
+    Second pass: clean, filter genres, encode and deduplicate
+
+    Args:
+        chunks (iterable): Raw DataFrame chunks
+        genres (list): Genres to keep (see valid_genres)
+        genre_encoder: Fitted LabelEncoder for genre_encoded
+        seen (SongKeySet): Songs already kept; updated in place
+        stats (dict): Optional counters, updated with rows_read, rows_cleaned,
+            rows_genre_filtered, duplicates and rows_kept
+
+    Yields:
+        pd.DataFrame: Prepared rows of each chunk, in file order
+    """
+    stats = stats if stats is not None else {}
+    for name in ('rows_read', 'rows_cleaned', 'rows_genre_filtered', 'duplicates', 'rows_kept'):
+        stats.setdefault(name, 0)
+    keep_genres = pd.Index(genres)
+
+    for chunk in chunks:
+        stats['rows_read'] += len(chunk)
+        chunk = clean_chunk(chunk)
+        stats['rows_cleaned'] += len(chunk)
+        in_genre = chunk['genre'].isin(keep_genres).to_numpy()
+        stats['rows_genre_filtered'] += int((~in_genre).sum())
+        chunk = chunk[in_genre]
+
+        first = seen.add_new(song_keys(chunk))
+        stats['duplicates'] += int((~first).sum())
+        chunk = chunk[first].copy()
+
+        # Encode each distinct genre of the chunk once, then map the codes
+        genre = chunk['genre'].cat.remove_unused_categories()
+        encoded = genre_encoder.transform(genre.cat.categories.astype(str))
+        chunk['genre_encoded'] = encoded[genre.cat.codes.to_numpy()].astype('int16')
+        chunk['genre'] = genre.astype(str)
+        stats['rows_kept'] += len(chunk)
+        yield chunk
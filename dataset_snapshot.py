@@ -0,0 +1,513 @@
+"""
+Preprocessed columnar snapshot of the Spotify dataset for fast server startup
+
+The CSV is streamed through dataset_pipeline.py in chunks and written as one
+.npy file per column (narrowed integer dtypes, categorical strings), which is
+memory-mapped on load, so worker restarts skip the CSV parse and share pages
+through the OS cache. The snapshot is rebuilt whenever the source CSV or the
+genre encoder changes; batches of new tracks can be appended without it.
+
+Usage:
+    python dataset_snapshot.py                         # build or refresh data/snapshot/
+    python dataset_snapshot.py --append new_tracks.csv # add a batch of new tracks
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from dataset_pipeline import (CHUNK_ROWS, COUNT_COLUMNS, MIN_GENRE_COUNT, SongKeySet,
+                              count_genres, prepare_chunks, read_chunks, valid_genres)
+
+SNAPSHOT_VERSION = 3
+SNAPSHOT_DIR = 'data/snapshot'
+
+# Model input columns, in the order the scaler and model were fit on
+FEATURE_NAMES = ['year', 'danceability', 'energy', 'key', 'loudness', 'mode',
+                 'speechiness', 'acousticness', 'instrumentalness', 'liveness',
+                 'valence', 'tempo', 'duration_min', 'time_signature', 'genre_encoded']
+
+# The columns the app serves; only the CSV's index column is dropped. Integers
+# are narrowed losslessly; floats stay float64, since float32 would change the
+# values /api/song returns and the model scores
+NUMERIC_DTYPES = {
+    'popularity': 'int8',
+    'year': 'int16',
+    'danceability': 'float64',
+    'energy': 'float64',
+    'key': 'int8',
+    'loudness': 'float64',
+    'mode': 'int8',
+    'speechiness': 'float64',
+    'acousticness': 'float64',
+    'instrumentalness': 'float64',
+    'liveness': 'float64',
+    'valence': 'float64',
+    'tempo': 'float64',
+    'duration_ms': 'int32',
+    'duration_min': 'float64',
+    'time_signature': 'int8',
+    'genre_encoded': 'int16',
+}
+STRING_COLUMNS = ['artist_name', 'track_name', 'track_id', 'genre']
+
+# Separator for the packed category strings of a column
+_STRING_SEP = '\x00'
+
+# Column files carry a fixed-size header so rows can be appended in place
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+_NPY_HEADER_BYTES = 128
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Hex SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _npy_header(dtype, n_rows):
+    """
+    Fixed-size .npy header for a 1-D array
+
+    The header is padded to _NPY_HEADER_BYTES so the shape can be rewritten
+    in place as rows are appended, whatever the final row count.
+    """
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                   'fortran_order': False, 'shape': (int(n_rows),)})
+    body_len = _NPY_HEADER_BYTES - len(_NPY_MAGIC) - 2
+    body = (header.ljust(body_len - 1) + '\n').encode('latin1')
+    return _NPY_MAGIC + struct.pack('<H', body_len) + body
+
+
+class _ColumnFile:
+    """One appendable .npy column"""
+
+    def __init__(self, path, dtype, create=False):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        if create:
+            with open(path, 'wb') as f:
+                f.write(_npy_header(self.dtype, 0))
+        self.n_rows = (os.path.getsize(path) - _NPY_HEADER_BYTES) // self.dtype.itemsize
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        with open(self.path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(values.tobytes())
+            self.n_rows += len(values)
+            f.seek(0)
+            f.write(_npy_header(self.dtype, self.n_rows))
+
+
+class _CategoryCodes:
+    """
+    Code lookup for one string column by 64-bit hash of each category
+
+    Keeps two sorted arrays (hash, code), 16 bytes per distinct string,
+    instead of a dict of Python strings, and is saved next to the column so
+    appended batches reuse the existing codes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            self.hashes, self.codes = np.load(path)
+        else:
+            self.hashes = np.empty(0, dtype=np.uint64)
+            self.codes = np.empty(0, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def encode(self, categories):
+        """
+        Codes for distinct strings, assigning new codes to unseen ones
+
+        Returns:
+            tuple: (codes, is_new) arrays aligned with categories
+        """
+        hashes = pd.util.hash_array(np.asarray(categories, dtype=object))
+        known = np.zeros(len(hashes), dtype=bool)
+        codes = np.empty(len(hashes), dtype=np.uint64)
+        if len(self.hashes):
+            position = np.searchsorted(self.hashes, hashes).clip(max=len(self.hashes) - 1)
+            known = self.hashes[position] == hashes
+            codes[known] = self.codes[position[known]]
+        is_new = ~known
+        codes[is_new] = len(self.hashes) + np.arange(is_new.sum(), dtype=np.uint64)
+        if is_new.any():
+            order = np.argsort(hashes[is_new])
+            new_hashes, new_codes = hashes[is_new][order], codes[is_new][order]
+            position = np.searchsorted(self.hashes, new_hashes)
+            self.hashes = np.insert(self.hashes, position, new_hashes)
+            self.codes = np.insert(self.codes, position, new_codes)
+        return codes.astype(np.int64), is_new
+
+    def save(self):
+        np.save(self.path, np.stack([self.hashes, self.codes]))
+
+
+class SnapshotWriter:
+    """
+    Appends prepared chunks to the column files of a snapshot directory
+
+    Numeric columns are appended as raw bytes. String columns are stored as
+    int32 codes plus packed category strings; only strings not seen in
+    earlier chunks are appended, so the writer holds one chunk of strings at
+    a time plus the hash lookup of each column.
+
+    Args:
+        snapshot_dir (str): Directory to write into
+        create (bool): Start empty columns instead of extending existing ones
+    """
+
+    def __init__(self, snapshot_dir, create=False):
+        self.snapshot_dir = snapshot_dir
+        self.numeric = {name: _ColumnFile(os.path.join(snapshot_dir, f'{name}.npy'), dtype, create)
+                        for name, dtype in NUMERIC_DTYPES.items()}
+        self.codes = {name: _ColumnFile(os.path.join(snapshot_dir, f'{name}.codes.npy'),
+                                        np.int32, create)
+                      for name in STRING_COLUMNS}
+        self.categories = {}
+        for name in STRING_COLUMNS:
+            if create:
+                open(self._categories_path(name), 'wb').close()
+            self.categories[name] = _CategoryCodes(
+                os.path.join(snapshot_dir, f'{name}.category_hashes.npy'))
+
+    @property
+    def n_rows(self):
+        return self.numeric['popularity'].n_rows
+
+    def _categories_path(self, name):
+        return os.path.join(self.snapshot_dir, f'{name}.categories')
+
+    def append(self, chunk):
+        for name, column in self.numeric.items():
+            column.append(chunk[name].to_numpy())
+        for name in STRING_COLUMNS:
+            local_codes, categories = pd.factorize(chunk[name])
+            categories = [str(c) for c in categories]
+            if any(_STRING_SEP in c for c in categories):
+                raise ValueError(f"Column {name} contains NUL characters and cannot be packed")
+            lookup = self.categories[name]
+            had_categories = len(lookup) > 0
+            codes, is_new = lookup.encode(categories)
+            self.codes[name].append(np.where(local_codes >= 0, codes[local_codes], -1))
+            new = [c for c, fresh in zip(categories, is_new) if fresh]
+            if new:
+                with open(self._categories_path(name), 'ab') as f:
+                    f.write(((_STRING_SEP if had_categories else '') + _STRING_SEP.join(new))
+                            .encode('utf-8'))
+
+    def close(self):
+        """Save the category lookups; returns the manifest's column entries"""
+        columns = {name: {'kind': 'numeric', 'dtype': dtype}
+                   for name, dtype in NUMERIC_DTYPES.items()}
+        for name in STRING_COLUMNS:
+            self.categories[name].save()
+            columns[name] = {'kind': 'categorical', 'n_categories': len(self.categories[name])}
+        return columns
+
+
+def _fresh_dir(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+
+def replace_dir(tmp_dir, target_dir):
+    """
+    Move a finished directory to target_dir, replacing any previous one
+
+    os.replace cannot replace a non-empty directory, so the old one is
+    renamed aside first and deleted only once the new one is in place:
+    target_dir never holds a mix of old and new files, and running servers
+    keep their memory maps of the old files valid. The old directory goes
+    into a fresh '<target>.old-*' directory, unique even between concurrent
+    writers; sweep_old_dirs removes any left behind by a crash.
+    """
+    target_dir = os.path.normpath(target_dir)
+    aside = None
+    if os.path.exists(target_dir):
+        aside = tempfile.mkdtemp(prefix=f'{os.path.basename(target_dir)}.old-',
+                                 dir=os.path.dirname(target_dir) or '.')
+        os.replace(target_dir, os.path.join(aside, 'previous'))
+    try:
+        os.replace(tmp_dir, target_dir)
+    except OSError:
+        if aside is not None:
+            os.replace(os.path.join(aside, 'previous'), target_dir)
+            os.rmdir(aside)
+        raise
+    if aside is not None:
+        shutil.rmtree(aside, ignore_errors=True)
+
+
+def sweep_old_dirs(target_dir):
+    """Remove '<target>.old-*' directories that replace_dir left behind when interrupted"""
+    target_dir = os.path.normpath(target_dir)
+    parent = os.path.dirname(target_dir) or '.'
+    prefix = f'{os.path.basename(target_dir)}.old-'
+    if not os.path.isdir(parent):
+        return
+    for entry in os.scandir(parent):
+        if entry.name.startswith(prefix) and entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _write_manifest(snapshot_dir, manifest):
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def build_snapshot(csv_path='data/spotify_data.csv', snapshot_dir=SNAPSHOT_DIR,
+                   encoder_path='spotify_genre_encoder.pkl', chunk_rows=CHUNK_ROWS,
+                   reapply_batches=True):
+    """
+    Stream the CSV through the preparation pipeline into a columnar snapshot
+
+    Memory is bounded by chunk_rows plus about 24 bytes per distinct song
+    (the deduplication and category hashes), not by the size of the CSV.
+
+    Args:
+        csv_path (str): Source dataset
+        snapshot_dir (str): Output directory, replaced atomically when done
+        encoder_path (str): Fitted LabelEncoder used for genre_encoded
+        chunk_rows (int): CSV rows parsed at a time
+        reapply_batches (bool): Append again the batches recorded in the
+            previous snapshot whose files still exist
+
+    Returns:
+        dict: The snapshot manifest
+    """
+    start = time.perf_counter()
+    genre_encoder = joblib.load(encoder_path)
+    stamp = _source_stamp(csv_path)
+    source_hash = file_sha256(csv_path)
+    previous = read_manifest(snapshot_dir) if reapply_batches else None
+
+    genre_counts = count_genres(read_chunks(csv_path, chunk_rows, COUNT_COLUMNS))
+    genres = valid_genres(genre_counts, genre_encoder)
+
+    sweep_old_dirs(snapshot_dir)
+    tmp_dir = f'{snapshot_dir}.tmp-{os.getpid()}'
+    _fresh_dir(tmp_dir)
+    writer = SnapshotWriter(tmp_dir, create=True)
+    seen = SongKeySet()
+    stats = {}
+    for chunk in prepare_chunks(read_chunks(csv_path, chunk_rows), genres, genre_encoder,
+                                seen, stats):
+        writer.append(chunk)
+    np.save(os.path.join(tmp_dir, 'song_keys.npy'), seen.keys)
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'n_rows': writer.n_rows,
+        'columns': writer.close(),
+        'source': {'path': os.path.abspath(csv_path), 'sha256': source_hash, **stamp},
+        'encoder_sha256': file_sha256(encoder_path),
+        'min_genre_count': MIN_GENRE_COUNT,
+        'genre_counts': genre_counts,
+        'genres': genres,
+        'stats': stats,
+        'batches': [],
+        'build_seconds': round(time.perf_counter() - start, 2),
+    }
+    _write_manifest(tmp_dir, manifest)
+    replace_dir(tmp_dir, snapshot_dir)
+
+    for batch in (previous or {}).get('batches', []):
+        if os.path.exists(batch['path']) and file_sha256(batch['path']) == batch['sha256']:
+            manifest = append_batch(batch['path'], snapshot_dir, encoder_path, chunk_rows)
+        else:
+            print(f"Appended batch {batch['path']} is gone or changed; not re-applied")
+    return manifest
+
+
+def append_batch(csv_path, snapshot_dir=SNAPSHOT_DIR, encoder_path='spotify_genre_encoder.pkl',
+                 chunk_rows=CHUNK_ROWS):
+    """
+    Add a CSV of new tracks to an existing snapshot without re-reading the history
+
+    The batch goes through the same cleaning rules. Its songs are
+    deduplicated against everything already in the snapshot using the saved
+    song hashes, and only rows of the snapshot's kept genres are added. Genre
+    counts are updated; a genre that reaches MIN_GENRE_COUNT only through
+    appended batches is reported but not added, because its earlier rows were
+    filtered out and only a full rebuild (and retraining) can bring them back.
+
+    The snapshot is extended in a copy and swapped into place, so processes
+    that have it memory-mapped keep reading consistent files.
+
+    Args:
+        csv_path (str): Batch CSV with the same columns as the source dataset
+        snapshot_dir (str): Snapshot to extend
+        encoder_path (str): Fitted LabelEncoder used for genre_encoded
+        chunk_rows (int): CSV rows parsed at a time
+
+    Returns:
+        dict: The updated manifest
+    """
+    start = time.perf_counter()
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or manifest.get('version') != SNAPSHOT_VERSION:
+        raise FileNotFoundError(f"No current dataset snapshot in {snapshot_dir}; build one first")
+    genre_encoder = joblib.load(encoder_path)
+    if file_sha256(encoder_path) != manifest['encoder_sha256']:
+        raise ValueError("Genre encoder changed since the snapshot was built; rebuild it")
+
+    genre_counts = count_genres(read_chunks(csv_path, chunk_rows, COUNT_COLUMNS),
+                                manifest['genre_counts'])
+    newly_frequent = sorted(set(valid_genres(genre_counts, genre_encoder))
+                            - set(manifest['genres']))
+    if newly_frequent:
+        print(f"Genres now above {MIN_GENRE_COUNT} rows: {', '.join(newly_frequent)}; "
+              f"rebuild the snapshot to include them")
+
+    tmp_dir = f'{snapshot_dir}.tmp-{os.getpid()}'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    shutil.copytree(snapshot_dir, tmp_dir)
+    writer = SnapshotWriter(tmp_dir)
+    seen = SongKeySet(np.load(os.path.join(tmp_dir, 'song_keys.npy')))
+    stats = {}
+    for chunk in prepare_chunks(read_chunks(csv_path, chunk_rows), manifest['genres'],
+                                genre_encoder, seen, stats):
+        writer.append(chunk)
+    np.save(os.path.join(tmp_dir, 'song_keys.npy'), seen.keys)
+
+    manifest['n_rows'] = writer.n_rows
+    manifest['columns'] = writer.close()
+    manifest['genre_counts'] = genre_counts
+    manifest['batches'].append({
+        'path': os.path.abspath(csv_path),
+        'sha256': file_sha256(csv_path),
+        'stats': stats,
+        'seconds': round(time.perf_counter() - start, 2),
+    })
+    _write_manifest(tmp_dir, manifest)
+    replace_dir(tmp_dir, snapshot_dir)
+    return manifest
+
+
+def read_manifest(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_is_current(csv_path='data/spotify_data.csv', snapshot_dir=SNAPSHOT_DIR,
+                        encoder_path='spotify_genre_encoder.pkl'):
+    """
+    Check the snapshot against its sources
+
+    Size and mtime are compared first; the CSV is only re-hashed when they
+    differ, so an unchanged dataset costs two stat calls.
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None or manifest.get('version') != SNAPSHOT_VERSION:
+        return False
+    if manifest['encoder_sha256'] != file_sha256(encoder_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True  # Snapshot deployed without the raw CSV
+    source = manifest['source']
+    stamp = _source_stamp(csv_path)
+    if stamp['size'] == source['size'] and stamp['mtime_ns'] == source['mtime_ns']:
+        return True
+    return file_sha256(csv_path) == source['sha256']
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR, mmap=True):
+    """
+    Load a snapshot as a DataFrame
+
+    Args:
+        snapshot_dir (str): Directory written by build_snapshot
+        mmap (bool): Memory-map numeric columns instead of reading them into RAM
+
+    Returns:
+        pd.DataFrame: Cleaned dataset with categorical string columns
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No dataset snapshot in {snapshot_dir}")
+
+    columns = {}
+    for name, info in manifest['columns'].items():
+        if info['kind'] == 'numeric':
+            columns[name] = np.load(os.path.join(snapshot_dir, f'{name}.npy'),
+                                    mmap_mode='r' if mmap else None)
+        else:
+            codes = np.load(os.path.join(snapshot_dir, f'{name}.codes.npy'))
+            with open(os.path.join(snapshot_dir, f'{name}.categories'), 'rb') as f:
+                packed = f.read().decode('utf-8')
+            categories = packed.split(_STRING_SEP) if info['n_categories'] else []
+            columns[name] = pd.Categorical.from_codes(codes, categories=categories,
+                                                      validate=False)
+    # copy=False keeps the memory-mapped arrays as the column storage
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_dataset(csv_path='data/spotify_data.csv', snapshot_dir=SNAPSHOT_DIR,
+                 encoder_path='spotify_genre_encoder.pkl', mmap=True):
+    """Load the snapshot, rebuilding it first if the CSV or encoder changed"""
+    if not snapshot_is_current(csv_path, snapshot_dir, encoder_path):
+        print(f"Building dataset snapshot in {snapshot_dir} (one-time)...")
+        manifest = build_snapshot(csv_path, snapshot_dir, encoder_path)
+        print(f"Snapshot built: {manifest['n_rows']:,} rows in {manifest['build_seconds']}s")
+    return load_snapshot(snapshot_dir, mmap=mmap)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or extend the dataset snapshot')
+    parser.add_argument('--csv', default='data/spotify_data.csv')
+    parser.add_argument('--append', metavar='CSV',
+                        help='Add a batch of new tracks to the existing snapshot')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild even if the snapshot is up to date')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.append:
+        manifest = append_batch(args.append, chunk_rows=args.chunk_rows)
+        batch = manifest['batches'][-1]
+        print(f"Appended {batch['stats']['rows_kept']:,} of {batch['stats']['rows_read']:,} rows "
+              f"({batch['stats']['duplicates']:,} duplicates) in {batch['seconds']}s; "
+              f"snapshot now has {manifest['n_rows']:,} rows")
+    elif not args.rebuild and snapshot_is_current(args.csv):
+        print(f"Snapshot in {SNAPSHOT_DIR} is up to date")
+        return
+    else:
+        manifest = build_snapshot(args.csv, chunk_rows=args.chunk_rows)
+        stats = manifest['stats']
+        print(f"Wrote {manifest['n_rows']:,} rows to {SNAPSHOT_DIR} "
+              f"in {manifest['build_seconds']}s ({stats['rows_read']:,} read, "
+              f"{stats['duplicates']:,} duplicates dropped)")
+    import resource  # Unix only; the rest of the module is portable
+    # ru_maxrss is KiB on Linux
+    print(f"Peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,314 @@
 """
-Export model data to JSON for client-side use
+Export model data for client-side use
+Writes the Random Forest as a quantized typed-array binary and the sample songs as small JSON shards
+
+Usage:
+    python export_model_data.py                   # model_data.json, forest and song shards in model_export/
+    python export_model_data.py --budget-kb 1024  # prune the forest to fit 1 MB
 """
-import pandas as pd
-import numpy as np
-import joblib
+import argparse
+import hashlib
 import json
+import os
+
+import joblib
+import numpy as np
+
+from dataset_snapshot import FEATURE_NAMES
+from forest_engine import fold_thresholds
+
+EXPORT_DIR = 'model_export'
+FOREST_BUDGET_KB = 2048
+MIN_DEPTH = 8  # Depth pruning stops here; past it whole trees are dropped
+SONG_SAMPLE = 2000
+SHARD_SIZE = 100
+SONG_COLUMNS = ['artist_name', 'track_name', 'popularity', 'genre', 'year', 'danceability',
+                'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_min', 'time_signature']
+
+# Binary layout, widest type first so every typed array view is aligned.
+# Child links >= 0 are internal nodes, negative links are ~leaf index.
+FOREST_SECTIONS = (('threshold', '<f4'), ('left', '<i4'), ('right', '<i4'),
+                   ('roots', '<i4'), ('leaf_value', '<u2'), ('feature', 'u1'))
+INTERNAL_NODE_BYTES = 13  # threshold, left, right, feature
+LEAF_BYTES = 2
+ROOT_BYTES = 4
+
+
+def _node_depths(tree):
+    """Depth of every node of an sklearn tree, one vectorized step per level"""
+    depth = np.zeros(tree.node_count, dtype=np.int32)
+    left, right = tree.children_left, tree.children_right
+    frontier = np.array([0])
+    level = 0
+    while len(frontier):
+        depth[frontier] = level
+        internal = frontier[left[frontier] >= 0]
+        frontier = np.concatenate([left[internal], right[internal]])
+        level += 1
+    return depth
+
+
+def forest_bytes(n_internal, n_trees):
+    """Size of an exported forest; every tree has one more leaf than internal nodes"""
+    return (n_internal * INTERNAL_NODE_BYTES + (n_internal + n_trees) * LEAF_BYTES
+            + n_trees * ROOT_BYTES)
+
+
+def choose_pruning(model, budget_bytes, max_trees=None, max_depth=None, min_depth=MIN_DEPTH):
+    """
+    Largest forest that fits the size budget
+
+    Trees are first cut to shallower depths (an internal node at the cut
+    becomes a leaf holding its mean), down to min_depth; if that is still
+    too big, trees are dropped from the end.
+
+    Args:
+        model: Fitted RandomForestRegressor
+        budget_bytes (int): Size limit of the exported binary
+        max_trees (int): Optional cap on the number of trees
+        max_depth (int): Optional cap on the depth
+
+    Returns:
+        tuple: (n_trees, max_depth)
+    """
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    levels = max(tree.max_depth for tree in trees)
+    # counts[t, d]: internal nodes of tree t at depth d
+    counts = np.zeros((len(trees), max(levels, 1)), dtype=np.int64)
+    for t, tree in enumerate(trees):
+        depth = _node_depths(tree)[tree.children_left >= 0]
+        counts[t] += np.bincount(depth, minlength=counts.shape[1])
+
+    n_trees = len(trees) if max_trees is None else min(max_trees, len(trees))
+    depth = levels if max_depth is None else min(max_depth, levels)
+    floor = min(min_depth, depth)
+    for d in range(depth, floor - 1, -1):
+        if forest_bytes(int(counts[:n_trees, :d].sum()), n_trees) <= budget_bytes:
+            return n_trees, d
+
+    sizes = np.cumsum([forest_bytes(int(n), 1) for n in counts[:n_trees, :floor].sum(axis=1)])
+    fitting = int(np.searchsorted(sizes, budget_bytes, side='right'))
+    if fitting == 0:
+        raise ValueError(f"A single tree of depth {floor} does not fit in {budget_bytes:,} bytes")
+    return fitting, floor
+
+
+def flatten_forest(model, scaler, n_trees, max_depth):
+    """
+    Node arrays of the first n_trees trees cut at max_depth, with raw-space thresholds
+
+    Returns:
+        dict: feature, threshold, left, right, roots and leaf_value arrays
+    """
+    parts = {name: [] for name in ('feature', 'threshold', 'left', 'right', 'leaf_value')}
+    roots = []
+    n_internal = n_leaves = 0
+    for estimator in model.estimators_[:n_trees]:
+        tree = estimator.tree_
+        depth = _node_depths(tree)
+        kept = depth <= max_depth
+        internal = kept & (tree.children_left >= 0) & (depth < max_depth)
+        leaf = kept & ~internal
+        # Exported reference of every original node: internal index or ~leaf index
+        ref = np.where(internal, np.cumsum(internal) - 1 + n_internal,
+                       ~(np.cumsum(leaf) - 1 + n_leaves))
+        nodes = np.flatnonzero(internal)
+        parts['feature'].append(tree.feature[nodes])
+        parts['threshold'].append(tree.threshold[nodes])
+        parts['left'].append(ref[tree.children_left[nodes]])
+        parts['right'].append(ref[tree.children_right[nodes]])
+        parts['leaf_value'].append(tree.value[leaf, 0, 0])
+        roots.append(ref[0])
+        n_internal += len(nodes)
+        n_leaves += int(leaf.sum())
+
+    arrays = {name: np.concatenate(values) for name, values in parts.items()}
+    arrays['roots'] = np.array(roots)
+    # Folded in blocks to bound the bisection's temporaries
+    for start in range(0, n_internal, 1 << 20):
+        block = slice(start, start + (1 << 20))
+        arrays['threshold'][block] = fold_thresholds(arrays['threshold'][block],
+                                                     arrays['feature'][block],
+                                                     scaler.mean_, scaler.scale_)
+    return arrays
+
+
+def encode_forest(arrays):
+    """
+    Quantize and pack flattened forest arrays into one binary
+
+    Thresholds become the largest float32 not above them, which keeps every
+    decision exact for float32-valued inputs. Leaf values become uint16
+    steps between the smallest and largest leaf.
+
+    Returns:
+        tuple: (bytes, layout dict with section offsets and the leaf value scale)
+    """
+    values = arrays['leaf_value']
+    value_min = float(values.min())
+    value_step = float(values.max() - value_min) / 65535 or 1.0
+    threshold = arrays['threshold'].astype(np.float32)
+    above = threshold.astype(np.float64) > arrays['threshold']
+    threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+    quantized = dict(arrays, threshold=threshold,
+                     leaf_value=np.round((values - value_min) / value_step))
+
+    blobs, layout, offset = [], {}, 0
+    for name, dtype in FOREST_SECTIONS:
+        blob = np.ascontiguousarray(quantized[name], dtype=dtype).tobytes()
+        layout[name] = [offset, len(quantized[name])]
+        blobs.append(blob)
+        offset += len(blob)
+    return b''.join(blobs), {'sections': layout, 'value_min': value_min, 'value_step': value_step}
+
+
+def decode_forest(data, layout):
+    """Arrays of an encoded forest, as the browser reads them"""
+    return {name: np.frombuffer(data, dtype=dtype, count=layout['sections'][name][1],
+                                offset=layout['sections'][name][0])
+            for name, dtype in FOREST_SECTIONS}
+
+
+def predict_exported(arrays, layout, X):
+    """Reference for the browser's predictPopularity: raw feature rows through the exported forest"""
+    X = np.asarray(X, dtype=np.float64)
+    rows = np.arange(len(X))[:, None]
+    node = np.broadcast_to(arrays['roots'].astype(np.int64), (len(X), len(arrays['roots'])))
+    while (node >= 0).any():
+        active = node >= 0
+        at = np.where(active, node, 0)
+        go_left = X[rows, arrays['feature'][at]] <= arrays['threshold'][at]
+        node = np.where(active, np.where(go_left, arrays['left'][at], arrays['right'][at]), node)
+    steps = arrays['leaf_value'][~node].astype(np.float64).sum(axis=1)
+    return layout['value_min'] + steps / len(arrays['roots']) * layout['value_step']
+
+
+def content_name(stem, data, suffix):
+    """File name carrying a hash of its content, so browsers can cache it forever"""
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}"
+
+
+def compact_json(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def export_forest(model, scaler, genre_encoder, output_dir, budget_kb=FOREST_BUDGET_KB,
+                  max_trees=None, max_depth=None, X_check=None):
+    """
+    Write the forest binary and return the model part of model_data.json
+
+    Args:
+        model, scaler, genre_encoder: The three fitted pickles
+        output_dir (str): Directory for the binary
+        budget_kb (int): Size limit of the binary in KiB
+        max_trees (int): Optional cap on the number of trees
+        max_depth (int): Optional cap on tree depth
+        X_check (np.ndarray): Optional raw feature rows to measure the
+            exported forest's error against the full model
+
+    Returns:
+        tuple: (list of written file names, dict for model_data.json)
+    """
+    n_trees, depth = choose_pruning(model, budget_kb * 1024, max_trees, max_depth)
+    data, layout = encode_forest(flatten_forest(model, scaler, n_trees, depth))
+    name = content_name('forest', data, '.bin')
+    with open(os.path.join(output_dir, name), 'wb') as f:
+        f.write(data)
+
+    forest = {'url': name, 'n_trees': n_trees, 'n_trees_full': len(model.estimators_),
+              'max_depth': depth, 'bytes': len(data), **layout}
+    if X_check is not None and len(X_check):
+        exported = predict_exported(decode_forest(data, layout), layout, X_check)
+        full = model.predict(scaler.transform(X_check))
+        error = np.abs(exported - full)
+        forest['fidelity'] = {'rows': len(X_check), 'mae': round(float(error.mean()), 4),
+                              'max_error': round(float(error.max()), 4)}
+
+    model_part = {
+        'feature_names': FEATURE_NAMES,
+        'genre_mapping': {genre: idx for idx, genre in enumerate(genre_encoder.classes_)},
+        # Used by the pages' approximate fallback when the forest cannot be loaded
+        'feature_importance': model.feature_importances_.tolist(),
+        'scaler_mean': scaler.mean_.tolist(),
+        'scaler_scale': scaler.scale_.tolist(),
+        'base_popularity': 50,
+        'forest': forest,
+    }
+    return [name], model_part
+
+
+def sample_songs(data, n_songs=SONG_SAMPLE, seed=0):
+    """Fixed random sample of song records, floats rounded to 4 decimals"""
+    sample = data.sample(min(n_songs, len(data)), random_state=seed)[SONG_COLUMNS].copy()
+    for column in sample.columns:
+        if sample[column].dtype.kind == 'f':
+            sample[column] = sample[column].astype(np.float64).round(4)
+    return sample.to_dict('records')
+
+
+def export_songs(data, output_dir, n_songs=SONG_SAMPLE, shard_size=SHARD_SIZE, seed=0):
+    """
+    Write the song sample as JSON shards of shard_size songs
+
+    Returns:
+        tuple: (list of written file names, dict for model_data.json). The
+            first shard is also inlined as sample_songs so the page can show
+            songs without a second request.
+    """
+    songs = sample_songs(data, n_songs, seed)
+    os.makedirs(os.path.join(output_dir, 'songs'), exist_ok=True)
+    names = []
+    for start in range(0, len(songs), shard_size):
+        blob = compact_json(songs[start:start + shard_size])
+        name = 'songs/' + content_name(f'songs-{start // shard_size:03d}', blob, '.json')
+        with open(os.path.join(output_dir, name), 'wb') as f:
+            f.write(blob)
+        names.append(name)
+    return names, {'song_shards': names, 'sample_songs': songs[:shard_size]}
+
+
+def export_model_data(output_dir=EXPORT_DIR, budget_kb=FOREST_BUDGET_KB, max_trees=None,
+                      max_depth=None, n_songs=SONG_SAMPLE, shard_size=SHARD_SIZE):
+    """Export the forest, the song shards and model_data.json into output_dir"""
+    from dataset_snapshot import load_dataset
 
-def export_model_data():
-    """Export model coefficients and sample data to JSON"""
-    
-    # Load model components
     model = joblib.load('spotify_popularity_model.pkl')
     scaler = joblib.load('spotify_scaler.pkl')
     genre_encoder = joblib.load('spotify_genre_encoder.pkl')
-    
-    # Load and prepare data
-    data = pd.read_csv('data/spotify_data.csv')
-    data = data.dropna(subset=['artist_name', 'track_name'])
-    data = data[data['popularity'] > 0]
-    data['duration_min'] = data['duration_ms'] / 60000
-    
-    # Filter valid genres
-    genre_counts = data['genre'].value_counts()
-    valid_genres = genre_counts[genre_counts >= 1000].index.tolist()
-    data = data[data['genre'].isin(valid_genres)]
-    
-    # Get sample songs (500 random songs)
-    sample_songs = data.sample(500)[['artist_name', 'track_name', 'popularity', 'genre', 
-                                    'year', 'danceability', 'energy', 'key', 'loudness', 
-                                    'mode', 'speechiness', 'acousticness', 'instrumentalness', 
-                                    'liveness', 'valence', 'tempo', 'duration_min', 'time_signature']].to_dict('records')
-    
-    # Extract Random Forest parameters (simplified prediction)
-    # We'll use feature importance and create a simplified linear model
-    feature_importance = model.feature_importances_
-    
-    # Get scaler parameters
-    scaler_mean = scaler.mean_.tolist()
-    scaler_scale = scaler.scale_.tolist()
-    
-    # Get genre mapping
-    genre_mapping = {genre: idx for idx, genre in enumerate(genre_encoder.classes_)}
-    
-    # Create simplified model data
-    model_data = {
-        'feature_importance': feature_importance.tolist(),
-        'scaler_mean': scaler_mean,
-        'scaler_scale': scaler_scale,
-        'genre_mapping': genre_mapping,
-        'feature_names': ['year', 'danceability', 'energy', 'key', 'loudness', 'mode', 
-                         'speechiness', 'acousticness', 'instrumentalness', 'liveness', 
-                         'valence', 'tempo', 'duration_min', 'time_signature', 'genre_encoded'],
-        'sample_songs': sample_songs,
-        'base_popularity': 50  # Base prediction value
-    }
-    
-    # Save to JSON
-    with open('model_data.json', 'w') as f:
-        json.dump(model_data, f, indent=2)
-    
-    print(f"Exported model data with {len(sample_songs)} sample songs")
-    print(f"Available genres: {list(genre_mapping.keys())}")
-    
-    return model_data
+    # Cleaned, deduplicated data from the chunked preparation pipeline
+    data = load_dataset()
+
+    os.makedirs(output_dir, exist_ok=True)
+    X_check = data[FEATURE_NAMES].sample(min(2000, len(data)), random_state=1).to_numpy(np.float64)
+    _, model_part = export_forest(model, scaler, genre_encoder, output_dir, budget_kb,
+                                  max_trees, max_depth, X_check)
+    _, songs_part = export_songs(data, output_dir, n_songs, shard_size)
+    with open(os.path.join(output_dir, 'model_data.json'), 'wb') as f:
+        f.write(compact_json({**model_part, **songs_part}))
+
+    forest = model_part['forest']
+    print(f"Exported forest: {forest['n_trees']}/{forest['n_trees_full']} trees, "
+          f"depth {forest['max_depth']}, {forest['bytes'] / 1024:.0f} KiB; "
+          f"MAE vs full model {forest['fidelity']['mae']:.3f} "
+          f"(max {forest['fidelity']['max_error']:.3f})")
+    print(f"Exported {len(songs_part['song_shards'])} song shards to {output_dir}/")
+    return {**model_part, **songs_part}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the model and sample songs for the web interface')
+    parser.add_argument('--output-dir', default=EXPORT_DIR)
+    parser.add_argument('--budget-kb', type=int, default=FOREST_BUDGET_KB,
+                        help='Size limit of the forest binary in KiB')
+    parser.add_argument('--max-trees', type=int, default=None)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--songs', type=int, default=SONG_SAMPLE)
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    args = parser.parse_args()
+    export_model_data(args.output_dir, args.budget_kb, args.max_trees, args.max_depth,
+                      args.songs, args.shard_size)
+
 
 if __name__ == "__main__":
-    export_model_data()
+    main()
@@ -0,0 +1,153 @@
+"""
+Content-addressed on-disk cache for audio feature results
+Keys are a hash of the audio bytes, the analysis sample rate, the resample quality and the analyzer version
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from audio_analyzer import ANALYZER_VERSION
+
+
+class FeatureCache:
+    """
+    Persistent, size-bounded LRU cache of analyzer output
+
+    Each entry is a small JSON file named after its key. Writes go to a temp
+    file and are renamed into place, so several worker processes can share one
+    cache directory without readers ever seeing a partial entry. Recency is the
+    file's mtime, refreshed on every hit; when the directory grows past
+    max_bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir='cache/features', max_bytes=32 * 1024 * 1024,
+                 analyzer_version=ANALYZER_VERSION, resample_quality='HQ'):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.analyzer_version = analyzer_version
+        self.resample_quality = resample_quality  # The analyzer's soxr preset
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Tracked approximately; rescanned from disk before evicting because
+        # other processes write to the same directory
+        self._approx_bytes = sum(size for _, _, size in self._entries())
+
+    def key_for(self, audio_bytes, sample_rate, mode='full'):
+        """Cache key for raw audio bytes analyzed at sample_rate in the given analysis mode"""
+        digest = hashlib.sha256()
+        digest.update(audio_bytes)
+        digest.update(f'|sr={sample_rate}|v={self.analyzer_version}'.encode())
+        if self.resample_quality != 'HQ':
+            # Other presets shift the spectral features; HQ keys predate the setting
+            digest.update(f'|rq={self.resample_quality}'.encode())
+        if mode != 'full':
+            # Full-mode keys predate modes and stay unchanged
+            digest.update(f'|mode={mode}'.encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key):
+        """Return the cached features for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                features = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return features
+
+    def put(self, key, features):
+        """Atomically store features under key, evicting old entries if needed"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(features, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._approx_bytes += size
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def get_or_compute(self, audio_bytes, sample_rate, compute, mode='full'):
+        """
+        Look up features for audio_bytes, calling compute() on a miss
+
+        Args:
+            audio_bytes (bytes): Raw contents of the audio file
+            sample_rate (int): Analysis sample rate, part of the key
+            compute (callable): Returns the feature dict, or None on failure
+            mode (str): Analysis mode ('full' or 'fast'), part of the key
+
+        Returns:
+            dict: Cached or freshly computed features (None results are not cached)
+        """
+        key = self.key_for(audio_bytes, sample_rate, mode)
+        features = self.get(key)
+        if features is None:
+            features = compute()
+            if features is not None:
+                self.put(key, features)
+        return features
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        """Remove least recently used entries until usage drops to 90% of the budget"""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._approx_bytes = total
+            self.evictions += evicted
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'approx_bytes': self._approx_bytes,
+                'max_bytes': self.max_bytes,
+            }
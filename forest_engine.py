@@ -0,0 +1,311 @@
+"""
+Array-backed inference engine for the tuned RandomForestRegressor
+Flattens every tree into contiguous NumPy arrays and traverses all trees at once
+
+Usage:
+    python forest_engine.py              # build spotify_model_engine/ from the .pkl files
+    python forest_engine.py --benchmark  # also compare latency and output with sklearn
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+
+ENGINE_DIR = 'spotify_model_engine'
+_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+_SIGN_BIT = np.int64(-2 ** 63)
+
+
+def _ordered_keys(x):
+    """Map float64 values to int64 keys with the same ordering"""
+    bits = np.asarray(x, dtype=np.float64).view(np.int64)
+    return np.where(bits >= 0, bits, -(bits & np.int64(0x7FFFFFFFFFFFFFFF)))
+
+
+def _from_ordered_keys(keys):
+    bits = np.where(keys >= 0, keys, (-keys) | _SIGN_BIT)
+    return bits.view(np.float64)
+
+
+def fold_thresholds(threshold, feature, mean, scale):
+    """
+    Move split thresholds from scaled space to raw feature space, exactly
+
+    sklearn compares float32((x - mean) / scale) <= threshold. That test is
+    monotone in x, so it holds exactly for x up to some largest float64; we
+    find it per node by bisecting the float64 bit patterns. A raw comparison
+    x <= folded then matches sklearn's decision for every input, including
+    values that land on float32 rounding boundaries.
+
+    Args:
+        threshold (np.ndarray): Split thresholds of internal nodes
+        feature (np.ndarray): Split feature of each node
+        mean (np.ndarray): StandardScaler.mean_
+        scale (np.ndarray): StandardScaler.scale_
+
+    Returns:
+        np.ndarray: Raw-space thresholds
+    """
+    m = np.asarray(mean, dtype=np.float64)[feature]
+    s = np.asarray(scale, dtype=np.float64)[feature]
+
+    def goes_left(keys):
+        with np.errstate(over='ignore', invalid='ignore'):
+            scaled = (_from_ordered_keys(keys) - m) / s
+            return scaled.astype(np.float32).astype(np.float64) <= threshold
+
+    lo = np.full(len(threshold), _ordered_keys(-1e300), dtype=np.int64)  # always left
+    hi = np.full(len(threshold), _ordered_keys(1e300), dtype=np.int64)   # always right
+    for _ in range(64):
+        # hi - lo can exceed int64; the unsigned difference cannot
+        active = (hi.view(np.uint64) - lo.view(np.uint64)) > 1
+        if not active.any():
+            break
+        # Overflow-free midpoint of two int64s
+        mid = (lo >> 1) + (hi >> 1) + (lo & hi & 1)
+        left = goes_left(mid)
+        lo = np.where(active & left, mid, lo)
+        hi = np.where(active & ~left, mid, hi)
+    return _from_ordered_keys(lo)
+
+
+class ForestEngine:
+    """
+    Vectorized RandomForestRegressor inference over flattened tree arrays
+
+    All trees share one node table: feature, threshold, left and right child
+    indices and the leaf value. Leaves point to themselves, so every row can
+    take exactly max_depth steps through all trees at once with no branching
+    in Python. When built with a scaler the thresholds are folded into raw
+    feature space and predict() takes unscaled features directly.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth,
+                 raw_input=False):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.raw_input = raw_input
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @classmethod
+    def from_sklearn(cls, model, scaler=None):
+        """
+        Flatten a fitted RandomForestRegressor
+
+        Args:
+            model: Fitted RandomForestRegressor (single output)
+            scaler: Optional fitted StandardScaler to fold into the thresholds
+
+        Returns:
+            ForestEngine
+        """
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        n_nodes = int(sizes.sum())
+        index_dtype = np.int32 if n_nodes < 2 ** 31 else np.int64
+
+        feature = np.empty(n_nodes, dtype=np.int16)
+        threshold = np.empty(n_nodes, dtype=np.float64)
+        left = np.empty(n_nodes, dtype=index_dtype)
+        right = np.empty(n_nodes, dtype=index_dtype)
+        value = np.empty(n_nodes, dtype=np.float64)
+        for tree, offset, size in zip(trees, offsets, sizes):
+            nodes = slice(offset, offset + size)
+            is_leaf = tree.children_left < 0
+            own = np.arange(offset, offset + size)
+            feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            threshold[nodes] = np.where(is_leaf, np.inf, tree.threshold)
+            left[nodes] = np.where(is_leaf, own, tree.children_left + offset)
+            right[nodes] = np.where(is_leaf, own, tree.children_right + offset)
+            value[nodes] = tree.value[:, 0, 0]
+
+        raw_input = scaler is not None
+        if raw_input:
+            # Folded in blocks to bound the bisection's temporaries
+            internal = np.flatnonzero(np.isfinite(threshold))
+            for start in range(0, len(internal), 1 << 20):
+                block = internal[start:start + (1 << 20)]
+                threshold[block] = fold_thresholds(threshold[block], feature[block],
+                                                   scaler.mean_, scaler.scale_)
+
+        max_depth = max(tree.max_depth for tree in trees)
+        return cls(feature, threshold, left, right, value,
+                   offsets.astype(index_dtype), max_depth, raw_input)
+
+    def predict(self, X):
+        """
+        Predict a batch of rows
+
+        Args:
+            X (np.ndarray): (n_rows, n_features); raw features if the engine
+                was built with a scaler, scaled features otherwise
+
+        Returns:
+            np.ndarray: Mean of the tree predictions per row
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if not self.raw_input:
+            # sklearn trees compare float32 inputs against float64 thresholds
+            X = X.astype(np.float32).astype(np.float64)
+
+        n_rows = len(X)
+        rows = np.arange(n_rows)[:, None]
+        node = np.broadcast_to(self.roots, (n_rows, self.n_trees))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        # Sum tree by tree in estimator order, as sklearn accumulates
+        leaf_values = self.value[node]
+        total = np.zeros(n_rows, dtype=np.float64)
+        for t in range(self.n_trees):
+            total += leaf_values[:, t]
+        return total / self.n_trees
+
+    def save(self, path=ENGINE_DIR, source_hash=None, source_stamps=None):
+        """Write the node arrays as .npy files so they can be memory-mapped"""
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        meta = {'max_depth': int(self.max_depth), 'raw_input': self.raw_input,
+                'n_trees': self.n_trees, 'n_nodes': self.n_nodes, 'source_hash': source_hash,
+                'source_stamps': source_stamps}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path=ENGINE_DIR, mmap_mode=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in _ARRAYS}
+        engine = cls(max_depth=meta['max_depth'], raw_input=meta['raw_input'], **arrays)
+        engine.source_hash = meta.get('source_hash')
+        engine.source_stamps = meta.get('source_stamps')
+        return engine
+
+
+def model_files_hash(model_path='spotify_popularity_model.pkl',
+                     scaler_path='spotify_scaler.pkl'):
+    """Identifies the pickles an engine was built from"""
+    digest = hashlib.sha256()
+    for path in (model_path, scaler_path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def model_files_stamps(model_path='spotify_popularity_model.pkl',
+                       scaler_path='spotify_scaler.pkl'):
+    """Size and mtime of each pickle, recorded next to model_files_hash"""
+    stamps = []
+    for path in (model_path, scaler_path):
+        stat = os.stat(path)
+        stamps.append({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    return stamps
+
+
+def model_files_match(source_hash, source_stamps=None):
+    """
+    Check recorded model files against the current ones
+
+    Sizes and mtimes are compared first; the pickles are only re-hashed when
+    they differ, so unchanged model files cost two stat calls.
+    """
+    if source_stamps is not None and source_stamps == model_files_stamps():
+        return True
+    return source_hash == model_files_hash()
+
+
+def load_engine(path=ENGINE_DIR, mmap_mode=None, verify=True):
+    """
+    Load the engine if it exists and was built from the current model files
+
+    verify=False skips the check, for callers that already made it (serve.py
+    checks once in the parent before forking its workers).
+    """
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    engine = ForestEngine.load(path, mmap_mode=mmap_mode)
+    if verify and not model_files_match(engine.source_hash, engine.source_stamps):
+        print(f"Ignoring stale forest engine in {path}; rebuild with forest_engine.py")
+        return None
+    return engine
+
+
+def _time_per_call(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(engine, model, scaler, X_raw):
+    """Compare engine and sklearn output and latency on raw feature rows"""
+    expected = model.predict(scaler.transform(X_raw))
+    actual = engine.predict(X_raw if engine.raw_input else scaler.transform(X_raw))
+    print(f"Rows compared: {len(X_raw):,}  identical: {np.array_equal(expected, actual)}  "
+          f"max |diff|: {np.max(np.abs(expected - actual)):.3g}")
+
+    single = X_raw[:1]
+    engine_input = single if engine.raw_input else scaler.transform(single)
+    sk_single = _time_per_call(lambda: model.predict(scaler.transform(single)), 50)
+    en_single = _time_per_call(lambda: engine.predict(engine_input), 200)
+    print(f"Single row: sklearn {sk_single * 1e3:.2f} ms, engine {en_single * 1e3:.3f} ms "
+          f"({sk_single / en_single:.1f}x)")
+
+    batch = X_raw[:1000]
+    engine_batch = batch if engine.raw_input else scaler.transform(batch)
+    sk_batch = _time_per_call(lambda: model.predict(scaler.transform(batch)), 5)
+    en_batch = _time_per_call(lambda: engine.predict(engine_batch), 5)
+    print(f"{len(batch)} rows:  sklearn {sk_batch * 1e3:.1f} ms, engine {en_batch * 1e3:.1f} ms "
+          f"({sk_batch / en_batch:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the array-backed forest engine')
+    parser.add_argument('--output', default=ENGINE_DIR)
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Check output against sklearn and compare latency')
+    args = parser.parse_args()
+
+    model = joblib.load('spotify_popularity_model.pkl')
+    scaler = joblib.load('spotify_scaler.pkl')
+
+    start = time.perf_counter()
+    engine = ForestEngine.from_sklearn(model, scaler)
+    stamps = model_files_stamps()  # Taken first: a later write then fails the stamp check
+    engine.save(args.output, source_hash=model_files_hash(), source_stamps=stamps)
+    print(f"Built engine with {engine.n_trees} trees, {engine.n_nodes:,} nodes, "
+          f"depth {engine.max_depth} in {time.perf_counter() - start:.1f}s -> {args.output}/")
+
+    if args.benchmark:
+        from dataset_snapshot import FEATURE_NAMES, load_dataset
+        data = load_dataset()
+        X_raw = data[FEATURE_NAMES].sample(min(len(data), 20000), random_state=0)
+        benchmark(engine, model, scaler, X_raw.to_numpy(dtype=np.float64))
+
+
+if __name__ == "__main__":
+    main()
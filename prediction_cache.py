@@ -0,0 +1,178 @@
+"""
+In-process cache of model predictions keyed by feature rows
+LRU with a TTL, cleared when the model files on disk change
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from dataset_snapshot import FEATURE_NAMES
+
+# Input resolution of each feature: the UI's slider steps, and 1 for integer features
+FEATURE_RESOLUTION = {
+    'year': 1,
+    'danceability': 0.01,
+    'energy': 0.01,
+    'key': 1,
+    'loudness': 0.1,
+    'mode': 1,
+    'speechiness': 0.01,
+    'acousticness': 0.01,
+    'instrumentalness': 0.01,
+    'liveness': 0.01,
+    'valence': 0.01,
+    'tempo': 1,
+    'duration_min': 0.1,
+    'time_signature': 1,
+    'genre_encoded': 1,
+}
+RESOLUTION = np.array([FEATURE_RESOLUTION[name] for name in FEATURE_NAMES])
+
+
+def quantize_steps(matrix):
+    """Feature rows as integer multiples of FEATURE_RESOLUTION"""
+    return np.round(np.asarray(matrix, dtype=np.float64) / RESOLUTION).astype(np.int64)
+
+
+def quantize_features(matrix):
+    """Feature rows rounded to FEATURE_RESOLUTION"""
+    return quantize_steps(matrix) * RESOLUTION
+
+
+def row_keys(matrix):
+    """
+    One hashable cache key per feature row, equal for rows that quantize alike
+
+    Callers score quantize_features(matrix), so every row sharing a key
+    gets the same prediction whether or not it was cached.
+    """
+    return [row.tobytes() for row in quantize_steps(matrix)]
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache of predictions with a time-to-live
+
+    Every clear() starts a new generation. Callers pass the generation they
+    looked up under when storing, so a prediction computed by a model that
+    was replaced in the meantime is dropped instead of cached.
+
+    Args:
+        capacity (int): Entries kept before the least recently used is evicted
+        ttl (float): Seconds an entry stays valid; None keeps entries until evicted
+    """
+
+    def __init__(self, capacity=50_000, ttl=3600.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (prediction, expires_at)
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'clears': 0}
+
+    def lookup(self, keys):
+        """
+        Cached predictions for keys
+
+        Returns:
+            tuple: (predictions with NaN for misses, generation to pass to store())
+        """
+        values = np.full(len(keys), np.nan)
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] is not None and entry[1] < now:
+                    del self._entries[key]
+                    self._counts['expired'] += 1
+                    continue
+                self._entries.move_to_end(key)
+                values[i] = entry[0]
+            hits = int(np.count_nonzero(~np.isnan(values)))
+            self._counts['hits'] += hits
+            self._counts['misses'] += len(keys) - hits
+            return values, self.generation
+
+    def store(self, keys, predictions, generation):
+        """Cache predictions computed under generation; ignored if the cache was cleared since"""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if generation != self.generation:
+                return
+            for key, value in zip(keys, predictions):
+                self._entries[key] = (float(value), expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self._counts['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self._counts['clears'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counts['hits'] + self._counts['misses']
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'ttl_sec': self.ttl,
+                **self._counts,
+                'hit_rate': round(self._counts['hits'] / lookups, 4) if lookups else 0.0,
+            }
+
+
+class FileWatcher:
+    """
+    Notices when any of a set of files is replaced or modified
+
+    changed() stats the files at most once per check_interval seconds, so it
+    is cheap enough to call on every request. A change is only reported once
+    the new stamps are the same on two checks in a row, so a set of files
+    written one after another (e.g. by train_model.py) is picked up after
+    the last write, not between two of them.
+    """
+
+    def __init__(self, paths, check_interval=2.0):
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self._stamps = self._read_stamps()
+        self._pending = None  # Changed stamps waiting to be seen again unchanged
+        self._next_check = time.monotonic() + check_interval
+        self._lock = threading.Lock()
+
+    def _read_stamps(self):
+        stamps = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_size, stat.st_mtime_ns, stat.st_ino))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def changed(self):
+        """True once for each change, after the files have settled"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.check_interval
+            stamps = self._read_stamps()
+            if stamps == self._stamps:
+                self._pending = None
+                return False
+            if stamps != self._pending:
+                self._pending = stamps  # Still being written, or first sight of the change
+                return False
+            self._stamps, self._pending = stamps, None
+            return True
@@ -0,0 +1,146 @@
+"""
+What-if sensitivity curves for the prediction sliders
+Varies one feature at a time around a base record and scores every grid point in one batch
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from dataset_snapshot import FEATURE_NAMES
+from prediction_cache import RESOLUTION, quantize_features, quantize_steps
+
+# Integer features get every value seen in the catalog instead of an even grid
+DISCRETE_FEATURES = {'year', 'key', 'mode', 'time_signature', 'genre_encoded'}
+
+
+def feature_grids(data, points=25, sample_rows=200_000, seed=0):
+    """
+    Grid of values to evaluate for each feature
+
+    Continuous features get `points` evenly spaced values between the 1st
+    and 99th percentile of the catalog, rounded to the input resolution;
+    discrete features get every distinct value.
+
+    Args:
+        data (pd.DataFrame): Cleaned dataset with FEATURE_NAMES columns
+        points (int): Grid size for continuous features
+        sample_rows (int): Rows sampled for the percentiles
+        seed (int): Sample seed
+
+    Returns:
+        dict: feature name -> sorted np.ndarray of values
+    """
+    if len(data) > sample_rows:
+        data = data.sample(sample_rows, random_state=seed)
+    grids = {}
+    for column, name in enumerate(FEATURE_NAMES):
+        values = data[name].to_numpy(dtype=np.float64)
+        if name in DISCRETE_FEATURES:
+            grids[name] = np.unique(values)
+        else:
+            low, high = np.percentile(values, [1, 99])
+            grid = np.linspace(low, high, points)
+            grids[name] = np.unique(np.round(grid / RESOLUTION[column]) * RESOLUTION[column])
+    return grids
+
+
+class SensitivityCurves:
+    """
+    Partial-dependence curves of one record along every feature axis
+
+    For each feature the base record is repeated once per grid value with
+    only that feature changed. The rows for all 15 features plus the base
+    record are scored with a single call to predict. Results are kept in an
+    LRU cache keyed by the base record quantized to FEATURE_RESOLUTION, so
+    slider positions that round to the same inputs share an entry.
+
+    Args:
+        predict (callable): Scores a (n_rows, 15) raw feature matrix
+        grids (dict): feature name -> grid values, see feature_grids
+        capacity (int): Cached base records
+    """
+
+    def __init__(self, predict, grids, capacity=1024):
+        self.predict = predict
+        self.grids = {name: np.asarray(grids[name], dtype=np.float64) for name in FEATURE_NAMES}
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def n_points(self):
+        return sum(len(grid) for grid in self.grids.values())
+
+    def curves(self, base):
+        """
+        Curves around one raw feature vector
+
+        Args:
+            base (np.ndarray): 15 raw feature values in FEATURE_NAMES order
+
+        Returns:
+            tuple: (result dict, cached flag). The result holds the quantized
+                base record, its prediction and per feature the grid values
+                and predicted popularity.
+        """
+        key = quantize_steps(np.asarray(base).reshape(1, -1))[0].tobytes()
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return result, True
+            self.misses += 1
+            generation = self._generation
+
+        result = self._compute(quantize_features(np.asarray(base).reshape(1, -1))[0])
+        with self._lock:
+            if generation != self._generation:
+                return result, False  # Model replaced while computing; don't cache
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return result, False
+
+    def _compute(self, base):
+        blocks = [base[None, :]]
+        for column, name in enumerate(FEATURE_NAMES):
+            block = np.repeat(base[None, :], len(self.grids[name]), axis=0)
+            block[:, column] = self.grids[name]
+            blocks.append(block)
+        predictions = self.predict(np.concatenate(blocks))
+
+        curves = {}
+        start = 1
+        for name in FEATURE_NAMES:
+            grid = self.grids[name]
+            if name in DISCRETE_FEATURES:
+                values = grid.astype(int).tolist()
+            else:
+                values = np.round(grid, 6).tolist()
+            curves[name] = {'values': values,
+                            'popularity': np.round(predictions[start:start + len(grid)], 3).tolist()}
+            start += len(grid)
+        return {
+            'base': {name: (int(value) if name in DISCRETE_FEATURES else round(float(value), 6))
+                     for name, value in zip(FEATURE_NAMES, base)},
+            'prediction': round(float(predictions[0]), 3),
+            'curves': curves,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._cache), 'capacity': self.capacity,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,228 @@
+"""
+Multi-process server for app_with_audio.py with shared model memory
+Runs N worker processes on one listening socket and can report per-worker memory
+
+Sharing modes:
+    none     every worker imports the app and unpickles its own model
+    mmap     every worker imports the app but scores with the memory-mapped
+             forest engine instead of the pickled forest, so the tree arrays
+             are shared through the page cache
+    In both, the parent builds or checks the dataset snapshot, forest engine
+    and similarity index before forking, and workers only open them
+    preload  the app is imported once in the parent and workers are forked
+             from it, sharing everything it loaded copy-on-write
+
+Usage:
+    python serve.py --workers 4 --share preload
+    python serve.py --workers 4 --share none --report-memory   # compare modes
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import numpy as np
+from werkzeug.serving import make_server
+
+
+def read_memory(pid):
+    """
+    RSS, PSS and USS of a process in MiB, from /proc/<pid>/smaps_rollup
+
+    RSS counts shared pages in full for every process that maps them; PSS
+    splits them between the sharers and USS counts only private pages, so
+    PSS summed over workers is the memory they really use together.
+
+    Returns:
+        dict: rss_mb, pss_mb and uss_mb, or None where /proc is unavailable
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    uss = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {'rss_mb': fields.get('Rss', 0) / 1024, 'pss_mb': fields.get('Pss', 0) / 1024,
+            'uss_mb': uss / 1024}
+
+
+def print_memory_report(pids, share):
+    rows = [(pid, read_memory(pid)) for pid in pids]
+    if any(memory is None for _, memory in rows):
+        print("Memory report needs Linux /proc/<pid>/smaps_rollup")
+        return
+    print(f"\nPer-worker memory (--share {share}):")
+    print(f"{'pid':>8} {'RSS MiB':>10} {'PSS MiB':>10} {'USS MiB':>10}")
+    for pid, memory in rows:
+        print(f"{pid:>8} {memory['rss_mb']:>10.1f} {memory['pss_mb']:>10.1f} "
+              f"{memory['uss_mb']:>10.1f}")
+    totals = {key: sum(memory[key] for _, memory in rows) for key in ('rss_mb', 'pss_mb', 'uss_mb')}
+    print(f"{'total':>8} {totals['rss_mb']:>10.1f} {totals['pss_mb']:>10.1f} "
+          f"{totals['uss_mb']:>10.1f}\n")
+
+
+def load_app(share):
+    """Import the Flask app with the sharing mode's settings"""
+    if share == 'mmap':
+        os.environ['SPOTIFY_MODEL_MMAP'] = '1'
+    import app_with_audio
+    return app_with_audio
+
+
+def prepare_artifacts():
+    """
+    Build or check the on-disk artifacts once, before any worker starts
+
+    Left to the workers, each would check the snapshot, engine and index on
+    its own, and rebuild stale ones into the same paths at the same time.
+    Afterwards, workers open them without checking (SPOTIFY_ARTIFACTS_PREPARED).
+
+    Returns:
+        bool: False if they could not be prepared; workers then check for themselves
+    """
+    import joblib
+    from dataset_snapshot import load_dataset
+    from forest_engine import ForestEngine, load_engine, model_files_hash, model_files_stamps
+    from similarity_index import load_or_build_index
+    start = time.perf_counter()
+    try:
+        data = load_dataset()
+        scaler = joblib.load('spotify_scaler.pkl')
+        if load_engine() is None:
+            print("Building forest engine for the current model files...")
+            stamps = model_files_stamps()
+            model = joblib.load('spotify_popularity_model.pkl')
+            ForestEngine.from_sklearn(model, scaler).save(source_hash=model_files_hash(),
+                                                          source_stamps=stamps)
+            del model
+        load_or_build_index(data, scaler)
+    except Exception as e:
+        print(f"Could not prepare snapshot, engine and index: {e}")
+        return False
+    os.environ['SPOTIFY_ARTIFACTS_PREPARED'] = '1'
+    print(f"Prepared snapshot, engine and index in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def run_worker(sock, app_module, share, ready_fd):
+    """Serve requests on the inherited socket; never returns"""
+    if app_module is None:
+        app_module = load_app(share)
+    else:
+        # Forked from the preloaded app: don't share its random state
+        np.random.seed()
+        if app_module.song_sampler is not None:
+            app_module.song_sampler.reseed()
+    server = make_server(*sock.getsockname()[:2], app_module.app, threaded=True,
+                         fd=sock.fileno())
+    if ready_fd is not None:
+        os.write(ready_fd, b'1')
+        os.close(ready_fd)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve app_with_audio.py from several processes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--share', choices=['none', 'mmap', 'preload'], default='preload',
+                        help='How workers share model and dataset memory')
+    parser.add_argument('--report-memory', action='store_true',
+                        help='Print per-worker RSS/PSS/USS once all workers are ready')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        sys.exit("serve.py needs os.fork; run app_with_audio.py directly on this platform")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    app_module = None
+    if args.share == 'preload':
+        start = time.perf_counter()
+        app_module = load_app(args.share)
+        # Workers must inherit the finished sampler, indexes and warm-up, not half-done ones
+        for thread in (app_module.song_sampler_thread, app_module.similarity_index_thread,
+                       app_module.catalog_scores_thread, app_module.warmup_thread):
+            if thread.is_alive():
+                thread.join()
+        # Keep the collector from writing to every inherited object header,
+        # which would turn shared pages into private copies in each worker
+        gc.collect()
+        gc.freeze()
+        print(f"Preloaded app in {time.perf_counter() - start:.1f}s")
+    else:
+        prepare_artifacts()
+
+    # Each worker writes one byte here once it is serving
+    ready_r, ready_w = os.pipe()
+    workers = set()
+
+    def spawn(ready_fd=None):
+        pid = os.fork()
+        if pid == 0:
+            if ready_fd is not None:
+                os.close(ready_r)
+            run_worker(sock, app_module, args.share, ready_fd)
+        workers.add(pid)
+
+    for _ in range(args.workers):
+        spawn(ready_w)
+    os.close(ready_w)
+
+    ready = 0
+    while ready < args.workers:
+        chunk = os.read(ready_r, args.workers)
+        if not chunk:
+            break
+        ready += len(chunk)
+    os.close(ready_r)
+    print(f"{ready} workers serving on http://{args.host}:{args.port} (--share {args.share})")
+    if args.report_memory:
+        print_memory_report(sorted(workers), args.share)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; restarting")
+            spawn()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,26 @@
 """
 Setup script for GitHub Pages deployment with Audio Analysis
+Incremental build: each artifact is rebuilt only when the content of its inputs changes
+
+Usage:
+    python setup_github_pages.py                 # update docs/
+    python setup_github_pages.py --force         # rebuild every artifact
+    python setup_github_pages.py --budget-kb 512 # smaller forest for the page
 """
+import argparse
+import gzip
+import hashlib
+import json
 import os
 import shutil
-import subprocess
 
-def setup_github_pages():
-    """Prepare files for GitHub Pages deployment with audio features"""
-    
-    print("🚀 Setting up GitHub Pages with Audio Analysis...")
-    
-    # Create docs folder (GitHub Pages can serve from docs/)
-    docs_dir = 'docs'
-    if os.path.exists(docs_dir):
-        shutil.rmtree(docs_dir)
-    os.makedirs(docs_dir)
-    
-    # Copy the enhanced HTML file with audio features
-    if os.path.exists('index_with_audio.html'):
-        shutil.copy('index_with_audio.html', f'{docs_dir}/index.html')
-        print(f"✓ Copied index_with_audio.html as main index.html")
-    else:
-        shutil.copy('index.html', f'{docs_dir}/index.html')
-        print(f"✓ Copied basic index.html (audio version not found)")
-    
-    # Copy sample audio file if it exists
-    if os.path.exists('skeletononthebeat.wav'):
-        shutil.copy('skeletononthebeat.wav', f'{docs_dir}/skeletononthebeat.wav')
-        print(f"✓ Copied sample audio file")
-    else:
-        print("⚠️  Sample audio file 'skeletononthebeat.wav' not found")
-    
-    # Try to export model data if possible
-    try:
-        if os.path.exists('export_model_data.py'):
-            print("Exporting model data...")
-            subprocess.run(['python', 'export_model_data.py'], check=True)
-            if os.path.exists('model_data.json'):
-                shutil.copy('model_data.json', f'{docs_dir}/model_data.json')
-                print("Copied model_data.json")
-            else:
-                print("model_data.json not found, using sample data in HTML")
-        else:
-            print("export_model_data.py not found, using sample data in HTML")
-    except Exception as e:
-        print(f"Could not export model data: {e}")
-        print("Using sample data embedded in HTML")
-    
-    # Create enhanced README for the docs folder
-    readme_content = """# 🎵 Spotify Popularity Predictor
+import export_model_data
+
+BUILD_MANIFEST = '.build_manifest.json'
+COMPRESS_SUFFIXES = ('.html', '.json', '.bin', '.md')
+MIN_COMPRESS_BYTES = 256
+
+DOCS_README = """# 🎵 Spotify Popularity Predictor
 
 A machine learning web application that predicts Spotify song popularity with audio analysis capabilities.
 
@@ -77,9 +49,9 @@ A machine learning web application that predicts Spotify song popularity with au
 
 ## 🧠 How It Works
 
-The web app uses a simplified version of a Random Forest model trained on 1M+ Spotify tracks:
-- **Feature Importance**: Uses weights from the trained model
-- **Client-Side Scaling**: Normalizes features in the browser
+The web app runs the Random Forest model trained on 1M+ Spotify tracks in the browser:
+- **Exported Forest**: The trees are shipped as a compact binary, pruned to fit a size budget
+- **No Scaling Needed**: The scaler is folded into the split thresholds
 - **Audio Simulation**: Simulates feature extraction for demo purposes
 - **Real-Time Predictions**: Instant updates as you adjust parameters
 
@@ -101,19 +73,8 @@ The system analyzes these Spotify-like features:
 
 *Note: This is a demonstration version. Audio analysis is simulated for GitHub Pages compatibility.*
 """
-    
-    with open(f'{docs_dir}/README.md', 'w', encoding='utf-8') as f:
-        f.write(readme_content)
-    
-    print(f"✓ Created enhanced README.md")
-    
-    # Create .nojekyll file to prevent Jekyll processing
-    with open(f'{docs_dir}/.nojekyll', 'w') as f:
-        f.write('')
-    print(f"✓ Created .nojekyll file")
-    
-    # Create a simple 404 page
-    error_404_content = """<!DOCTYPE html>
+
+ERROR_404 = """<!DOCTYPE html>
 <html>
 <head>
     <title>404 - Page Not Found</title>
@@ -130,19 +91,254 @@ The system analyzes these Spotify-like features:
     <p><a href="/">← Back to Spotify Popularity Predictor</a></p>
 </body>
 </html>"""
-    
-    with open(f'{docs_dir}/404.html', 'w', encoding='utf-8') as f:
-        f.write(error_404_content)
-    print(f"✓ Created 404.html")
-    
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SiteBuild:
+    """
+    Build steps for one output directory, skipped when their inputs are unchanged
+
+    The manifest in the output directory records, per step, a hash over the
+    content of its input files and its parameters, plus the files it wrote.
+    A step runs again only if that hash changed or one of its outputs was
+    modified or removed. File hashes are cached by size and mtime, so
+    unchanged large inputs such as the model pickle are not re-read.
+
+    Args:
+        out_dir (str): Output directory
+        force (bool): Run every step regardless of the manifest
+    """
+
+    def __init__(self, out_dir, force=False):
+        self.out_dir = out_dir
+        self.force = force
+        self.manifest_path = os.path.join(out_dir, BUILD_MANIFEST)
+        self.previous = {'steps': {}, 'files': {}, 'compressed': {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.previous.update(json.load(f))
+        self.steps = {}
+        self.files = {}
+        self.compressed = {}
+        os.makedirs(out_dir, exist_ok=True)
+
+    def digest(self, path):
+        """Content hash of a file, reusing the recorded one if size and mtime match"""
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        key = os.path.abspath(path)
+        cached = self.files.get(key) or self.previous['files'].get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, _sha256(path))
+        self.files[key] = cached
+        return cached[1]
+
+    def _output_digest(self, name):
+        path = os.path.join(self.out_dir, name)
+        return self.digest(path) if os.path.exists(path) else None
+
+    def step(self, name, inputs, params, build):
+        """
+        Run build(out_dir) unless its inputs and outputs are unchanged
+
+        Args:
+            name (str): Step name, unique within the build
+            inputs (list): Input file paths
+            params (dict): JSON-serializable parameters that affect the output
+            build (callable): Writes the outputs; returns (output names
+                relative to out_dir, JSON-serializable metadata)
+
+        Returns:
+            The metadata returned by build, or the recorded one if skipped
+        """
+        key = hashlib.sha256(json.dumps(
+            {'inputs': {path: self.digest(path) for path in inputs}, 'params': params},
+            sort_keys=True).encode()).hexdigest()
+        previous = self.previous['steps'].get(name)
+        if (not self.force and previous is not None and previous['key'] == key
+                and all(self._output_digest(out) == digest
+                        for out, digest in previous['outputs'].items())):
+            self.steps[name] = previous
+            print(f"✓ {name} unchanged")
+            return previous['meta']
+
+        outputs, meta = build(self.out_dir)
+        self.steps[name] = {'key': key, 'meta': meta,
+                            'outputs': {out: self._output_digest(out) for out in outputs}}
+        print(f"✓ Built {name}")
+        return meta
+
+    def copy(self, name, source, dest):
+        def build(out_dir):
+            shutil.copy(source, os.path.join(out_dir, dest))
+            return [dest], None
+        self.step(name, [source], {'dest': dest}, build)
+
+    def write(self, name, dest, content):
+        def build(out_dir):
+            with open(os.path.join(out_dir, dest), 'wb') as f:
+                f.write(content)
+            return [dest], None
+        self.step(name, [], {'dest': dest, 'content': hashlib.sha256(content).hexdigest()}, build)
+
+    def outputs(self):
+        return [out for record in self.steps.values() for out in record['outputs']]
+
+    def compress(self):
+        """Write .gz (and .br if the brotli module is installed) next to each text or binary output"""
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+            print("brotli not installed; writing gzip only")
+
+        totals = {'raw': 0, 'gz': 0, 'br': 0}
+        for out in self.outputs():
+            path = os.path.join(self.out_dir, out)
+            if not out.endswith(COMPRESS_SUFFIXES) or os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+            digest = self.digest(path)
+            variants = {'gz': lambda data: gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants['br'] = lambda data: brotli.compress(data, quality=11)
+            previous = self.previous['compressed'].get(out, {})
+            data = None
+            record = {'source': digest}
+            for suffix, compress in variants.items():
+                target = f'{path}.{suffix}'
+                if (self.force or previous.get('source') != digest or previous.get(suffix) is None
+                        or not os.path.exists(target) or self.digest(target) != previous[suffix]):
+                    if data is None:
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                    with open(target, 'wb') as f:
+                        f.write(compress(data))
+                record[suffix] = self.digest(target)
+                totals[suffix] += os.path.getsize(target)
+            totals['raw'] += os.path.getsize(path)
+            self.compressed[out] = record
+
+        summary = f"Compressible assets: {totals['raw'] / 1024:.0f} KiB, gzip {totals['gz'] / 1024:.0f} KiB"
+        if brotli is not None:
+            summary += f", brotli {totals['br'] / 1024:.0f} KiB"
+        print(summary)
+
+    def finish(self):
+        """Remove outputs of the previous build that this one no longer produces, then save the manifest"""
+        current = set(self.outputs())
+        previous = {out for record in self.previous['steps'].values() for out in record['outputs']}
+        for out in sorted(previous - current):
+            for path in (out, f'{out}.gz', f'{out}.br'):
+                path = os.path.join(self.out_dir, path)
+                if os.path.exists(path):
+                    os.remove(path)
+            print(f"✓ Removed stale {out}")
+        for out in current - set(self.compressed):
+            for suffix in ('gz', 'br'):
+                path = os.path.join(self.out_dir, f'{out}.{suffix}')
+                if os.path.exists(path):
+                    os.remove(path)
+
+        with open(self.manifest_path, 'w') as f:
+            json.dump({'steps': self.steps, 'files': self.files, 'compressed': self.compressed},
+                      f, indent=1)
+
+
+def setup_github_pages(docs_dir='docs', force=False, compress=True,
+                       budget_kb=export_model_data.FOREST_BUDGET_KB, max_trees=None,
+                       max_depth=None, n_songs=export_model_data.SONG_SAMPLE,
+                       shard_size=export_model_data.SHARD_SIZE):
+    """Prepare files for GitHub Pages deployment with audio features"""
+
+    print("🚀 Setting up GitHub Pages with Audio Analysis...")
+
+    # GitHub Pages can serve from docs/; files are updated in place, not recreated
+    site = SiteBuild(docs_dir, force=force)
+
+    # Copy the enhanced HTML file with audio features
+    if os.path.exists('index_with_audio.html'):
+        site.copy('index.html', 'index_with_audio.html', 'index.html')
+    else:
+        print("Audio version not found, using basic index.html")
+        site.copy('index.html', 'index.html', 'index.html')
+
+    # Copy sample audio file if it exists
+    if os.path.exists('skeletononthebeat.wav'):
+        site.copy('sample audio', 'skeletononthebeat.wav', 'skeletononthebeat.wav')
+    else:
+        print("⚠️  Sample audio file 'skeletononthebeat.wav' not found")
+
+    # Export the forest and the song shards; each only when its inputs changed
+    exporter = export_model_data.__file__
+    model_files = ['spotify_popularity_model.pkl', 'spotify_scaler.pkl', 'spotify_genre_encoder.pkl']
+    dataset_cache = {}
+
+    def dataset():
+        if 'data' not in dataset_cache:
+            from dataset_snapshot import load_dataset
+            dataset_cache['data'] = load_dataset()
+        return dataset_cache['data']
+
+    def build_forest(out_dir):
+        import joblib
+        model, scaler, genre_encoder = (joblib.load(path) for path in model_files)
+        data = dataset()
+        X_check = data[export_model_data.FEATURE_NAMES].sample(
+            min(2000, len(data)), random_state=1).to_numpy(dtype=float)
+        outputs, meta = export_model_data.export_forest(
+            model, scaler, genre_encoder, out_dir, budget_kb, max_trees, max_depth, X_check)
+        forest = meta['forest']
+        print(f"  {forest['n_trees']}/{forest['n_trees_full']} trees, depth {forest['max_depth']}, "
+              f"{forest['bytes'] / 1024:.0f} KiB, MAE vs full model {forest['fidelity']['mae']:.3f}")
+        return outputs, meta
+
+    def build_songs(out_dir):
+        return export_model_data.export_songs(dataset(), out_dir, n_songs, shard_size)
+
+    try:
+        from dataset_snapshot import SNAPSHOT_DIR
+        snapshot_manifest = os.path.join(SNAPSHOT_DIR, 'manifest.json')
+        if not os.path.exists(snapshot_manifest):
+            dataset()  # Builds the snapshot, whose manifest identifies the dataset
+        model_part = site.step('forest', model_files + [exporter, snapshot_manifest],
+                               {'budget_kb': budget_kb, 'max_trees': max_trees,
+                                'max_depth': max_depth}, build_forest)
+        songs_part = site.step('songs', [exporter, snapshot_manifest],
+                               {'n_songs': n_songs, 'shard_size': shard_size}, build_songs)
+        site.write('model_data.json', 'model_data.json',
+                   export_model_data.compact_json({**model_part, **songs_part}))
+    except Exception as e:
+        print(f"Could not export model data: {e}")
+        print("Using sample data embedded in HTML")
+
+    # Create enhanced README for the docs folder
+    site.write('README.md', 'README.md', DOCS_README.encode('utf-8'))
+
+    # Create .nojekyll file to prevent Jekyll processing
+    site.write('.nojekyll', '.nojekyll', b'')
+
+    # Create a simple 404 page
+    site.write('404.html', '404.html', ERROR_404.encode('utf-8'))
+
+    if compress:
+        site.compress()
+    site.finish()
+
     print("\n🎉 GitHub Pages setup with Audio Analysis complete!")
     print("\n🌟 Enhanced Features Added:")
     print("  - Audio file upload simulation")
     print("  - Feature extraction visualization")
     print("  - Interactive audio controls")
-    print("  - Real-time predictions")
+    print("  - Real-time predictions from the exported Random Forest")
     print("  - Mobile-responsive design")
-    
+
     print("\n📋 Next steps:")
     print("1. Push this repository to GitHub")
     print("2. Go to Settings > Pages in your GitHub repo")
@@ -150,12 +346,30 @@ The system analyzes these Spotify-like features:
     print("4. Choose 'main' branch and '/docs' folder")
     print("5. Your enhanced site will be available at:")
     print("   https://danielc8.github.io/SpotifyPopularityModel/")
-    
+
     print(f"\n📁 Files ready in '{docs_dir}/' folder:")
-    for file in os.listdir(docs_dir):
+    for file in site.outputs():
         file_size = os.path.getsize(f'{docs_dir}/{file}')
         size_str = f"{file_size:,} bytes" if file_size < 1024 else f"{file_size//1024}KB"
         print(f"  - {file} ({size_str})")
 
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the GitHub Pages site in docs/')
+    parser.add_argument('--docs-dir', default='docs')
+    parser.add_argument('--force', action='store_true', help='Rebuild every artifact')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='Skip the precompressed .gz/.br copies')
+    parser.add_argument('--budget-kb', type=int, default=export_model_data.FOREST_BUDGET_KB,
+                        help='Size limit of the forest binary in KiB')
+    parser.add_argument('--max-trees', type=int, default=None)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--songs', type=int, default=export_model_data.SONG_SAMPLE)
+    parser.add_argument('--shard-size', type=int, default=export_model_data.SHARD_SIZE)
+    args = parser.parse_args()
+    setup_github_pages(args.docs_dir, args.force, not args.no_compress, args.budget_kb,
+                       args.max_trees, args.max_depth, args.songs, args.shard_size)
+
+
 if __name__ == "__main__":
-    setup_github_pages()
+    main()
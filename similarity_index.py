@@ -0,0 +1,313 @@
+"""
+Nearest-neighbour index over the scaled feature vectors of the catalog
+Inverted-file (IVF) index built with NumPy: k-means lists, probed nearest-first, exact re-ranking
+
+Usage:
+    python similarity_index.py              # build spotify_similarity_index/ from the snapshot
+    python similarity_index.py --benchmark  # also measure recall@k against latency
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import joblib
+import numpy as np
+
+INDEX_DIR = 'spotify_similarity_index'
+_ARRAYS = ('centroids', 'offsets', 'vectors', 'rows', 'genres')
+
+
+def _squared_distances(X, centroids, centroid_norms):
+    """||x - c||^2 for every row of X and every centroid, via one matrix product"""
+    return (np.einsum('ij,ij->i', X, X)[:, None] - 2 * X @ centroids.T
+            + centroid_norms[None, :])
+
+
+def _assign(X, centroids, block_rows=2048):
+    """Nearest centroid of every row, in cache-sized blocks of the distance matrix"""
+    norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), block_rows):
+        block = X[start:start + block_rows]
+        distances = _squared_distances(block, centroids, norms)
+        labels[start:start + block_rows] = distances.argmin(axis=1)
+    return labels
+
+
+def kmeans(X, n_clusters, n_iter=15, rows_per_cluster=64, seed=0):
+    """
+    Lloyd's k-means on a row sample
+
+    Args:
+        X (np.ndarray): (n_rows, n_features) float32
+        n_clusters (int): Number of centroids
+        n_iter (int): Lloyd iterations
+        rows_per_cluster (int): Sample size per centroid used to fit; the
+            other rows are only assigned
+        seed (int): Random seed for the sample and initial centroids
+
+    Returns:
+        np.ndarray: (n_clusters, n_features) centroids
+    """
+    rng = np.random.default_rng(seed)
+    sample_rows = n_clusters * rows_per_cluster
+    if len(X) > sample_rows:
+        X = X[rng.choice(len(X), sample_rows, replace=False)]
+    centroids = X[rng.choice(len(X), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(X, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.stack([np.bincount(labels, weights=X[:, j], minlength=n_clusters)
+                         for j in range(X.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+        # Re-seed empty clusters from random rows so every list stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = X[rng.choice(len(X), len(empty), replace=False)]
+    return centroids
+
+
+class SimilarityIndex:
+    """
+    IVF nearest-neighbour index over scaled feature vectors
+
+    Rows are grouped by their nearest k-means centroid and stored list by
+    list, so the rows of one list are a contiguous slice. A query ranks the
+    centroids, gathers the nprobe nearest lists and computes exact
+    distances on those rows only. nprobe trades recall for latency; probing
+    every list is an exact search. A genre filter drops other genres while
+    re-ranking and keeps probing further lists until k matches are found.
+    """
+
+    def __init__(self, centroids, offsets, vectors, rows, genres):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.rows = rows
+        self.genres = genres
+        self.centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def n_rows(self):
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, X_scaled, genres, n_lists=None, n_iter=15):
+        """
+        Cluster the catalog and lay its vectors out list by list
+
+        Args:
+            X_scaled (np.ndarray): (n_rows, 15) scaled features, in dataset row order
+            genres (np.ndarray): genre_encoded per row
+            n_lists (int): Number of lists; defaults to about sqrt(n_rows)
+            n_iter (int): k-means iterations
+
+        Returns:
+            SimilarityIndex
+        """
+        X = np.ascontiguousarray(X_scaled, dtype=np.float32)
+        if n_lists is None:
+            n_lists = max(1, int(round(np.sqrt(len(X)))))
+        n_lists = min(n_lists, len(X))
+        centroids = kmeans(X, n_lists, n_iter=n_iter)
+        labels = _assign(X, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        return cls(centroids, offsets.astype(np.int64), X[order], order.astype(np.int32),
+                   np.asarray(genres)[order].astype(np.int16))
+
+    def query(self, q, k=10, nprobe=16, genre=None, exclude=None):
+        """
+        Approximate k nearest catalog rows to one scaled vector
+
+        Args:
+            q (np.ndarray): Scaled 15-feature vector
+            k (int): Number of neighbours
+            nprobe (int): Lists to search; n_lists makes the search exact
+            genre (int): Only return rows with this genre_encoded
+            exclude (int): Dataset row to leave out, e.g. the query song itself
+
+        Returns:
+            tuple: (rows, distances) as arrays sorted by Euclidean distance
+        """
+        q = np.asarray(q, dtype=np.float32).reshape(-1)
+        centroid_dist = self.centroid_norms - 2 * self.centroids @ q
+        list_order = np.argsort(centroid_dist)
+
+        found_rows, found_dist = [], []
+        n_found = 0
+        probed = 0
+        nprobe = max(1, nprobe)
+        while probed < self.n_lists and (probed < nprobe or n_found < k):
+            lists = list_order[probed:probed + nprobe]
+            probed += len(lists)
+            candidates = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1])
+                                         for i in lists])
+            if genre is not None:
+                candidates = candidates[self.genres[candidates] == genre]
+            if exclude is not None:
+                candidates = candidates[self.rows[candidates] != exclude]
+            if not len(candidates):
+                continue
+            diff = self.vectors[candidates] - q
+            found_dist.append(np.einsum('ij,ij->i', diff, diff))
+            found_rows.append(candidates)
+            n_found += len(candidates)
+
+        if not n_found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidates = np.concatenate(found_rows)
+        dist = np.concatenate(found_dist)
+        if len(dist) > k:
+            top = np.argpartition(dist, k - 1)[:k]
+            candidates, dist = candidates[top], dist[top]
+        order = np.argsort(dist, kind='stable')
+        return self.rows[candidates[order]].astype(np.int64), np.sqrt(dist[order])
+
+    def save(self, path=INDEX_DIR, source_hash=None):
+        """
+        Write the arrays as .npy files so they can be memory-mapped
+
+        They are written to a temporary directory that then replaces path, so
+        readers never see a half-written index and servers that have the old
+        files mapped keep reading them.
+        """
+        from dataset_snapshot import replace_dir
+        path = os.path.normpath(path)
+        # Per thread: a model reload may save while the startup build still is
+        tmp_dir = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        try:
+            for name in _ARRAYS:
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), getattr(self, name))
+            meta = {'n_lists': self.n_lists, 'n_rows': self.n_rows, 'source_hash': source_hash}
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f, indent=2)
+            replace_dir(tmp_dir, path)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path=INDEX_DIR, mmap_mode=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in _ARRAYS}
+        index = cls(**arrays)
+        index.source_hash = meta.get('source_hash')
+        return index
+
+
+def index_source_hash(scaler_path='spotify_scaler.pkl', snapshot_dir=None):
+    """Identifies the scaler and dataset snapshot an index was built from"""
+    from dataset_snapshot import SNAPSHOT_DIR
+    digest = hashlib.sha256()
+    for path in (scaler_path, os.path.join(snapshot_dir or SNAPSHOT_DIR, 'manifest.json')):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def scaled_catalog(data, scaler):
+    """Scaled 15-feature matrix of the dataset, float32"""
+    from dataset_snapshot import FEATURE_NAMES
+    X = data[FEATURE_NAMES].to_numpy(dtype=np.float64)
+    return scaler.transform(X).astype(np.float32)
+
+
+def load_or_build_index(data, scaler, path=INDEX_DIR, mmap_mode='r'):
+    """Load the index if it matches the current scaler and snapshot, else build and save it"""
+    source_hash = index_source_hash()
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        index = SimilarityIndex.load(path, mmap_mode=mmap_mode)
+        if index.source_hash == source_hash and index.n_rows == len(data):
+            return index
+        print(f"Rebuilding stale similarity index in {path}")
+    start = time.perf_counter()
+    index = SimilarityIndex.build(scaled_catalog(data, scaler), data['genre_encoded'].to_numpy())
+    try:
+        index.save(path, source_hash=source_hash)
+    except OSError as e:
+        print(f"Could not save similarity index to {path}: {e}")
+    print(f"Built similarity index: {index.n_rows:,} rows in {index.n_lists} lists "
+          f"in {time.perf_counter() - start:.1f}s")
+    return index
+
+
+def benchmark(index, X, k=10, n_queries=200, seed=0):
+    """Recall@k and latency per query for several nprobe values, against exact search"""
+    from sklearn.neighbors import KDTree
+
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(X), min(n_queries, len(X)), replace=False)
+
+    start = time.perf_counter()
+    tree = KDTree(X, leaf_size=40)
+    print(f"KDTree built in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    _, exact = tree.query(X[queries], k=k)
+    kd_ms = (time.perf_counter() - start) / len(queries) * 1e3
+
+    start = time.perf_counter()
+    for q in queries[:20]:
+        diff = X - X[q]
+        np.argpartition(np.einsum('ij,ij->i', diff, diff), k)[:k]
+    brute_ms = (time.perf_counter() - start) / min(20, len(queries)) * 1e3
+
+    print(f"{len(queries)} queries, k={k}, {index.n_rows:,} rows, {index.n_lists} lists")
+    print(f"{'method':>14} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'brute force':>14} {1.0:>9.3f} {brute_ms:>9.3f}")
+    print(f"{'KDTree':>14} {1.0:>9.3f} {kd_ms:>9.3f}")
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        results = [index.query(X[q], k=k, nprobe=nprobe)[0] for q in queries]
+        ms = (time.perf_counter() - start) / len(queries) * 1e3
+        # Ties at equal distance can swap rows, so compare distances, not ids
+        hits = 0
+        for q, rows, truth in zip(queries, results, exact):
+            worst = np.sum((X[truth[-1]] - X[q]) ** 2)
+            hits += min(k, int(np.sum(np.sum((X[rows] - X[q]) ** 2, axis=1) <= worst + 1e-6)))
+        print(f"{f'IVF nprobe={nprobe}':>14} {hits / (k * len(queries)):>9.3f} {ms:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the song similarity index')
+    parser.add_argument('--output', default=INDEX_DIR)
+    parser.add_argument('--lists', type=int, default=None,
+                        help='Number of IVF lists (default: about sqrt(rows))')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Measure recall@k against latency for several nprobe values')
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    from dataset_snapshot import load_dataset
+    data = load_dataset()
+    scaler = joblib.load('spotify_scaler.pkl')
+    X = scaled_catalog(data, scaler)
+
+    start = time.perf_counter()
+    index = SimilarityIndex.build(X, data['genre_encoded'].to_numpy(), n_lists=args.lists)
+    index.save(args.output, source_hash=index_source_hash())
+    print(f"Built index over {index.n_rows:,} rows in {index.n_lists} lists "
+          f"in {time.perf_counter() - start:.1f}s -> {args.output}/")
+
+    if args.benchmark:
+        benchmark(index, X, k=args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Hash index over the song catalog for constant-time artist/track lookups
+Supports exact, normalized (case/whitespace/Unicode-insensitive) and prefix matching
+"""
+import bisect
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+def normalize_name(name):
+    """Canonical form for loose matching: NFKC, casefolded, single-spaced"""
+    return ' '.join(unicodedata.normalize('NFKC', str(name)).casefold().split())
+
+
+def _native(value):
+    """Convert numpy scalars to plain Python values for JSON"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class SongIndex:
+    """
+    Maps (artist, track) to a row position in the dataset
+
+    Names are factorized to integer codes and each (artist, track) pair is
+    packed into one int key, so the index is a plain dict built with NumPy
+    rather than a million tuple keys. When a pair appears more than once the
+    first row wins, matching the old boolean-mask lookup.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.columns = list(data.columns)
+
+        artist_codes, artists = pd.factorize(data['artist_name'])
+        track_codes, tracks = pd.factorize(data['track_name'])
+        self._artist_lookup = {name: code for code, name in enumerate(artists)}
+        self._track_lookup = {name: code for code, name in enumerate(tracks)}
+        self._exact = self._pair_index(artist_codes, track_codes, len(tracks))
+
+        self._artists = artists
+        self._tracks = tracks
+        self._artist_codes = artist_codes
+        self._track_codes = track_codes
+
+        # Normalized and prefix structures are built on first use so they do
+        # not slow startup; exact lookups are what the UI issues
+        self._normalized = None
+        self._prefix = None
+        self._build_lock = threading.RLock()
+
+    def _build_normalized(self):
+        # Normalized names collapse to fewer codes, remapped through the originals
+        norm_artists = [normalize_name(a) for a in self._artists]
+        norm_tracks = [normalize_name(t) for t in self._tracks]
+        norm_artist_of, norm_artist_names = pd.factorize(pd.Series(norm_artists, dtype=object))
+        norm_track_of, norm_track_names = pd.factorize(pd.Series(norm_tracks, dtype=object))
+        self._norm_artist_codes = np.where(self._artist_codes >= 0,
+                                           norm_artist_of[self._artist_codes], -1)
+        self._norm_track_codes = np.where(self._track_codes >= 0,
+                                          norm_track_of[self._track_codes], -1)
+        self._norm_artist_names = list(norm_artist_names)
+        self._norm_track_names = list(norm_track_names)
+        self._norm_artist_lookup = {name: code for code, name in enumerate(norm_artist_names)}
+        self._norm_track_lookup = {name: code for code, name in enumerate(norm_track_names)}
+        self._normalized = self._pair_index(self._norm_artist_codes, self._norm_track_codes,
+                                            len(norm_track_names))
+
+    def _ensure_built(self, attr, build):
+        if getattr(self, attr) is None:
+            with self._build_lock:
+                if getattr(self, attr) is None:
+                    build()
+
+    @staticmethod
+    def _pair_index(artist_codes, track_codes, n_tracks):
+        """Dict of packed (artist, track) code -> first row position"""
+        keys = artist_codes.astype(np.int64) * n_tracks + track_codes
+        valid = (artist_codes >= 0) & (track_codes >= 0)
+        positions = np.flatnonzero(valid)
+        unique_keys, first = np.unique(keys[valid], return_index=True)
+        return dict(zip(unique_keys.tolist(), positions[first].tolist()))
+
+    def __len__(self):
+        return len(self.data)
+
+    def lookup(self, artist, track, normalized=False):
+        """
+        Find the row position of a song
+
+        Args:
+            artist (str): Artist name
+            track (str): Track name
+            normalized (bool): Match ignoring case, Unicode form and extra whitespace
+
+        Returns:
+            int: Row position, or None if there is no such song
+        """
+        if normalized:
+            self._ensure_built('_normalized', self._build_normalized)
+            artist_code = self._norm_artist_lookup.get(normalize_name(artist))
+            track_code = self._norm_track_lookup.get(normalize_name(track))
+            index, n_tracks = self._normalized, len(self._norm_track_names)
+        else:
+            artist_code = self._artist_lookup.get(artist)
+            track_code = self._track_lookup.get(track)
+            index, n_tracks = self._exact, len(self._track_lookup)
+        if artist_code is None or track_code is None:
+            return None
+        return index.get(artist_code * n_tracks + track_code)
+
+    def find(self, artist, track):
+        """Exact lookup, falling back to normalized matching"""
+        position = self.lookup(artist, track)
+        if position is None:
+            position = self.lookup(artist, track, normalized=True)
+        return position
+
+    def row(self, position, columns=None):
+        """Row at position as a plain dict, without building a filtered DataFrame"""
+        columns = columns or self.columns
+        return {col: _native(self.data[col].iat[position]) for col in columns}
+
+    def _build_prefix(self):
+        self._ensure_built('_normalized', self._build_normalized)
+        prefix = {}
+        for kind, names, row_codes in (('track', self._norm_track_names, self._norm_track_codes),
+                                       ('artist', self._norm_artist_names, self._norm_artist_codes)):
+            order_of_names = np.argsort(np.asarray(names, dtype=object))
+            sorted_names = [names[i] for i in order_of_names]
+            # Missing names (code -1) rank past the end and never match
+            rank = np.empty(len(names) + 1, dtype=np.int64)
+            rank[order_of_names] = np.arange(len(names))
+            rank[-1] = len(names)
+            row_rank = rank[row_codes]
+            rows = np.argsort(row_rank, kind='stable')
+            prefix[kind] = (sorted_names, row_rank[rows], rows)
+        self._prefix = prefix
+
+    def search_prefix(self, query, limit=10):
+        """
+        Autocomplete: songs whose track or artist name starts with query
+
+        Track-name matches come first, then artist-name matches.
+
+        Args:
+            query (str): Prefix, matched after normalization
+            limit (int): Maximum number of results
+
+        Returns:
+            list: Row positions in sorted-name order
+        """
+        query = normalize_name(query)
+        if not query or limit <= 0:
+            return []
+        self._ensure_built('_prefix', self._build_prefix)
+
+        results = []
+        seen = set()
+        for kind in ('track', 'artist'):
+            sorted_names, sorted_ranks, rows = self._prefix[kind]
+            lo = bisect.bisect_left(sorted_names, query)
+            hi = bisect.bisect_left(sorted_names, query + '\U0010ffff')
+            start = np.searchsorted(sorted_ranks, lo, side='left')
+            stop = np.searchsorted(sorted_ranks, hi, side='left')
+            for position in rows[start:min(stop, start + limit)].tolist():
+                if position not in seen:
+                    seen.add(position)
+                    results.append(position)
+                    if len(results) >= limit:
+                        return results
+        return results
@@ -0,0 +1,143 @@
+"""
+Constant-time random song sampling for /api/songs
+Rows are serialized to JSON once; each request joins fragments at a cursor over a reshuffled order
+"""
+import json
+import threading
+from json.encoder import encode_basestring_ascii
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_COLUMNS = ['artist_name', 'track_name', 'popularity', 'genre']
+POPULARITY_BANDS = (0, 20, 40, 60, 80, 101)
+
+
+def _json_column(series):
+    """Encode every value of a column as a JSON literal, vectorized where possible"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = [str(c) for c in series.cat.categories.tolist()]
+        encoded = np.array([encode_basestring_ascii(c) for c in categories] + ['null'],
+                           dtype=object)
+        return encoded[series.cat.codes.to_numpy()]  # code -1 picks 'null'
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.astype(str).to_numpy(dtype=object)
+    if pd.api.types.is_float_dtype(series.dtype):
+        return np.array([json.dumps(float(v)) if np.isfinite(v) else 'null'
+                         for v in series.to_numpy()], dtype=object)
+    return np.array([json.dumps(v) for v in series.tolist()], dtype=object)
+
+
+class SongSampler:
+    """
+    Serves random pages of songs at a cost independent of catalog size
+
+    At build time every row is serialized to a compact JSON object, in a
+    shuffled order, into one bytes blob. The whole catalog, each genre and
+    each popularity band has its own shuffled list of blob positions; a
+    request walks its list from a cursor and joins n fragments. A list is
+    reshuffled each time its cursor wraps, so successive passes come in a
+    new order.
+    """
+
+    def __init__(self, data, columns=SAMPLE_COLUMNS, bands=POPULARITY_BANDS, seed=None):
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        n_rows = len(data)
+
+        # Shuffle once; blob position i holds row order[i]
+        order = self._rng.permutation(n_rows)
+        shuffled = data.iloc[order]
+
+        # Same key order as jsonify's sorted output. Every literal is
+        # ASCII-escaped, so string lengths equal byte lengths
+        keys = sorted(columns)
+        template = '{' + ','.join(json.dumps(col) + ':%s' for col in keys) + '},'
+        values = [_json_column(shuffled[col]) for col in keys]
+        fragments = [template % row for row in zip(*values)]
+        self._offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, fragments), dtype=np.int64, count=n_rows),
+                  out=self._offsets[1:])
+        self._blob = ''.join(fragments).encode('ascii')
+
+        # Blob positions grouped by genre and by (genre, popularity band)
+        genre_codes, genre_names = pd.factorize(shuffled['genre'])
+        band_of = np.digitize(shuffled['popularity'].to_numpy(), bands[1:-1])
+        self.bands = bands
+        self._groups = {(None, None): [np.arange(n_rows), 0]}
+        by_genre = np.argsort(genre_codes, kind='stable')
+        bounds = np.searchsorted(genre_codes[by_genre], np.arange(len(genre_names) + 1))
+        for code, genre in enumerate(genre_names):
+            genre = str(genre)
+            positions = by_genre[bounds[code]:bounds[code + 1]]
+            self._groups[(genre, None)] = [positions, 0]
+            for band in range(len(bands) - 1):
+                in_band = positions[band_of[positions] == band]
+                if len(in_band):
+                    self._groups[(genre, band)] = [in_band, 0]
+        for band in range(len(bands) - 1):
+            in_band = np.flatnonzero(band_of == band)
+            if len(in_band):
+                self._groups[(None, band)] = [in_band, 0]
+
+    def reseed(self, seed=None):
+        """
+        Restart from a new random state, reshuffling every position list
+
+        A process forked after the sampler was built inherits its generator
+        and cursors; without this, every worker serves the same pages in the
+        same order. seed=None draws fresh OS entropy.
+        """
+        with self._lock:
+            self._rng = np.random.default_rng(seed)
+            for group in self._groups.values():
+                self._rng.shuffle(group[0])
+                group[1] = 0
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def genres(self):
+        return sorted(g for g, band in self._groups if g is not None and band is None)
+
+    def _fragment(self, position):
+        # Drop the trailing comma stored with each fragment
+        return self._blob[self._offsets[position]:self._offsets[position + 1] - 1]
+
+    def _take_group(self, key, n):
+        group = self._groups.get(key)
+        if group is None:
+            return []
+        with self._lock:
+            positions, cursor = group
+            n = min(n, len(positions))
+            if cursor + n > len(positions):
+                self._rng.shuffle(positions)
+                cursor = 0
+            group[1] = cursor + n
+            taken = positions[cursor:cursor + n].tolist()
+        return [self._fragment(p) for p in taken]
+
+    def sample(self, n=50, genre=None, stratified=False):
+        """
+        Serialized JSON array of n random songs
+
+        Args:
+            n (int): Number of songs
+            genre (str): Only sample this genre
+            stratified (bool): Draw evenly across popularity bands
+
+        Returns:
+            bytes: JSON array body
+        """
+        if n <= 0 or not len(self):
+            return b'[]'
+        if stratified:
+            n_bands = len(self.bands) - 1
+            fragments = []
+            for band in range(n_bands):
+                share = n // n_bands + (1 if band < n % n_bands else 0)
+                fragments.extend(self._take_group((genre, band), share))
+            return b'[' + b','.join(fragments) + b']'
+        return b'[' + b','.join(self._take_group((genre, None), n)) + b']'
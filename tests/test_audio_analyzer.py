@@ -0,0 +1,47 @@
+"""
+Regression checks for SpotifyAudioAnalyzer.analyze_audio_file
+Expected values were produced by the analyzer before the shared STFT/mel plan
+"""
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_analyzer import SpotifyAudioAnalyzer
+
+# Per clip gain: every feature of the original analyzer on synthesize_clip(gain)
+EXPECTED = {
+    0.5: {'duration_min': 0.3333333333333333, 'tempo': 117.45383522727273, 'time_signature': 4,
+          'key': 9, 'mode': 1, 'energy': 1.0, 'loudness': -16.227941513061523,
+          'danceability': 1.0, 'valence': 0.5508855560470469,
+          'acousticness': 0.5416691954905167, 'instrumentalness': 0.0, 'liveness': 1.0,
+          'speechiness': 1.0},
+    # Quieter, so energy is not clipped at 1.0 (loudness is clipped at -30 instead)
+    0.1: {'duration_min': 0.3333333333333333, 'tempo': 117.45383522727273, 'time_signature': 4,
+          'key': 9, 'mode': 1, 'energy': 0.3069564402103424, 'loudness': -30.0,
+          'danceability': 1.0, 'valence': 0.5508846423656394,
+          'acousticness': 0.5416713333878955, 'instrumentalness': 0.0, 'liveness': 1.0,
+          'speechiness': 1.0},
+}
+
+
+def synthesize_clip(gain, seconds=20, sr=22050):
+    """A-major triad with noise-burst clicks every half second (120 BPM)"""
+    t = np.arange(int(seconds * sr)) / sr
+    rng = np.random.default_rng(0)
+    y = (0.3 * np.sin(2 * np.pi * 220 * t) + 0.2 * np.sin(2 * np.pi * 277.18 * t)
+         + 0.2 * np.sin(2 * np.pi * 329.63 * t))
+    clicks = (np.mod(t, 0.5) < 0.02) * rng.normal(0, 0.5, len(t))
+    return ((y + clicks + 0.02 * rng.normal(size=len(t))) * gain).astype(np.float32)
+
+
+@pytest.mark.parametrize('gain', sorted(EXPECTED))
+def test_analyze_audio_file_matches_original(tmp_path, gain):
+    path = str(tmp_path / 'clip.wav')
+    sf.write(path, synthesize_clip(gain), 22050, subtype='PCM_16')
+
+    features = SpotifyAudioAnalyzer().analyze_audio_file(path)
+
+    assert features is not None
+    assert set(features) == set(EXPECTED[gain])
+    for name, expected in EXPECTED[gain].items():
+        assert features[name] == pytest.approx(expected, abs=1e-6), name
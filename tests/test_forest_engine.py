@@ -0,0 +1,68 @@
+"""
+ForestEngine must reproduce RandomForestRegressor.predict exactly
+Including rows that sit on, or one float step either side of, a split threshold
+"""
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+from forest_engine import ForestEngine
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 6)) * [1, 10, 0.01, 100, 1, 1] + [0, 2000, 0.5, -5, 0, 0]
+    X[:, 4] = rng.integers(0, 12, size=len(X))  # Integer feature, like key or year
+    y = X[:, 0] * 3 + np.sin(X[:, 1]) + (X[:, 4] > 5) + rng.normal(0, 0.1, len(X))
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=12, max_depth=8, random_state=0)
+    model.fit(scaler.transform(X), y)
+    return X, model, scaler
+
+
+def edge_rows(X, feature, thresholds, rng):
+    """Rows of X with one feature set to each threshold and its float64 neighbours"""
+    values = np.concatenate([thresholds, np.nextafter(thresholds, -np.inf),
+                             np.nextafter(thresholds, np.inf)])
+    columns = np.concatenate([feature] * 3)
+    rows = X[rng.integers(0, len(X), size=len(values))].copy()
+    rows[np.arange(len(values)), columns] = values
+    return rows
+
+
+def test_scaler_folded_engine_matches_sklearn(fitted):
+    X, model, scaler = fitted
+    engine = ForestEngine.from_sklearn(model, scaler)
+    internal = np.flatnonzero(np.isfinite(engine.threshold))
+    feature = engine.feature[internal].astype(np.int64)
+    rng = np.random.default_rng(1)
+
+    # Folded raw-space thresholds, and sklearn's scaled thresholds mapped back to raw space
+    scaled = np.concatenate([est.tree_.threshold[est.tree_.children_left >= 0]
+                             for est in model.estimators_])
+    scaled_feature = np.concatenate([est.tree_.feature[est.tree_.children_left >= 0]
+                                     for est in model.estimators_])
+    raw = scaled * scaler.scale_[scaled_feature] + scaler.mean_[scaled_feature]
+    rows = np.vstack([X,
+                      edge_rows(X, feature, engine.threshold[internal], rng),
+                      edge_rows(X, scaled_feature, raw, rng)])
+
+    expected = model.predict(scaler.transform(rows))
+    np.testing.assert_array_equal(engine.predict(rows), expected)
+    for row, value in zip(rows[:50], expected[:50]):
+        assert engine.predict(row)[0] == value
+
+
+def test_scaled_input_engine_matches_sklearn(fitted):
+    X, model, scaler = fitted
+    engine = ForestEngine.from_sklearn(model)
+    internal = np.flatnonzero(np.isfinite(engine.threshold))
+    rng = np.random.default_rng(2)
+
+    rows = np.vstack([scaler.transform(X),
+                      edge_rows(scaler.transform(X), engine.feature[internal].astype(np.int64),
+                                engine.threshold[internal], rng)])
+
+    np.testing.assert_array_equal(engine.predict(rows), model.predict(rows))
@@ -0,0 +1,450 @@
+"""
+Reproducible training of the popularity model outside the notebook
+Successive-halving hyperparameter search with cached preprocessing and per-stage time and memory
+
+Usage:
+    python train_model.py                                  # writes the three .pkl files the app loads
+    python train_model.py --candidates 200 --max-memory-gb 16
+    python train_model.py --resource n_estimators --output-dir models/
+
+Preprocessing is the dataset snapshot's pipeline (dataset_pipeline.py), so
+the model is trained on exactly the rows and encoding the app serves. The
+search space is the notebook's; candidates are evaluated with successive
+halving, so most of them only ever see a fraction of the rows (or trees).
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+from scipy.stats import randint
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import GridSearchCV, KFold, ParameterSampler, train_test_split
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+from dataset_pipeline import (CHUNK_ROWS, COUNT_COLUMNS, MIN_GENRE_COUNT, SongKeySet,
+                              count_genres, prepare_chunks, read_chunks)
+from dataset_snapshot import FEATURE_NAMES, file_sha256
+
+TRAINING_CACHE_VERSION = 1
+TRAINING_CACHE_DIR = 'cache/training'
+
+# The notebook's RandomizedSearchCV space
+PARAM_DISTRIBUTIONS = {
+    'n_estimators': randint(low=50, high=500),
+    'max_depth': randint(low=3, high=20),
+    'min_samples_split': randint(low=2, high=20),
+    'min_samples_leaf': randint(low=1, high=10),
+    'max_features': ['sqrt', 'log2', None],
+    'bootstrap': [True, False],
+}
+MAX_TREES = 500  # Upper end of n_estimators, the resource's maximum with --resource n_estimators
+
+# sklearn tree node (64 bytes) plus its float64 value
+NODE_BYTES = 72
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _process_tree_rss(pid=None):
+    """Resident bytes of a process and all its descendants (Linux /proc), or None"""
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * _PAGE_SIZE
+        children = []
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children += f.read().split()
+    except (OSError, ValueError, IndexError):
+        return None
+    # Pages shared with a parent (e.g. joblib's memmapped data) count in each process
+    return rss + sum(_process_tree_rss(int(child)) or 0 for child in children)
+
+
+class StageRecorder:
+    """
+    Wall time and peak memory per named stage
+
+    Peak memory is the largest resident size of this process plus its
+    worker processes, sampled every sample_interval seconds while a stage
+    runs. Where /proc is not available only ru_maxrss is reported, the
+    high-water mark of the main process since it started.
+    """
+
+    def __init__(self, sample_interval=0.1):
+        self.sample_interval = sample_interval
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        peak = [_process_tree_rss()]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.sample_interval):
+                rss = _process_tree_rss()
+                if rss is not None and (peak[0] is None or rss > peak[0]):
+                    peak[0] = rss
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            done.set()
+            sampler.join()
+            # ru_maxrss is KiB on Linux
+            self.stages[name] = {
+                'seconds': round(seconds, 2),
+                'peak_rss_mib': round(peak[0] / 2 ** 20, 1) if peak[0] is not None else None,
+                'max_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            }
+            print(f"  [{name}] {seconds:.1f}s, peak memory "
+                  f"{self.stages[name]['peak_rss_mib'] or self.stages[name]['max_rss_mib']} MiB")
+
+
+def _cache_key(csv_sha256, test_size, seed):
+    settings = {'version': TRAINING_CACHE_VERSION, 'csv': csv_sha256, 'test_size': test_size,
+                'seed': seed, 'min_genre_count': MIN_GENRE_COUNT, 'features': FEATURE_NAMES}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def prepare_training_data(csv_path, test_size=0.2, seed=42, chunk_rows=CHUNK_ROWS):
+    """
+    Clean, encode and split the dataset the way the snapshot does
+
+    The genre encoder is fit on the genres with at least MIN_GENRE_COUNT
+    rows, then the CSV is streamed through prepare_chunks with it.
+
+    Returns:
+        tuple: (X_train, X_test, y_train, y_test, genres, stats); feature
+            matrices are float32 in FEATURE_NAMES order
+    """
+    genre_counts = count_genres(read_chunks(csv_path, chunk_rows, COUNT_COLUMNS))
+    genres = sorted(genre for genre, n in genre_counts.items() if n >= MIN_GENRE_COUNT)
+    genre_encoder = LabelEncoder().fit(np.array(genres, dtype=object))
+
+    stats = {}
+    X_parts, y_parts = [], []
+    for chunk in prepare_chunks(read_chunks(csv_path, chunk_rows), genres, genre_encoder,
+                                SongKeySet(), stats):
+        X_parts.append(chunk[FEATURE_NAMES].to_numpy(dtype=np.float32))
+        y_parts.append(chunk['popularity'].to_numpy(dtype=np.int8))
+    X, y = np.concatenate(X_parts), np.concatenate(y_parts)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size,
+                                                        random_state=seed)
+    return X_train, X_test, y_train, y_test, genres, stats
+
+
+def load_training_data(csv_path, cache_dir=TRAINING_CACHE_DIR, test_size=0.2, seed=42,
+                       chunk_rows=CHUNK_ROWS):
+    """
+    prepare_training_data through an on-disk cache keyed by the CSV's hash
+
+    The split matrices are saved as .npy files, so a rerun on an unchanged
+    dataset (e.g. to try other search settings) skips both CSV passes.
+
+    Returns:
+        tuple: (X_train, X_test, y_train, y_test, genres, meta), meta holding
+            the pipeline stats and whether the cache was used
+    """
+    key = _cache_key(file_sha256(csv_path), test_size, seed)
+    path = os.path.join(cache_dir, key)
+    names = ('X_train', 'X_test', 'y_train', 'y_test')
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, f'{name}.npy')) for name in names]
+        return (*arrays, meta['genres'], {**meta, 'cached': True})
+    except (OSError, ValueError, KeyError):
+        pass
+
+    *arrays, genres, stats = prepare_training_data(csv_path, test_size, seed, chunk_rows)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    for name, array in zip(names, arrays):
+        np.save(os.path.join(tmp, f'{name}.npy'), array)
+    meta = {'csv': os.path.abspath(csv_path), 'genres': genres, 'stats': stats}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp)  # A concurrent run wrote it first; both copies are identical
+    return (*arrays, genres, {**meta, 'cached': False})
+
+
+def forest_memory_estimate(params, n_samples, n_features, n_trees):
+    """
+    Upper bound on the bytes one RandomForestRegressor fit holds
+
+    Each tree has at most one leaf per min_samples_leaf distinct training
+    rows (63% of them with bootstrap) and at most 2**max_depth leaves; the
+    fit also makes a float32 copy of its rows.
+    """
+    rows = n_samples * (0.632 if params.get('bootstrap', True) else 1.0)
+    leaves = rows / params.get('min_samples_leaf', 1)
+    if params.get('max_depth') is not None:
+        leaves = min(leaves, 2 ** params['max_depth'])
+    nodes = 2 * leaves - 1
+    return int(n_trees * nodes * NODE_BYTES + n_samples * n_features * 4)
+
+
+def memory_capped_jobs(candidates, n_samples, n_features, cv, n_trees, n_jobs, budget_bytes):
+    """
+    Parallel fits that fit in budget_bytes if every job holds the largest candidate
+
+    Args:
+        candidates (list): Parameter dicts fitted in this round
+        n_samples (int): Rows the round fits on, before the CV split
+        n_trees (int): Trees of candidates without an n_estimators setting
+
+    Returns:
+        tuple: (n_jobs, largest per-job estimate in bytes)
+    """
+    fold_rows = int(n_samples * (cv - 1) / cv)
+    largest = max(forest_memory_estimate(params, fold_rows, n_features,
+                                         params.get('n_estimators', n_trees))
+                  for params in candidates)
+    return max(1, min(n_jobs, budget_bytes // max(largest, 1))), largest
+
+
+def halving_schedule(n_candidates, factor, max_resources):
+    """
+    (candidates, resources) per round, as HalvingGridSearchCV's min_resources='exhaust'
+
+    The smallest resource is chosen so the last round, with fewer than
+    factor candidates left, gets (nearly) max_resources.
+    """
+    n_rounds = 1 + int(np.floor(np.log(n_candidates) / np.log(factor) + 1e-9))
+    min_resources = max(1, max_resources // factor ** (n_rounds - 1))
+    schedule = []
+    for i in range(n_rounds):
+        candidates = int(np.ceil(n_candidates / factor ** i))
+        schedule.append((candidates, min(min_resources * factor ** i, max_resources)))
+    return schedule
+
+
+def search_hyperparameters(X, y, n_candidates=100, factor=3, cv=5, resource_name='n_samples',
+                           n_jobs=None, max_memory_bytes=None, seed=42):
+    """
+    Successive-halving search over the notebook's parameter space
+
+    Candidates are drawn up front with ParameterSampler, as
+    HalvingRandomSearchCV does. Each round cross-validates the surviving
+    candidates on its share of the resource (a random sample of training
+    rows, or a number of trees with resource_name='n_estimators') and keeps
+    the best 1/factor of them for the next round, which gets factor times
+    the resource. Rounds run one at a time so the number of parallel fits
+    can be capped from what that round's candidates need at its size: the
+    early rounds on a few thousand rows run fully parallel even when a
+    single fit of the last round needs most of the budget.
+
+    Returns:
+        tuple: (best params, search report dict)
+    """
+    space = dict(PARAM_DISTRIBUTIONS)
+    if resource_name == 'n_estimators':
+        del space['n_estimators']
+    candidates = list(ParameterSampler(space, n_candidates, random_state=seed))
+    max_jobs = n_jobs or os.cpu_count() or 1
+    max_resources = MAX_TREES if resource_name == 'n_estimators' else len(X)
+    rng = np.random.default_rng(seed)
+
+    iterations = []
+    for round_index, (_, resources) in enumerate(halving_schedule(len(candidates), factor,
+                                                                  max_resources)):
+        if resource_name == 'n_estimators':
+            round_params = [{**params, 'n_estimators': resources} for params in candidates]
+            X_round, y_round = X, y
+        else:
+            round_params = candidates
+            rows = (np.sort(rng.choice(len(X), resources, replace=False))
+                    if resources < len(X) else slice(None))
+            X_round, y_round = X[rows], y[rows]
+
+        jobs = min(max_jobs, len(round_params) * cv)
+        per_fit = None
+        if max_memory_bytes:
+            jobs, per_fit = memory_capped_jobs(round_params, len(X_round), X.shape[1], cv,
+                                               MAX_TREES, jobs, max_memory_bytes)
+            if per_fit > max_memory_bytes:
+                print(f"Warning: one fit may need {per_fit / 2 ** 30:.2f} GiB, more than the "
+                      f"{max_memory_bytes / 2 ** 30:.2f} GiB budget; running fits one at a time")
+        print(f"Round {round_index + 1}: {len(round_params)} candidates on {resources:,} "
+              f"{'trees' if resource_name == 'n_estimators' else 'rows'}, {jobs} parallel fits"
+              + (f" (up to {per_fit / 2 ** 30:.2f} GiB each)" if per_fit is not None else ''))
+
+        start = time.perf_counter()
+        search = GridSearchCV(
+            RandomForestRegressor(random_state=seed, n_jobs=1),
+            param_grid=[{name: [value] for name, value in params.items()}
+                        for params in round_params],
+            cv=KFold(cv, shuffle=True, random_state=seed),
+            scoring='neg_root_mean_squared_error', refit=False, n_jobs=jobs)
+        search.fit(X_round, y_round)
+        scores = search.cv_results_['mean_test_score']
+        iterations.append({'candidates': len(round_params), 'resources': int(resources),
+                           'n_jobs': int(jobs),
+                           'max_fit_gib': round(per_fit / 2 ** 30, 3) if per_fit else None,
+                           'best_cv_rmse': round(-float(scores.max()), 4),
+                           'seconds': round(time.perf_counter() - start, 2)})
+
+        # Best first; ties keep the earlier candidate
+        order = np.argsort(-scores, kind='stable')
+        best_score, best_params = float(scores[order[0]]), dict(round_params[order[0]])
+        keep = int(np.ceil(len(candidates) / factor))
+        candidates = [candidates[i] for i in order[:keep]]
+
+    report = {
+        'resource': resource_name,
+        'factor': factor,
+        'cv': cv,
+        'iterations': iterations,
+        'fits': int(sum(it['candidates'] * cv for it in iterations)),
+        'best_cv_rmse': round(-best_score, 4),
+        'best_params': {k: (v.item() if hasattr(v, 'item') else v) for k, v in best_params.items()},
+    }
+    return best_params, report
+
+
+def save_artifacts(artifacts, output_dir):
+    """
+    Write {file name: object} pickles and move them into place together
+
+    Every pickle is dumped into a temporary directory next to the outputs
+    first, so the slow part (a large forest takes seconds) happens before
+    any file the app loads changes. The renames then follow each other
+    within milliseconds, and the app's FileWatcher only reloads once the
+    files have stayed unchanged over two checks, so it never pairs a new
+    scaler with the old model.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_dir = os.path.join(output_dir, f'.train-{os.getpid()}')
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        for name, obj in artifacts.items():
+            joblib.dump(obj, os.path.join(tmp_dir, name))
+        for name in artifacts:
+            os.replace(os.path.join(tmp_dir, name), os.path.join(output_dir, name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def train(csv_path='data/spotify_data.csv', output_dir='.', cache_dir=TRAINING_CACHE_DIR,
+          n_candidates=100, factor=3, cv=5, resource_name='n_samples', n_jobs=None,
+          max_memory_gb=None, test_size=0.2, seed=42):
+    """
+    Prepare the data, search, refit the best forest and write the .pkl files
+
+    Returns:
+        dict: Training report (search rounds, test metrics and per-stage time and memory)
+    """
+    recorder = StageRecorder()
+    if max_memory_gb is None:
+        # Default to half of physical memory
+        max_memory_bytes = os.sysconf('SC_PHYS_PAGES') * _PAGE_SIZE // 2
+    else:
+        max_memory_bytes = int(max_memory_gb * 2 ** 30)
+
+    print(f"Preparing {csv_path}")
+    with recorder.stage('prepare'):
+        X_train, X_test, y_train, y_test, genres, data_meta = load_training_data(
+            csv_path, cache_dir, test_size, seed)
+    print(f"{len(X_train):,} training and {len(X_test):,} test rows, {len(genres)} genres"
+          f"{' (cached)' if data_meta['cached'] else ''}")
+
+    with recorder.stage('scale'):
+        genre_encoder = LabelEncoder().fit(np.array(genres, dtype=object))
+        scaler = StandardScaler()
+        X_train_scaled = scaler.fit_transform(X_train.astype(np.float64))
+        X_test_scaled = scaler.transform(X_test.astype(np.float64))
+
+    print(f"Searching {n_candidates} candidates by successive halving over {resource_name}")
+    with recorder.stage('search'):
+        best_params, search_report = search_hyperparameters(
+            X_train_scaled, y_train, n_candidates, factor, cv, resource_name, n_jobs,
+            max_memory_bytes, seed)
+    print(f"Best CV RMSE {search_report['best_cv_rmse']} with {search_report['best_params']}")
+
+    with recorder.stage('refit'):
+        model = RandomForestRegressor(random_state=seed, n_jobs=n_jobs or -1, **best_params)
+        model.fit(X_train_scaled, y_train)
+
+    with recorder.stage('evaluate'):
+        predictions = model.predict(X_test_scaled)
+        test_metrics = {'rmse': round(float(np.sqrt(mean_squared_error(y_test, predictions))), 4),
+                        'r2': round(float(r2_score(y_test, predictions)), 4)}
+        model.n_jobs = None  # The app predicts with the default
+    print(f"Test RMSE {test_metrics['rmse']}, R² {test_metrics['r2']}")
+
+    with recorder.stage('save'):
+        save_artifacts({'spotify_genre_encoder.pkl': genre_encoder,
+                        'spotify_scaler.pkl': scaler,
+                        'spotify_popularity_model.pkl': model}, output_dir)
+
+    report = {
+        'csv': os.path.abspath(csv_path),
+        'rows': {'train': len(X_train), 'test': len(X_test)},
+        'genres': genres,
+        'pipeline_stats': data_meta['stats'],
+        'preprocessing_cached': data_meta['cached'],
+        'search': search_report,
+        'test': test_metrics,
+        'feature_importance': dict(zip(FEATURE_NAMES, np.round(model.feature_importances_, 4)
+                                       .tolist())),
+        'stages': recorder.stages,
+        'total_seconds': round(sum(s['seconds'] for s in recorder.stages.values()), 2),
+        'max_memory_gb': round(max_memory_bytes / 2 ** 30, 2),
+    }
+    with open(os.path.join(output_dir, 'training_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the popularity model and write its .pkl files')
+    parser.add_argument('--csv', default='data/spotify_data.csv')
+    parser.add_argument('--output-dir', default='.', help='Where the .pkl files and report go')
+    parser.add_argument('--cache-dir', default=TRAINING_CACHE_DIR,
+                        help='Cache of the cleaned, split feature matrices')
+    parser.add_argument('--candidates', type=int, default=100,
+                        help='Hyperparameter candidates drawn from the search space')
+    parser.add_argument('--factor', type=int, default=3,
+                        help='Each round keeps 1/factor of the candidates')
+    parser.add_argument('--cv', type=int, default=5, help='Cross-validation folds')
+    parser.add_argument('--resource', choices=['n_samples', 'n_estimators'], default='n_samples',
+                        help='What grows from round to round: training rows or trees')
+    parser.add_argument('-j', '--n-jobs', type=int, default=None,
+                        help='Parallel fits (default: CPU count, lowered to fit --max-memory-gb)')
+    parser.add_argument('--max-memory-gb', type=float, default=None,
+                        help='Memory budget for parallel fits (default: half of physical memory)')
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    report = train(args.csv, args.output_dir, args.cache_dir, args.candidates, args.factor,
+                   args.cv, args.resource, args.n_jobs, args.max_memory_gb, args.test_size,
+                   args.seed)
+    print(f"\nTrained in {report['total_seconds']}s; wrote the model, scaler and encoder to "
+          f"{os.path.abspath(args.output_dir)}/")
+    for name, stage in report['stages'].items():
+        memory = stage['peak_rss_mib'] if stage['peak_rss_mib'] is not None else stage['max_rss_mib']
+        print(f"  {name:<9} {stage['seconds']:>8.1f}s  {memory:>8.0f} MiB")
+    print("Rebuild the forest engine (forest_engine.py) and rescore the catalog "
+          "(catalog_scores.py) for the new model")
+
+
+if __name__ == "__main__":
+    main()